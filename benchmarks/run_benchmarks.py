@@ -0,0 +1,227 @@
+"""
+Benchmark suite for the torus analysis kernels.
+
+Usage:
+    python benchmarks/run_benchmarks.py run --output results.json
+    python benchmarks/run_benchmarks.py compare baseline.json results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import calculate_torus_stresses
+from modules import advanced_calculations, composite_analysis, fem_3d_analysis
+from modules.real_world_examples import examples
+
+# Problem sizes per preset, one list per benchmark parameter
+sizes = {
+    'small': {'grid': [50, 100], 'mesh': [8, 12], 'samples': [500, 1000], 'time_span': [1, 10], 'layers': [4, 16]},
+    'medium': {'grid': [100, 300], 'mesh': [12, 20], 'samples': [1000, 5000], 'time_span': [10, 50], 'layers': [16, 64]},
+    'large': {'grid': [300, 1000], 'mesh': [20, 32], 'samples': [5000, 20000], 'time_span': [50, 200], 'layers': [64, 256]}
+}
+
+def example_params(index=0):
+    """Fixed inputs (R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T) from a real-world example"""
+    return examples[index]['params']
+
+def bench_torus_stresses(n):
+    params = example_params()
+    theta, phi = np.meshgrid(np.linspace(0, 2*np.pi, n), np.linspace(0, 2*np.pi, n))
+    def run():
+        calculate_torus_stresses(*params, theta, phi)
+    return run, n*n, 'points'
+
+def bench_fem_assemble(n):
+    R, r, t, E, nu, p_int, p_ext = example_params()[:7]
+    nodes, elements = fem_3d_analysis.generate_torus_mesh(R, r, t, n)
+    def run():
+        fem_3d_analysis.assemble_system(nodes, elements, E, nu, p_int, p_ext)
+    return run, len(elements), 'elements'
+
+def bench_fem_solve(n):
+    R, r, t, E, nu, p_int, p_ext = example_params()[:7]
+    nodes, elements = fem_3d_analysis.generate_torus_mesh(R, r, t, n)
+    K, F = fem_3d_analysis.assemble_system(nodes, elements, E, nu, p_int, p_ext)
+    fixed_dofs = fem_3d_analysis.rigid_body_constraints(nodes)
+    def run():
+        fem_3d_analysis.solve_system(K, F, fixed_dofs)
+    return run, K.shape[0], 'dofs'
+
+def bench_fem_recovery(n):
+    R, r, t, E, nu, p_int, p_ext = example_params()[:7]
+    nodes, elements = fem_3d_analysis.generate_torus_mesh(R, r, t, n)
+    K, F = fem_3d_analysis.assemble_system(nodes, elements, E, nu, p_int, p_ext)
+    U = fem_3d_analysis.solve_system(K, F, fem_3d_analysis.rigid_body_constraints(nodes))
+    def run():
+        fem_3d_analysis.post_process(nodes, elements, U, E, nu)
+        fem_3d_analysis.recover_nodal_stresses(nodes, elements, U, E, nu)
+    return run, len(elements), 'elements'
+
+def bench_fem_cyclic(n, n_sectors=4):
+    R, r, t, E, nu, p_int, p_ext = example_params()[:7]
+    def run():
+        fem_3d_analysis.cyclic_symmetry_analysis(R, r, t, E, nu, p_int, p_ext, n, n_sectors)
+    return run, 3 * 3*n*n, 'ring dofs'
+
+def bench_probabilistic(n_samples):
+    params = example_params()
+    R, r, t, E, nu, p_int, p_ext = params[:7]
+    uncertainties = {'R': 0.01*R, 'r': 0.01*r, 't': 0.05*t, 'E': 0.05*E, 'nu': 0.01,
+                     'p_int': 0.1*p_int, 'p_ext': 0.1*p_ext, 'yield_stress': 250e6}
+    def run():
+        np.random.seed(0)
+        advanced_calculations.probabilistic_analysis(*params, uncertainties, n_samples=n_samples)
+    return run, n_samples, 'samples'
+
+def bench_sobol(n_samples):
+    params = example_params()
+    R, r, t, E, nu, p_int, p_ext = params[:7]
+    uncertainties = {'R': 0.01*R, 'r': 0.01*r, 't': 0.05*t, 'E': 0.05*E, 'nu': 0.01,
+                     'p_int': 0.1*p_int, 'p_ext': 0.1*p_ext}
+    def run():
+        advanced_calculations.sobol_analysis(*params, uncertainties, n_samples=n_samples, seed=0)
+    return run, n_samples * 9, 'evaluations'
+
+def bench_dynamic_stress(time_span):
+    R, r, t, E = example_params()[:4]
+    def run():
+        advanced_calculations.dynamic_stress_analysis(R, r, t, E, 7850, 100, (0, time_span))
+    return run, time_span, 'seconds simulated'
+
+def bench_laminate(n_layers):
+    angles = np.resize([0, 45, -45, 90], n_layers)
+    layers = [[0.125e-3, angle, 140e9, 10e9, 5e9, 0.3] for angle in angles]
+    def run():
+        composite_analysis.laminate_analysis(layers)
+    return run, n_layers, 'layers'
+
+benchmarks = {
+    'torus_stresses': (bench_torus_stresses, 'grid'),
+    'fem_assemble': (bench_fem_assemble, 'mesh'),
+    'fem_solve': (bench_fem_solve, 'mesh'),
+    'fem_recovery': (bench_fem_recovery, 'mesh'),
+    'fem_cyclic': (bench_fem_cyclic, 'mesh'),
+    'probabilistic': (bench_probabilistic, 'samples'),
+    'sobol': (bench_sobol, 'samples'),
+    'dynamic_stress': (bench_dynamic_stress, 'time_span'),
+    'laminate': (bench_laminate, 'layers')
+}
+
+def measure(run, repeats):
+    """Best and median wall time over repeats, then peak traced memory of one extra call"""
+    run()  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+def run_benchmarks(preset='small', only=None, repeats=5):
+    results = []
+    for name, (setup, parameter) in benchmarks.items():
+        if only and name not in only:
+            continue
+        for size in sizes[preset][parameter]:
+            run, work, unit = setup(size)
+            best, median, peak = measure(run, repeats)
+            results.append({
+                'name': name,
+                'parameter': parameter,
+                'size': size,
+                'wall_time': best,
+                'wall_time_median': median,
+                'peak_memory': peak,
+                'throughput': work / best,
+                'unit': unit
+            })
+            print(f"{name:16s} {parameter + '=' + str(size):16s} {best*1e3:10.3f} ms  {peak/2**20:8.2f} MiB  {work/best:12.4g} {unit}/s")
+
+    return {
+        'metadata': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'preset': preset,
+            'repeats': repeats,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()
+        },
+        'results': results
+    }
+
+def compare_results(baseline, current, threshold=0.1):
+    """Pair results by (name, size) and flag those slower than baseline by more than threshold"""
+    reference = {(entry['name'], entry['size']): entry for entry in baseline['results']}
+    regressions = []
+    print(f"{'benchmark':16s} {'size':>6s} {'baseline ms':>12s} {'current ms':>12s} {'ratio':>7s}")
+    for entry in current['results']:
+        key = (entry['name'], entry['size'])
+        if key not in reference:
+            continue
+        ratio = entry['wall_time'] / reference[key]['wall_time']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append({'name': entry['name'], 'size': entry['size'], 'ratio': ratio})
+        print(f"{entry['name']:16s} {entry['size']:>6} {reference[key]['wall_time']*1e3:12.3f} {entry['wall_time']*1e3:12.3f} {ratio:7.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the torus analysis kernels")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks and write JSON results")
+    run_parser.add_argument('--preset', choices=sizes, default='small')
+    run_parser.add_argument('--only', nargs='+', choices=benchmarks, help="benchmarks to run (default: all)")
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--baseline', help="compare against this results file after running")
+    run_parser.add_argument('--threshold', type=float, default=0.1)
+
+    compare_parser = subparsers.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="relative slowdown reported as a regression (default: 0.1)")
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        current = run_benchmarks(args.preset, args.only, args.repeats)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+        baseline_path = args.baseline
+    else:
+        with open(args.current) as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import numpy as np
 # Constants
 G = 9.81  # Gravitational acceleration (m/s^2)
 
-def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi):
+def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi, alpha=12e-6):
     # Calculate stresses using advanced thin-walled torus theory
     r_m = r + t/2  # Mean radius
     A = 2 * np.pi * r_m * t  # Cross-sectional area
@@ -24,8 +24,7 @@ def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M
     sigma_z = F_z / A
     tau_xy = M_x * r_m / J
 
-    # Thermal stress
-    alpha = 12e-6  # Thermal expansion coefficient (example value for steel)
+    # Thermal stress (alpha defaults to the expansion coefficient of steel)
     sigma_thermal = -E * alpha * T / (1 - nu)
 
     # Combine stresses
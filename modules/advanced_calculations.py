@@ -1,9 +1,16 @@
+import functools
 import numpy as np
-from scipy.integrate import odeint, solve_ivp
+from scipy.integrate import RK45, odeint, solve_ivp
 from scipy.optimize import fsolve, minimize
 from scipy.interpolate import interp1d
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from scipy.sparse import coo_matrix, diags, identity, kron
+from scipy.sparse.linalg import factorized
 from scipy.stats import norm
 import sympy as sp
+from main import calculate_torus_stresses
+from modules.checkpoint import Checkpointer, legacy_rng_state, restore_legacy_rng_state
+from modules.instrumentation import count, report, span, traced
 
 def advanced_stress_tensor(sigma_vm, sigma_phi, sigma_theta, tau_xy, tau_yz, tau_xz):
     """Calculate the full 3D stress tensor with all components"""
@@ -53,26 +60,184 @@ def non_linear_material_model(strain, E, yield_stress, n, C, gamma):
         stress += C * (1 - np.exp(-gamma * (strain - yield_stress / E)))
     return stress
 
-def thermal_stress_analysis(R, r, t, E, alpha, k, T_inner, T_outer, q):
+def radial_temperature_profile(r_in, r_out, T_inner, T_outer, q, k, n_points=100):
+    """Closed-form wall temperature for both wall temperatures, broadcast over cases"""
+    # (rho T')' = -q/k  =>  T = -q rho / k + C1 ln(rho) + C2
+    rho = np.linspace(r_in, r_out, n_points)
+    T_inner, T_outer, q, k = (np.asarray(v, dtype=float)[..., np.newaxis] for v in (T_inner, T_outer, q, k))
+    C1 = (T_outer - T_inner + q * (r_out - r_in) / k) / np.log(r_out / r_in)
+    C2 = T_inner + q * r_in / k - C1 * np.log(r_in)
+    return rho, -q * rho / k + C1 * np.log(rho) + C2
+
+def solve_tridiagonal_batch(lower, diag, upper, rhs):
+    """Thomas algorithm vectorized over leading dimensions; all arrays are (..., n)"""
+    n = diag.shape[-1]
+    c = np.empty(np.broadcast(lower, diag, upper, rhs).shape)
+    d = np.empty_like(c)
+    c[..., 0] = upper[..., 0] / diag[..., 0]
+    d[..., 0] = rhs[..., 0] / diag[..., 0]
+    for i in range(1, n):
+        denom = diag[..., i] - lower[..., i] * c[..., i-1]
+        c[..., i] = upper[..., i] / denom
+        d[..., i] = (rhs[..., i] - lower[..., i] * d[..., i-1]) / denom
+    x = np.empty_like(d)
+    x[..., -1] = d[..., -1]
+    for i in range(n-2, -1, -1):
+        x[..., i] = d[..., i] - c[..., i] * x[..., i+1]
+    return x
+
+def solve_radial_conduction(r_in, r_out, T_inner, T_outer, q, k, n_points=100):
+    """
+    Finite-difference wall temperature for many (T_inner, T_outer, q, k) cases at once.
+    k may vary through the wall, shape (..., n_points); all cases share one
+    batched tridiagonal solve.
+    """
+    rho = np.linspace(r_in, r_out, n_points)
+    h = rho[1] - rho[0]
+    T_inner, T_outer, q = (np.asarray(v, dtype=float) for v in (T_inner, T_outer, q))
+    k = np.asarray(k, dtype=float)
+    if k.ndim == 0 or k.shape[-1] != n_points:
+        k = k[..., np.newaxis]
+    shape = np.broadcast(T_inner[..., np.newaxis], T_outer[..., np.newaxis], q[..., np.newaxis], k).shape[:-1] + (n_points,)
+
+    # d/drho(rho k dT/drho) = -q with conductance evaluated at the cell faces
+    k = np.broadcast_to(k, shape)
+    rho_k = rho * k
+    w = (rho_k[..., 1:] + rho_k[..., :-1]) / 2
+    lower = np.zeros(shape)
+    upper = np.zeros(shape)
+    diag = np.ones(shape)
+    rhs = np.zeros(shape)
+    lower[..., 1:-1] = w[..., :-1]
+    upper[..., 1:-1] = w[..., 1:]
+    diag[..., 1:-1] = -(w[..., :-1] + w[..., 1:])
+    rhs[..., 1:-1] = -q[..., np.newaxis] * h**2
+    rhs[..., 0] = T_inner
+    rhs[..., -1] = T_outer
+
+    return rho, solve_tridiagonal_batch(lower, diag, upper, rhs)
+
+def thermal_stress_analysis(R, r, t, E, alpha, k, T_inner, T_outer, q, nu=0.3, n_points=100):
     """Calculate thermal stresses with heat transfer considerations"""
-    # Solve heat conduction equation
-    def heat_equation(r, T):
-        return [T[1], -T[1]/r - q/(k*r)]
-    
-    r_span = [r - t/2, r + t/2]
-    bc = [(1, T_inner), (2, T_outer)]
-    sol = solve_ivp(heat_equation, r_span, [T_inner, 0], dense_output=True, events=None, vectorized=True)
-    
-    T_distribution = sol.sol(np.linspace(r - t/2, r + t/2, 100))
+    # Solve heat conduction equation with both wall temperatures as boundary conditions
+    if np.ndim(k) > 0 and np.shape(k)[-1] == n_points:
+        _, T_distribution = solve_radial_conduction(r - t/2, r + t/2, T_inner, T_outer, q, k, n_points)
+    else:
+        _, T_distribution = radial_temperature_profile(r - t/2, r + t/2, T_inner, T_outer, q, k, n_points)
     
     # Calculate thermal stresses
-    sigma_thermal_hoop = E * alpha * (T_distribution - np.mean(T_distribution)) / (1 - nu)
-    sigma_thermal_radial = E * alpha * (T_distribution - np.mean(T_distribution))
+    T_mean = np.mean(T_distribution, axis=-1, keepdims=True)
+    sigma_thermal_hoop = E * alpha * (T_distribution - T_mean) / (1 - nu)
+    sigma_thermal_radial = E * alpha * (T_distribution - T_mean)
     
     return sigma_thermal_hoop, sigma_thermal_radial, T_distribution
 
-def dynamic_stress_analysis(R, r, t, E, rho, omega, time_span):
-    """Calculate dynamic stresses due to rotation and vibration"""
+def transient_thermal_analysis(R, r, t, E, alpha, k, rho, c_p, T_inner, T_outer, time_span, n_steps, nu=0.3, T_initial=0.0, n_points=50, n_meridional=1):
+    """
+    Transient through-thickness (and optionally meridional) heat conduction
+    with Crank-Nicolson time stepping.
+
+    T_inner and T_outer are constants or callables of time returning a scalar
+    or one value per meridional station. The system matrix is factored once
+    (banded Cholesky for the 1D wall, sparse LU when meridional conduction is
+    included) and reused every step. Only the peak thermal stress is kept per
+    step; returns (time, peak_stress_history, T_final).
+    """
+    rho_r = np.linspace(r - t/2, r + t/2, n_points)
+    h = rho_r[1] - rho_r[0]
+    n_int = n_points - 2
+    time = np.linspace(time_span[0], time_span[1], n_steps + 1)
+    dt = time[1] - time[0]
+
+    def wall_temperature(T_wall, at):
+        value = T_wall(at) if callable(T_wall) else T_wall
+        return np.broadcast_to(np.asarray(value, dtype=float), (n_meridional,))
+
+    # Finite-volume mass (diagonal) and symmetric conductance matrices for the interior nodes
+    mass = rho * c_p * rho_r[1:-1] * h
+    w = k * (rho_r[1:] + rho_r[:-1]) / 2 / h
+    K_diag = w[:-1] + w[1:]
+    K_off = -w[1:-1]
+
+    if n_meridional == 1:
+        ab = np.zeros((2, n_int))
+        ab[0, 1:] = dt/2 * K_off
+        ab[1] = mass + dt/2 * K_diag
+        factor = cholesky_banded(ab)
+        solve = lambda rhs: cho_solve_banded((factor, False), rhs)
+
+        def apply_rhs(T):
+            out = (mass - dt/2 * K_diag) * T
+            out[:-1] -= dt/2 * K_off * T[1:]
+            out[1:] -= dt/2 * K_off * T[:-1]
+            return out
+    else:
+        # Meridional conduction couples stations around the tube (periodic)
+        d_phi = 2*np.pi / n_meridional
+        w_m = k * h / (rho_r[1:-1] * d_phi**2)
+        radial = diags([np.tile(np.append(K_off, 0), n_meridional)[:-1], np.tile(K_diag, n_meridional), np.tile(np.append(K_off, 0), n_meridional)[:-1]], [-1, 0, 1])
+        station = np.arange(n_meridional)
+        neighbour = coo_matrix((np.ones(n_meridional), (station, (station + 1) % n_meridional)), shape=(n_meridional, n_meridional))
+        ring = 2 * identity(n_meridional) - neighbour - neighbour.T
+        K = (radial + kron(ring, diags(w_m))).tocsc()
+        M = diags(np.tile(mass, n_meridional))
+        solve_flat = factorized((M + dt/2 * K).tocsc())
+        B = (M - dt/2 * K).tocsr()
+        solve = lambda rhs: solve_flat(rhs.ravel()).reshape(rhs.shape)
+        apply_rhs = lambda T: (B @ T.ravel()).reshape(T.shape)
+
+    weights = rho_r / np.sum(rho_r)
+
+    def peak_stress(T_full):
+        T_mean = np.sum(T_full * weights, axis=-1, keepdims=True)
+        return np.max(np.abs(E * alpha * (T_full - T_mean) / (1 - nu)))
+
+    T = np.broadcast_to(np.asarray(T_initial, dtype=float), (n_meridional, n_points)).copy()
+    T_in, T_out = wall_temperature(T_inner, time[0]), wall_temperature(T_outer, time[0])
+    T[:, 0], T[:, -1] = T_in, T_out
+    T_int = T[:, 1:-1].copy()
+    if n_meridional == 1:
+        T_int = T_int[0]
+
+    peak_history = np.empty(n_steps + 1)
+    peak_history[0] = peak_stress(T)
+
+    for n in range(n_steps):
+        T_in_next, T_out_next = wall_temperature(T_inner, time[n+1]), wall_temperature(T_outer, time[n+1])
+        rhs = apply_rhs(T_int)
+        # Dirichlet wall nodes, averaged over the step
+        boundary = np.zeros((n_meridional, n_int))
+        boundary[:, 0] += dt/2 * w[0] * (T_in + T_in_next)
+        boundary[:, -1] += dt/2 * w[-1] * (T_out + T_out_next)
+        T_int = solve(rhs + (boundary[0] if n_meridional == 1 else boundary))
+
+        T[:, 1:-1] = T_int
+        T[:, 0], T[:, -1] = T_in_next, T_out_next
+        T_in, T_out = T_in_next, T_out_next
+        peak_history[n+1] = peak_stress(T)
+    count('transient_thermal.steps', n_steps)
+
+    return time, peak_history, T[0] if n_meridional == 1 else T
+
+def through_thickness_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T_distribution, theta, phi):
+    """
+    Torus stresses at every point of a through-thickness temperature profile.
+    Returns von Mises, hoop and meridional stresses of shape (n_points,) + grid shape.
+    """
+    T_profile = np.asarray(T_distribution, dtype=float)
+    T_profile = T_profile.reshape(T_profile.shape + (1,) * np.ndim(np.broadcast(theta, phi)))
+    return calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T_profile, theta, phi)
+
+def dynamic_stress_analysis(R, r, t, E, rho, omega, time_span, checkpoint=None, checkpoint_interval=60.0):
+    """
+    Calculate dynamic stresses due to rotation and vibration.
+
+    The equations of motion are integrated with RK45 step by step, exactly as
+    solve_ivp would, so that the integrator state (time, state vector and
+    step size) and the output so far can be saved every checkpoint_interval
+    seconds to the optional .npz path checkpoint. A run finding a checkpoint
+    for the same inputs resumes from it with bit-identical results.
+    """
     # Natural frequencies
     n = 2  # Number of modes to consider
     freq = np.sqrt(E / (rho * R**2)) * np.arange(1, n+1)
@@ -88,72 +253,390 @@ def dynamic_stress_analysis(R, r, t, E, rho, omega, time_span):
         acceleration = -freq**2 * displacement - 2 * omega * velocity
         return np.concatenate([velocity, acceleration])
     
-    sol = solve_ivp(eom, time_span, np.zeros(2*n), t_eval=np.linspace(time_span[0], time_span[1], 1000))
+    t_start, t_end = map(float, time_span)
+    t_eval = np.linspace(time_span[0], time_span[1], 1000)
+    checkpointer = Checkpointer(checkpoint, 'dynamic_stress_analysis', (R, r, t, E, rho, omega, time_span), checkpoint_interval)
+    state = checkpointer.load()
+    if state is None:
+        solver = RK45(eom, t_start, np.zeros(2*n), t_end)
+        t_eval_i, ys = 0, [np.empty((2*n, 0))]
+    else:
+        # RK45 only carries the step size between steps; its derivative is recomputed from (t, y)
+        solver = RK45(eom, float(state['t']), state['y'], t_end, first_step=min(float(state['h_abs']), abs(t_end - float(state['t']))))
+        solver.h_abs = float(state['h_abs'])
+        t_eval_i, ys = int(state['t_eval_i']), [state['ys']]
+    
+    while solver.status == 'running':
+        if checkpointer.due():
+            checkpointer.save(t=solver.t, y=solver.y, h_abs=solver.h_abs, t_eval_i=t_eval_i, ys=np.hstack(ys))
+        solver.step()
+        if solver.status == 'failed':
+            raise RuntimeError(f"Integration failed at t = {solver.t}")
+        # Output points up to and including the new time, from the step's dense output
+        if solver.direction > 0:
+            t_eval_i_new = np.searchsorted(t_eval, solver.t, side='right')
+            t_eval_step = t_eval[t_eval_i:t_eval_i_new]
+        else:
+            t_eval_i_new = np.searchsorted(t_eval, solver.t, side='left')
+            t_eval_step = t_eval[t_eval_i_new:t_eval_i][::-1]
+        if t_eval_step.size > 0:
+            ys.append(solver.dense_output()(t_eval_step))
+            t_eval_i = t_eval_i_new
+    checkpointer.finish()
+    count('dynamic.steps', solver.nfev)
+    sol_t, sol_y = t_eval, np.hstack(ys)
     
     # Calculate stresses
     theta = np.linspace(0, 2*np.pi, 100)
-    stress = np.zeros((len(sol.t), len(theta)))
-    for i, t in enumerate(sol.t):
+    stress = np.zeros((len(sol_t), len(theta)))
+    for i, t in enumerate(sol_t):
         for j in range(n):
-            stress[i] += E * r / R**2 * sol.y[j][i] * mode_shape(theta, j+1)
+            stress[i] += E * r / R**2 * sol_y[j][i] * mode_shape(theta, j+1)
     
-    return stress, sol.t, theta
+    return stress, sol_t, theta
+
+def geometry_factor(a, Y):
+    """Geometry factor as a constant or from a precomputed (a_table, Y_table) interpolation table"""
+    if isinstance(Y, tuple):
+        a_table, Y_table = Y
+        return np.interp(a, a_table, Y_table)
+    return Y
+
+def critical_crack_length(K_IC, sigma_max, Y, a_min=1e-9, tol=1e-10, max_iter=200):
+    """
+    Crack length at which K_max reaches K_IC, broadcast over arrays.
+    Closed form for a constant Y; vectorized bisection in log(a) over the
+    table range for a crack-size-dependent Y. Entries whose K_max does not
+    cross K_IC inside the table (already critical at its first crack length,
+    or still below K_IC at its last) are nan, since the table cannot place
+    their critical length.
+    """
+    if not isinstance(Y, tuple):
+        return (K_IC / (Y * sigma_max * np.sqrt(np.pi)))**2
+
+    a_table = Y[0]
+    K_IC, sigma_max = np.broadcast_arrays(np.asarray(K_IC, dtype=float), np.asarray(sigma_max, dtype=float))
+    lo = np.full(K_IC.shape, np.log(max(a_min, a_table[0])))
+    hi = np.full(K_IC.shape, np.log(a_table[-1]))
+
+    def stress_intensity(log_a):
+        a = np.exp(log_a)
+        return geometry_factor(a, Y) * sigma_max * np.sqrt(np.pi * a)
+
+    bracketed = (stress_intensity(lo) < K_IC) & (stress_intensity(hi) >= K_IC)
+    for _ in range(max_iter):
+        mid = (lo + hi) / 2
+        above = stress_intensity(mid) >= K_IC
+        lo = np.where(above, lo, mid)
+        hi = np.where(above, mid, hi)
+        if np.all(hi - lo <= tol):
+            break
+    return np.where(bracketed, np.exp(hi), np.nan)
+
+def crack_growth_life(a0, delta_sigma, K_IC, C, m, Y=1.0, sigma_max=None, n_steps=200, return_history=False):
+    """
+    Paris-law cycles to critical crack length for many cases at once.
+
+    All arguments broadcast. With a constant Y the life follows in closed form;
+    with a (a_table, Y_table) geometry factor the cycle count is integrated
+    with a vectorized fixed-step RK4 in log(a) from a0 to a_crit, so the
+    critical-size event is the integration end point. sigma_max defaults to
+    delta_sigma (zero stress ratio). Returns (a_crit, N_f), plus the (N, a)
+    histories of shape (..., n_steps + 1) when return_history is set. Cases
+    whose critical length lies outside the Y table get nan for all of these.
+    """
+    if sigma_max is None:
+        sigma_max = delta_sigma
+    a0, delta_sigma, K_IC, C, m, sigma_max = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (a0, delta_sigma, K_IC, C, m, sigma_max)))
+
+    a_crit = critical_crack_length(K_IC, sigma_max, Y)
+    a_end = np.maximum(a_crit, a0)
+    # The closed form only needs the end point unless the history is requested
+    if isinstance(Y, tuple) or return_history:
+        x = np.linspace(0, 1, n_steps + 1)
+    else:
+        x = np.ones(1)
+    a_hist = a0[..., np.newaxis] * (a_end / a0)[..., np.newaxis]**x
+
+    if not isinstance(Y, tuple):
+        # N(a) = (a0^(1-m/2) - a^(1-m/2)) / ((m/2 - 1) C (Y dS sqrt(pi))^m), log form for m = 2
+        coeff = C * (Y * delta_sigma * np.sqrt(np.pi))**m
+        exponent = 1 - m/2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            power_law = (a_hist**exponent[..., np.newaxis] - a0[..., np.newaxis]**exponent[..., np.newaxis]) / (exponent * coeff)[..., np.newaxis]
+        log_law = np.log(a_hist / a0[..., np.newaxis]) / coeff[..., np.newaxis]
+        N_hist = np.where(np.isclose(m, 2)[..., np.newaxis], log_law, power_law)
+    else:
+        def dN_dlna(a):
+            return a / (C[..., np.newaxis] * (geometry_factor(a, Y) * delta_sigma[..., np.newaxis] * np.sqrt(np.pi * a))**m[..., np.newaxis])
+
+        log_a = np.log(a_hist)
+        h = np.log(a_end / a0)[..., np.newaxis] / n_steps
+        # RK4 for a quadrature reduces to Simpson's rule on each step
+        f_start = dN_dlna(a_hist[..., :-1])
+        f_mid = dN_dlna(np.exp(log_a[..., :-1] + h/2))
+        f_end = dN_dlna(a_hist[..., 1:])
+        increments = h/6 * (f_start + 4*f_mid + f_end)
+        N_hist = np.concatenate((np.zeros(a0.shape + (1,)), np.cumsum(increments, axis=-1)), axis=-1)
+
+    N_f = N_hist[..., -1]
+    if return_history:
+        return a_crit, N_f, N_hist, a_hist
+    return a_crit, N_f
 
 def fracture_mechanics(K_IC, sigma, a, Y, da_dN_params):
     """Advanced fracture mechanics analysis including fatigue crack growth"""
     # Paris law parameters
     C, m = da_dN_params
     
-    # Critical crack length
-    a_crit = (K_IC / (Y * sigma * np.sqrt(np.pi)))**2
-    
-    # Fatigue crack growth
-    def crack_growth(a, N):
-        K = Y * sigma * np.sqrt(np.pi * a)
-        return C * K**m
-    
-    N_span = [0, 1e6]  # Number of cycles
-    a0 = a  # Initial crack length
-    sol = solve_ivp(crack_growth, N_span, [a0], dense_output=True, events=lambda N, a: a[0] - a_crit)
-    
-    return a_crit, sol.t, sol.y[0]
-
-def probabilistic_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties):
-    """Perform probabilistic analysis using Monte Carlo simulation"""
-    n_samples = 10000
-    results = []
-    
-    for _ in range(n_samples):
-        # Sample input parameters from their distributions
-        R_sample = norm.rvs(R, param_uncertainties['R'])
-        r_sample = norm.rvs(r, param_uncertainties['r'])
-        t_sample = norm.rvs(t, param_uncertainties['t'])
-        E_sample = norm.rvs(E, param_uncertainties['E'])
-        nu_sample = norm.rvs(nu, param_uncertainties['nu'])
-        p_int_sample = norm.rvs(p_int, param_uncertainties['p_int'])
-        p_ext_sample = norm.rvs(p_ext, param_uncertainties['p_ext'])
+    # Critical crack length and crack growth history up to it
+    a_crit, _, N, a_history = crack_growth_life(a, sigma, K_IC, C, m, Y, return_history=True)
+    
+    return a_crit, N, a_history
+
+def sample_distribution(rng, spec, size):
+    """
+    Draw samples from a distribution spec: a constant, or a tuple
+    ('normal', mean, std), ('lognormal', mean, std), ('uniform', low, high)
+    or ('weibull', scale, shape).
+    """
+    if not isinstance(spec, tuple):
+        return np.full(size, float(spec))
+    kind, p1, p2 = spec
+    if kind == 'normal':
+        return rng.normal(p1, p2, size)
+    elif kind == 'lognormal':
+        # Parameters are the mean and standard deviation of the variable itself
+        sigma_log = np.sqrt(np.log1p((p2 / p1)**2))
+        return rng.lognormal(np.log(p1) - sigma_log**2 / 2, sigma_log, size)
+    elif kind == 'uniform':
+        return rng.uniform(p1, p2, size)
+    elif kind == 'weibull':
+        return p1 * rng.weibull(p2, size)
+    else:
+        raise ValueError(f"Unknown distribution '{kind}'. Choose 'normal', 'lognormal', 'uniform' or 'weibull'.")
+
+def _damage_tolerance_chunk(args):
+    """Life samples for one chunk, reduced to failure counts per cycle level"""
+    seed, n, distributions, Y, cycles, n_steps = args
+    rng = np.random.default_rng(seed)
+    samples = {name: sample_distribution(rng, distributions[name], n) for name in ('a0', 'K_IC', 'C', 'm', 'delta_sigma')}
+    _, N_f = crack_growth_life(samples['a0'], samples['delta_sigma'], samples['K_IC'], samples['C'], samples['m'], Y, n_steps=n_steps)
+    if np.any(np.isnan(N_f)):
+        raise ValueError(f"{np.count_nonzero(np.isnan(N_f))} sampled cases have a critical crack length outside the Y table; "
+                         f"extend the table to cover them")
+    N_f = np.sort(N_f)
+    failures = np.searchsorted(N_f, cycles, side='right')
+    return failures, np.sum(N_f), np.sum(N_f**2), N_f.size
+
+def damage_tolerance_analysis(distributions, n_samples=100000, cycles=None, Y=1.0, chunk_size=100000, n_workers=1, seed=None, n_steps=50):
+    """
+    Probability of failure versus cycles from Monte Carlo crack growth.
+
+    distributions maps 'a0', 'K_IC', 'C', 'm' and 'delta_sigma' to specs
+    accepted by sample_distribution. Samples are drawn and propagated a chunk
+    at a time and only failure counts are kept, so memory does not grow with
+    n_samples. Each chunk has its own spawned seed, so results do not depend
+    on n_workers; n_workers > 1 spreads the chunks over processes.
+    Returns (cycles, prob_failure, (mean_life, std_life)).
+    """
+    if cycles is None:
+        cycles = np.logspace(2, 10, 200)
+    cycles = np.asarray(cycles, dtype=float)
+
+    n_chunks = -(-n_samples // chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    sizes = [min(chunk_size, n_samples - i * chunk_size) for i in range(n_chunks)]
+    jobs = [(seeds[i], sizes[i], distributions, Y, cycles, n_steps) for i in range(n_chunks)]
+
+    if n_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            chunk_results = list(executor.map(_damage_tolerance_chunk, jobs))
+    else:
+        chunk_results = map(_damage_tolerance_chunk, jobs)
+
+    failures = np.zeros(len(cycles))
+    total, total_sq, n_done = 0.0, 0.0, 0
+    for chunk_failures, chunk_sum, chunk_sum_sq, chunk_count in chunk_results:
+        failures += chunk_failures
+        total += chunk_sum
+        total_sq += chunk_sum_sq
+        n_done += chunk_count
+
+    mean_life = total / n_done
+    std_life = np.sqrt(max(total_sq / n_done - mean_life**2, 0.0))
+    return cycles, failures / n_done, (mean_life, std_life)
+
+def probabilistic_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties, n_samples=10000, surrogate=None,
+                           checkpoint=None, checkpoint_interval=60.0):
+    """
+    Perform probabilistic analysis using Monte Carlo simulation.
+
+    surrogate is an optional callable mapping rows (R, r, t, E, nu, p_int,
+    p_ext) to stresses (see modules.surrogate_models); all samples are then
+    drawn at once and evaluated in one batch. It must have been trained for
+    the same F, M and T.
+
+    checkpoint is an optional .npz path for the per-sample loop: the global
+    NumPy random state and the stresses so far are saved every
+    checkpoint_interval seconds, a run finding a checkpoint for the same
+    inputs resumes from it with bit-identical results, and the file is
+    removed on completion.
+    """
+    if surrogate is not None:
+        means = {'R': R, 'r': r, 't': t, 'E': E, 'nu': nu, 'p_int': p_int, 'p_ext': p_ext}
+        X = np.column_stack([norm.rvs(mean, param_uncertainties[name], size=n_samples) for name, mean in means.items()])
+        results = surrogate(X)
+    else:
+        inputs = (R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties, n_samples)
+        checkpointer = Checkpointer(checkpoint, 'probabilistic_analysis', inputs, checkpoint_interval)
+        state = checkpointer.load()
+        results = []
+        if state is not None:
+            results = list(state['results'])
+            restore_legacy_rng_state(state)
         
-        # Calculate stresses for this sample
-        sigma_vm, _, _ = calculate_torus_stresses(R_sample, r_sample, t_sample, E_sample, nu_sample, 
-                                                  p_int_sample, p_ext_sample, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
-        results.append(np.max(sigma_vm))
+        while len(results) < n_samples:
+            if checkpointer.due():
+                checkpointer.save(results=np.array(results, dtype=float), **legacy_rng_state())
+            
+            # Sample input parameters from their distributions
+            R_sample = norm.rvs(R, param_uncertainties['R'])
+            r_sample = norm.rvs(r, param_uncertainties['r'])
+            t_sample = norm.rvs(t, param_uncertainties['t'])
+            E_sample = norm.rvs(E, param_uncertainties['E'])
+            nu_sample = norm.rvs(nu, param_uncertainties['nu'])
+            p_int_sample = norm.rvs(p_int, param_uncertainties['p_int'])
+            p_ext_sample = norm.rvs(p_ext, param_uncertainties['p_ext'])
+            
+            # Calculate stresses for this sample
+            sigma_vm, _, _ = calculate_torus_stresses(R_sample, r_sample, t_sample, E_sample, nu_sample, 
+                                                      p_int_sample, p_ext_sample, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
+            results.append(np.max(sigma_vm))
+        checkpointer.finish()
     
     # Analyze results
     mean_stress = np.mean(results)
     std_stress = np.std(results)
     prob_failure = np.sum(np.array(results) > param_uncertainties['yield_stress']) / n_samples
+    count('probabilistic.samples', n_samples)
     
     return mean_stress, std_stress, prob_failure
 
-def optimization_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, constraints):
-    """Perform design optimization to minimize weight while meeting stress constraints"""
+def _torus_stress_rows(X, F_x, F_y, F_z, M_x, M_y, M_z, T):
+    """Von Mises stress at theta = phi = 0 for rows (R, r, t, E, nu, p_int, p_ext)"""
+    sigma_vm, _, _ = calculate_torus_stresses(*X.T, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
+    return np.broadcast_to(sigma_vm, len(X)).astype(float)
+
+def _evaluate_rows(args):
+    model, X = args
+    return np.asarray(model(X), dtype=float)
+
+def sobol_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties, n_samples=10000,
+                   n_bootstrap=200, confidence=0.95, chunk_size=100000, n_workers=1, seed=None, model=None):
+    """
+    First-order and total Sobol indices of the stress with respect to R, r, t,
+    E, nu, p_int and p_ext, each normal with the standard deviation in
+    param_uncertainties.
+
+    Uses the Saltelli sampling scheme: matrices A and B (n_samples, d) and, for
+    every input i, A with column i taken from B. All n_samples*(d+2) rows are
+    generated up front and evaluated in batched chunks of chunk_size rows
+    (spread over n_workers processes when n_workers > 1). First-order indices
+    use the Saltelli (2010) estimator and total indices the Jansen estimator;
+    confidence intervals are bootstrap percentiles. model is an optional
+    batched callable on those rows (e.g. a surrogate); it must be picklable
+    when n_workers > 1.
+    Returns a dict with names, first_order, total, first_order_ci, total_ci
+    and variance.
+    """
+    names = ('R', 'r', 't', 'E', 'nu', 'p_int', 'p_ext')
+    means = np.array([R, r, t, E, nu, p_int, p_ext], dtype=float)
+    std = np.array([param_uncertainties[name] for name in names], dtype=float)
+    d = len(names)
+    if model is None:
+        model = functools.partial(_torus_stress_rows, F_x=F_x, F_y=F_y, F_z=F_z, M_x=M_x, M_y=M_y, M_z=M_z, T=T)
+
+    rng = np.random.default_rng(seed)
+    A = means + std * rng.standard_normal((n_samples, d))
+    B = means + std * rng.standard_normal((n_samples, d))
+    X = np.empty((d + 2, n_samples, d))
+    X[0], X[1] = A, B
+    for i in range(d):
+        X[i + 2] = A
+        X[i + 2, :, i] = B[:, i]
+    X = X.reshape(-1, d)
+
+    with span('sobol.evaluate'):
+        jobs = [(model, X[i:i + chunk_size]) for i in range(0, len(X), chunk_size)]
+        if n_workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                y = np.concatenate(list(executor.map(_evaluate_rows, jobs)))
+        else:
+            y = np.concatenate([_evaluate_rows(job) for job in jobs])
+    count('sobol.evaluations', len(X))
+
+    # Centring leaves the indices unchanged but keeps the Saltelli estimator's variance down for large means
+    y = y.reshape(d + 2, n_samples) - np.mean(y[:2 * n_samples])
+    f_A, f_B, f_AB = y[0], y[1], y[2:]
+
+    # Per-sample terms of both estimators and of the output variance; a bootstrap
+    # replicate is then a count-weighted mean, so a block of replicates is one matrix product
+    terms = np.vstack((f_B * (f_AB - f_A), 0.5 * (f_A - f_AB)**2, f_A + f_B, f_A**2 + f_B**2))
+
+    def indices(means):
+        variance = means[..., -1] / 2 - (means[..., -2] / 2)**2
+        scale = np.divide(1, variance, out=np.zeros_like(variance), where=variance > 0)[..., np.newaxis]
+        return means[..., :d] * scale, means[..., d:2 * d] * scale, variance
+
+    first_order, total, variance = indices(np.mean(terms, axis=1))
+    with span('sobol.bootstrap'):
+        first_boot, total_boot = [], []
+        for block in range(0, n_bootstrap, 50):
+            weights = np.array([np.bincount(rng.integers(n_samples, size=n_samples), minlength=n_samples)
+                                for _ in range(min(50, n_bootstrap - block))], dtype=float)
+            first, total_block, _ = indices(weights @ terms.T / n_samples)
+            first_boot.append(first)
+            total_boot.append(total_block)
+        first_boot, total_boot = np.vstack(first_boot), np.vstack(total_boot)
+    tail = 100 * (1 - confidence) / 2
+    return {
+        'names': names,
+        'first_order': first_order,
+        'total': total,
+        'first_order_ci': np.percentile(first_boot, [tail, 100 - tail], axis=0).T,
+        'total_ci': np.percentile(total_boot, [tail, 100 - tail], axis=0).T,
+        'variance': variance
+    }
+
+def optimization_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, constraints, surrogate=None, density=7800,
+                          checkpoint=None, checkpoint_interval=60.0):
+    """
+    Perform design optimization to minimize weight (material density in kg/m³)
+    while meeting stress constraints.
+
+    With a surrogate (see probabilistic_analysis) the stress constraint is
+    evaluated through it; the optimum is then checked with the true model and,
+    if the constraint is violated there, the optimization continues from it
+    with the true model.
+
+    checkpoint is an optional .npz path: the current iterate and phase are
+    saved every checkpoint_interval seconds and an interrupted run restarts
+    SLSQP from the saved iterate. SLSQP does not expose its quasi-Newton
+    state, so a resumed run converges to the same optimum within the solver
+    tolerance but not necessarily bit-for-bit.
+    """
     def objective(x):
         R, r, t = x
         volume = 2 * np.pi**2 * R * r * t
-        return volume * 7800  # Assuming steel density
+        return volume * density
     
-    def constraint(x):
+    def constraint(x, use_surrogate=False):
         R, r, t = x
+        if use_surrogate:
+            return constraints['max_stress'] - surrogate(np.array([[R, r, t, E, nu, p_int, p_ext]]))[0]
         sigma_vm, _, _ = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
         return constraints['max_stress'] - np.max(sigma_vm)
     
@@ -161,52 +644,103 @@ def optimization_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y,
     bounds = ((0.5*R, 1.5*R), (0.5*r, 1.5*r), (0.5*t, 1.5*t))
     cons = {'type': 'ineq', 'fun': constraint}
     
-    result = minimize(objective, x0, method='SLSQP', bounds=bounds, constraints=cons)
+    inputs = (R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, constraints, surrogate is not None, density)
+    checkpointer = Checkpointer(checkpoint, 'optimization_analysis', inputs, checkpoint_interval)
+    state = checkpointer.load()
+    phase = 'surrogate' if surrogate is not None else 'true'
+    if state is not None:
+        x0, phase = state['x'], str(state['phase'])
+    
+    def save(phase):
+        def callback(xk):
+            if checkpointer.due():
+                checkpointer.save(x=xk, phase=phase)
+        return callback
+    
+    if phase == 'surrogate':
+        result = minimize(objective, x0, method='SLSQP', bounds=bounds,
+                          constraints={'type': 'ineq', 'fun': constraint, 'args': (True,)}, callback=save('surrogate'))
+        count('optimization.iterations', result.nit)
+        count('optimization.evaluations', result.nfev)
+        if constraint(result.x) >= -1e-6 * abs(constraints['max_stress']):
+            checkpointer.finish()
+            return result.x, result.fun
+        x0 = result.x
+        checkpointer.save(x=x0, phase='true')
+    
+    result = minimize(objective, x0, method='SLSQP', bounds=bounds, constraints=cons, callback=save('true'))
+    count('optimization.iterations', result.nit)
+    count('optimization.evaluations', result.nfev)
+    checkpointer.finish()
     
     return result.x, result.fun
 
-def advanced_torus_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, yield_stress, n, T_inner, T_outer, rho, omega, K_IC):
-    """Perform comprehensive advanced torus stress analysis"""
+@traced('advanced_torus_analysis')
+def advanced_torus_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, yield_stress, n, T_inner, T_outer, rho, omega, K_IC,
+                            sensitivity_samples=0):
+    """
+    Perform comprehensive advanced torus stress analysis.
+
+    With sensitivity_samples > 0, Sobol indices of the stress are added from
+    sobol_analysis with that base sample count (sensitivity_samples*9 model
+    evaluations); they are skipped by default.
+    """
     # Basic stress calculation
-    sigma_vm, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
+    with span('advanced.torus_stresses'):
+        sigma_vm, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
     
     # Advanced stress tensor
-    stress_tensor = advanced_stress_tensor(sigma_vm, sigma_phi, sigma_theta, M_x * r / (2 * np.pi * r**3 * t), 0, 0)
+    with span('advanced.stress_tensor'):
+        stress_tensor = advanced_stress_tensor(sigma_vm, sigma_phi, sigma_theta, M_x * r / (2 * np.pi * r**3 * t), 0, 0)
     
     # Finite element analysis
-    U = finite_element_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, 100)
+    with span('advanced.finite_element'):
+        U = finite_element_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, 100)
     
     # Non-linear material behavior
-    strain = sigma_vm / E
-    C, gamma = 1e5, 50  # Example Chaboche model parameters
-    sigma_nl = non_linear_material_model(strain, E, yield_stress, n, C, gamma)
+    with span('advanced.non_linear_material'):
+        strain = sigma_vm / E
+        C, gamma = 1e5, 50  # Example Chaboche model parameters
+        sigma_nl = non_linear_material_model(strain, E, yield_stress, n, C, gamma)
     
     # Thermal stress analysis
-    k = 50  # Thermal conductivity (W/m·K)
-    q = 1000  # Heat flux (W/m²)
-    sigma_thermal_hoop, sigma_thermal_radial, T_distribution = thermal_stress_analysis(R, r, t, E, 12e-6, k, T_inner, T_outer, q)
+    with span('advanced.thermal'):
+        k = 50  # Thermal conductivity (W/m·K)
+        q = 1000  # Heat flux (W/m²)
+        sigma_thermal_hoop, sigma_thermal_radial, T_distribution = thermal_stress_analysis(R, r, t, E, 12e-6, k, T_inner, T_outer, q, nu)
     
     # Dynamic stress analysis
-    time_span = [0, 10]  # Analyze for 10 seconds
-    dynamic_stress, time, theta = dynamic_stress_analysis(R, r, t, E, rho, omega, time_span)
+    with span('advanced.dynamic'):
+        time_span = [0, 10]  # Analyze for 10 seconds
+        dynamic_stress, time, theta = dynamic_stress_analysis(R, r, t, E, rho, omega, time_span)
     
     # Fracture mechanics
-    Y = 1.0  # Geometry factor, simplified
-    da_dN_params = (1e-11, 3)  # Paris law parameters (C, m)
-    a_crit, N, a = fracture_mechanics(K_IC, sigma_vm, t/10, Y, da_dN_params)
+    with span('advanced.fracture'):
+        Y = 1.0  # Geometry factor, simplified
+        da_dN_params = (1e-11, 3)  # Paris law parameters (C, m)
+        a_crit, N, a = fracture_mechanics(K_IC, sigma_vm, t/10, Y, da_dN_params)
     
     # Probabilistic analysis
-    param_uncertainties = {
-        'R': 0.01*R, 'r': 0.01*r, 't': 0.05*t, 'E': 0.05*E, 'nu': 0.1*nu,
-        'p_int': 0.1*p_int, 'p_ext': 0.1*p_ext, 'yield_stress': 0.1*yield_stress
-    }
-    mean_stress, std_stress, prob_failure = probabilistic_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties)
+    with span('advanced.probabilistic'):
+        param_uncertainties = {
+            'R': 0.01*R, 'r': 0.01*r, 't': 0.05*t, 'E': 0.05*E, 'nu': 0.1*nu,
+            'p_int': 0.1*p_int, 'p_ext': 0.1*p_ext, 'yield_stress': 0.1*yield_stress
+        }
+        mean_stress, std_stress, prob_failure = probabilistic_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties)
+    
+    # Global sensitivity of the stress to the uncertain parameters (opt-in)
+    sobol = None
+    if sensitivity_samples > 0:
+        with span('advanced.sensitivity'):
+            sobol = sobol_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, param_uncertainties,
+                                   n_samples=sensitivity_samples)
     
     # Optimization analysis
-    constraints = {'max_stress': yield_stress}
-    opt_dimensions, opt_weight = optimization_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, constraints)
+    with span('advanced.optimization'):
+        constraints = {'max_stress': yield_stress}
+        opt_dimensions, opt_weight = optimization_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, constraints, density=rho)
     
-    return {
+    results = {
         'stress_tensor': stress_tensor,
         'fem_displacement': U,
         'non_linear_stress': sigma_nl,
@@ -220,6 +754,9 @@ def advanced_torus_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_
         'optimized_dimensions': opt_dimensions,
         'optimized_weight': opt_weight
     }
+    if sobol is not None:
+        results['sensitivity_indices'] = {name: (first, total) for name, first, total in zip(sobol['names'], sobol['first_order'], sobol['total'])}
+    return results
 
 def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
     print("Advanced Calculations Analysis")
@@ -246,15 +783,20 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
     rho = float(input("Enter density (rho): "))
     omega = float(input("Enter angular velocity (omega): "))
     K_IC = float(input("Enter fracture toughness (K_IC): "))
+    sensitivity_samples = int(input("Enter Sobol sample count for sensitivity indices (0 to skip): ") or 0)
 
     # Perform advanced analysis
-    results = advanced_torus_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, yield_stress, n, T_inner, T_outer, rho, omega, K_IC)
+    results = advanced_torus_analysis(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, yield_stress, n, T_inner, T_outer, rho, omega, K_IC,
+                                      sensitivity_samples)
 
     # Display results
     print("\nAdvanced Analysis Results:")
     for key, value in results.items():
         print(f"{key}: {value}")
 
+    # Stage timings when instrumentation is enabled (TORUS_TRACE=1)
+    report()
+
     input("\nPress Enter to return to the main menu...")
 
 if __name__ == "__main__":
@@ -18,23 +18,121 @@ def plastic_model(stress, yield_stress, E, n):
     total_strain = elastic_strain + plastic_strain
     return total_strain
 
+def viscoelastic_creep_matrix(stress_range, time, E1, E2, eta):
+    """
+    Kelvin-Voigt creep strain for every stress level and time in one broadcast.
+    Returns an array of shape (n_stress, n_time).
+    """
+    stress = np.asarray(stress_range, dtype=float)[:, np.newaxis]
+    time = np.asarray(time, dtype=float)[np.newaxis, :]
+    return viscoelastic_model(stress, time, E1, E2, eta)
+
+def prony_creep_compliance(time, J0, J, tau):
+    """
+    Creep compliance of a generalized Kelvin (Prony series) model:
+    J(t) = J0 + sum_i J_i * (1 - exp(-t / tau_i))
+    """
+    time = np.asarray(time, dtype=float)
+    J = np.asarray(J, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    return J0 + np.sum(J * -np.expm1(-time[..., np.newaxis] / tau), axis=-1)
+
+def prony_relaxation_modulus(time, E_inf, E, tau):
+    """
+    Relaxation modulus of a generalized Maxwell (Prony series) model:
+    E(t) = E_inf + sum_i E_i * exp(-t / tau_i)
+    """
+    time = np.asarray(time, dtype=float)
+    E = np.asarray(E, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    return E_inf + np.sum(E * np.exp(-time[..., np.newaxis] / tau), axis=-1)
+
+def prony_creep_history(stress_history, time, J0, J, tau):
+    """
+    Strain response of a generalized Kelvin model to an arbitrary stress history.
+
+    The hereditary integral is evaluated recursively: each Kelvin element keeps
+    its own internal strain, which is advanced exactly over a step assuming the
+    stress varies linearly within it. The cost is O(n_terms) per step, so long
+    histories scale linearly with the number of steps.
+
+    stress_history may carry leading batch dimensions (..., n_time); all
+    histories are advanced together and the strain has the same shape.
+    """
+    stress_history = np.asarray(stress_history, dtype=float)
+    time = np.asarray(time, dtype=float)
+    J = np.asarray(J, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+
+    dt = np.diff(time)
+    decay = np.exp(-dt[:, np.newaxis] / tau)
+    # Weight of the stress increment for a stress ramp over the step
+    ramp = 1 - tau / dt[:, np.newaxis] * (1 - decay)
+
+    strain = np.empty_like(stress_history)
+    q = np.zeros(stress_history.shape[:-1] + J.shape)
+    sigma_prev = stress_history[..., 0]
+    strain[..., 0] = J0 * sigma_prev
+
+    for n in range(len(dt)):
+        sigma = stress_history[..., n + 1]
+        d_sigma = sigma - sigma_prev
+        q = decay[n] * q + J * (sigma_prev[..., np.newaxis] * (1 - decay[n]) + d_sigma[..., np.newaxis] * ramp[n])
+        strain[..., n + 1] = J0 * sigma + np.sum(q, axis=-1)
+        sigma_prev = sigma
+
+    return strain
+
+def generalized_maxwell_history(strain_history, time, E_inf, E, tau):
+    """
+    Stress response of a generalized Maxwell model to an arbitrary strain history.
+
+    Uses the same recursive update as prony_creep_history: each Maxwell arm
+    carries an internal stress that is advanced exactly for a strain ramp over
+    the step, giving O(n_terms) work per step.
+    """
+    strain_history = np.asarray(strain_history, dtype=float)
+    time = np.asarray(time, dtype=float)
+    E = np.asarray(E, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+
+    dt = np.diff(time)
+    decay = np.exp(-dt[:, np.newaxis] / tau)
+    gain = tau / dt[:, np.newaxis] * (1 - decay)
+
+    stress = np.empty_like(strain_history)
+    h = strain_history[..., 0, np.newaxis] * E
+    stress[..., 0] = E_inf * strain_history[..., 0] + np.sum(h, axis=-1)
+
+    for n in range(len(dt)):
+        d_eps = strain_history[..., n + 1] - strain_history[..., n]
+        h = decay[n] * h + E * gain[n] * d_eps[..., np.newaxis]
+        stress[..., n + 1] = E_inf * strain_history[..., n + 1] + np.sum(h, axis=-1)
+
+    return stress
+
 def analyze_advanced_material(model_type, parameters, stress_range, time_range=None):
     if model_type == "viscoelastic":
         E1, E2, eta = parameters
         time = np.linspace(0, time_range, 100)
-        strain = [viscoelastic_model(stress, time, E1, E2, eta) for stress in stress_range]
+        strain = viscoelastic_creep_matrix(stress_range, time, E1, E2, eta)
+        return time, strain
+    elif model_type == "prony":
+        J0, J, tau = parameters
+        time = np.linspace(0, time_range, 100)
+        strain = np.outer(stress_range, prony_creep_compliance(time, J0, J, tau))
         return time, strain
     elif model_type == "plastic":
         yield_stress, E, n = parameters
-        strain = [plastic_model(stress, yield_stress, E, n) for stress in stress_range]
+        strain = plastic_model(np.asarray(stress_range, dtype=float), yield_stress, E, n)
         return stress_range, strain
     else:
-        raise ValueError("Invalid model type. Choose 'viscoelastic' or 'plastic'.")
+        raise ValueError("Invalid model type. Choose 'viscoelastic', 'prony' or 'plastic'.")
 
 def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
     print("Advanced Material Models Analysis")
     
-    model_type = input("Choose model type (viscoelastic/plastic): ").lower()
+    model_type = input("Choose model type (viscoelastic/prony/plastic): ").lower()
     
     if model_type == "viscoelastic":
         E1 = float(input("Enter E1 (Pa): "))
@@ -46,12 +144,28 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
         time, strain = analyze_advanced_material(model_type, (E1, E2, eta), stress_range, time_range)
         
         plt.figure(figsize=(10, 6))
-        plt.plot(time, strain)
+        plt.plot(time, strain.T)
         plt.xlabel("Time (s)")
         plt.ylabel("Strain")
         plt.title("Viscoelastic Material Response")
         plt.show()
         
+    elif model_type == "prony":
+        J0 = float(input("Enter instantaneous compliance J0 (1/Pa): "))
+        J = [float(v) for v in input("Enter Prony compliances J_i (1/Pa, comma separated): ").split(",")]
+        tau = [float(v) for v in input("Enter retardation times tau_i (s, comma separated): ").split(",")]
+        stress_range = np.linspace(0, 1e6, 100)
+        time_range = float(input("Enter time range (s): "))
+        
+        time, strain = analyze_advanced_material(model_type, (J0, J, tau), stress_range, time_range)
+        
+        plt.figure(figsize=(10, 6))
+        plt.plot(time, strain.T)
+        plt.xlabel("Time (s)")
+        plt.ylabel("Strain")
+        plt.title("Prony Series Creep Response")
+        plt.show()
+        
     elif model_type == "plastic":
         yield_stress = float(input("Enter yield stress (Pa): "))
         E = float(input("Enter Young's modulus (Pa): "))
@@ -68,7 +182,7 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
         plt.show()
         
     else:
-        print("Invalid model type. Please choose 'viscoelastic' or 'plastic'.")
+        print("Invalid model type. Please choose 'viscoelastic', 'prony' or 'plastic'.")
     
     input("\nPress Enter to return to the main menu...")
 
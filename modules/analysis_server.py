@@ -0,0 +1,375 @@
+import asyncio
+import functools
+import json
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse.linalg import splu
+from main import calculate_torus_stresses
+from modules.fem_3d_analysis import (assemble_system, generate_torus_mesh, pressure_loads, recover_nodal_stresses,
+                                     rigid_body_constraints, von_mises)
+from modules.instrumentation import count, span
+
+# 'host:port' for TCP or 'unix:/path' for a Unix socket
+default_address = os.environ.get('TORUS_SERVER', '127.0.0.1:8765')
+
+# Inputs of a stress request, in calculate_torus_stresses order
+stress_inputs = ('R', 'r', 't', 'E', 'nu', 'p_int', 'p_ext', 'F_x', 'F_y', 'F_z', 'M_x', 'M_y', 'M_z', 'T', 'theta', 'phi', 'alpha')
+stress_defaults = {'F_x': 0, 'F_y': 0, 'F_z': 0, 'M_x': 0, 'M_y': 0, 'M_z': 0, 'T': 0, 'theta': 0, 'phi': 0, 'alpha': 12e-6}
+
+def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
+    print("Analysis Server")
+
+    address = input(f"Enter server address (leave empty for {default_address}): ").strip() or default_address
+    try:
+        with AnalysisClient(address, timeout=2) as client:
+            stats = client.stats()
+    except OSError:
+        stats = None
+
+    if stats is not None:
+        print(f"\nServer at {address} is running:")
+        for key, value in stats.items():
+            print(f"  {key}: {value}")
+
+        job = input("\nSubmit a job (stresses, fem or leave empty for none): ").strip().lower()
+        if job in ('stresses', 'fem'):
+            R = float(input("Enter major radius (R): "))
+            r = float(input("Enter minor radius (r): "))
+            t = float(input("Enter thickness (t): "))
+            E = float(input("Enter Young's modulus (E): "))
+            nu = float(input("Enter Poisson's ratio (nu): "))
+            p_int = float(input("Enter internal pressure (p_int): "))
+            p_ext = float(input("Enter external pressure (p_ext): "))
+            with AnalysisClient(address) as client:
+                start = time.perf_counter()
+                if job == 'stresses':
+                    # One request for the whole (theta, phi) grid
+                    theta, phi = np.meshgrid(np.linspace(0, 2*np.pi, 36), np.linspace(0, 2*np.pi, 36))
+                    sigma_vm, sigma_phi, sigma_theta = client.stresses(R, r, t, E, nu, p_int, p_ext, theta=theta, phi=phi)
+                    elapsed = time.perf_counter() - start
+                    print(f"\nStresses over a {theta.shape[0]}x{theta.shape[1]} grid ({elapsed * 1e3:.1f} ms):")
+                    print(f"Max von Mises stress: {np.max(sigma_vm):.4e}")
+                    print(f"Max hoop stress: {np.max(sigma_phi):.4e}")
+                    print(f"Max meridional stress: {np.max(sigma_theta):.4e}")
+                else:
+                    n_elements = int(input("Enter number of elements: "))
+                    result = client.fem(R, r, t, E, nu, p_int, p_ext, n_elements)
+                    elapsed = time.perf_counter() - start
+                    print(f"\nFEM job ({elapsed * 1e3:.1f} ms, {'cached' if result['cache_hit'] else 'new'} factorization):")
+                    print(f"DOFs: {result['n_dofs']}")
+                    print(f"Max von Mises stress: {result['max_von_mises']:.4e}")
+                    print(f"Max displacement: {result['max_displacement']:.4e}")
+    else:
+        n_workers = int(input("No server running. Enter number of FEM worker processes to start one with: "))
+        print(f"Serving on {address}, press Ctrl+C to stop")
+        try:
+            serve(address, n_workers)
+        except KeyboardInterrupt:
+            print("\nServer stopped")
+
+    input("\nPress Enter to return to the main menu...")
+
+@functools.lru_cache(maxsize=8)
+def fem_model(R, r, t, E, nu, n_elements):
+    """Mesh, unit pressure loads and sparse LU of the constrained stiffness matrix, cached per worker process"""
+    with span('server.fem_model'):
+        nodes, elements = generate_torus_mesh(R, r, t, n_elements)
+        K, _ = assemble_system(nodes, elements, E, nu, 0, 0)
+        F_int = pressure_loads(nodes, elements, 1, 0)
+        F_ext = pressure_loads(nodes, elements, 0, 1)
+        free = np.setdiff1d(np.arange(K.shape[0]), rigid_body_constraints(nodes))
+        lu = splu(K[free][:, free].tocsc(), permc_spec='MMD_AT_PLUS_A')
+    return nodes, elements, F_int, F_ext, free, lu
+
+def fem_job(R, r, t, E, nu, p_int, p_ext, n_elements=8, fields=False):
+    """
+    Peak results of the 3D FEM pressure model. The model is linear in the
+    pressures, so repeated geometry and material reuse the cached
+    factorization and only pay a triangular solve and stress recovery.
+    """
+    hits = fem_model.cache_info().hits
+    nodes, elements, F_int, F_ext, free, lu = fem_model(R, r, t, E, nu, n_elements)
+    U = np.zeros(3 * len(nodes))
+    U[free] = lu.solve(p_int * F_int[free] + p_ext * F_ext[free])
+    sigma_vm = von_mises(recover_nodal_stresses(nodes, elements, U, E, nu))
+    displacement = U.reshape(-1, 3)
+    result = {
+        'max_von_mises': float(np.max(sigma_vm)),
+        'max_displacement': float(np.max(np.linalg.norm(displacement, axis=1))),
+        'n_dofs': int(U.size),
+        'cache_hit': fem_model.cache_info().hits > hits,
+        'pid': os.getpid()
+    }
+    if fields:
+        result.update(nodes=nodes.tolist(), displacement=displacement.tolist(), von_mises=sigma_vm.tolist())
+    return result
+
+def evaluate_stress_batch(requests):
+    """
+    Stresses for many requests with one calculate_torus_stresses call: every
+    request's inputs are broadcast together, flattened and concatenated.
+    Returns one (sigma_vm, sigma_phi, sigma_theta) tuple of arrays per request.
+    """
+    shapes, columns = [], []
+    for params in requests:
+        values = np.broadcast_arrays(*(np.asarray(params[name], dtype=float) for name in stress_inputs))
+        shapes.append(values[0].shape)
+        columns.append([value.ravel() for value in values])
+    args = [np.concatenate(column) for column in zip(*columns)]
+    results = calculate_torus_stresses(*args[:-1], alpha=args[-1])
+    results = [np.broadcast_to(result, args[0].shape) for result in results]
+    offsets = np.cumsum([0] + [int(np.prod(shape)) for shape in shapes])
+    return [tuple(result[start:end].reshape(shape) for result in results)
+            for start, end, shape in zip(offsets[:-1], offsets[1:], shapes)]
+
+class StressBatcher:
+    """
+    Coalesces concurrent stress requests: the first request of a batch waits
+    max_delay seconds for others (with max_delay=0, until the event loop's
+    next iteration), or less once max_points points are queued, and the
+    whole batch is evaluated in one vectorized call.
+    """
+
+    def __init__(self, max_delay=0, max_points=1000000):
+        self.max_delay = max_delay
+        self.max_points = max_points
+        self.pending = []
+        self.points = 0
+        self.timer = None
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, params):
+        params = dict(stress_defaults, **params)
+        missing = [name for name in stress_inputs if name not in params]
+        if missing:
+            raise ValueError(f"Missing stress inputs: {', '.join(missing)}.")
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((params, future))
+        self.points += max(np.size(params['theta']), np.size(params['phi']))
+        if self.points >= self.max_points:
+            self.flush()
+        elif self.timer is None and self.max_delay > 0:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+        elif self.timer is None:
+            # Batch whatever arrives before the event loop's next iteration
+            self.timer = asyncio.get_running_loop().call_soon(self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending, self.points = self.pending, [], 0
+        if not batch:
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        count('server.stress_batches')
+        count('server.stress_requests', len(batch))
+        try:
+            with span('server.stress_batch', size=len(batch)):
+                results = evaluate_stress_batch([params for params, _ in batch])
+        except Exception:
+            # Evaluate one at a time so a bad request only fails itself
+            results = []
+            for params, _ in batch:
+                try:
+                    results.append(evaluate_stress_batch([params])[0])
+                except Exception as error:
+                    results.append(error)
+        for (_, future), result in zip(batch, results):
+            if future.cancelled():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+class AnalysisServer:
+    """
+    Local analysis service speaking line-delimited JSON: each request line is
+    {"id": ..., "method": ..., "params": {...}} and each response line is
+    {"id": ..., "result": ...} or {"id": ..., "error": "..."}. Requests on a
+    connection are handled concurrently, so responses may arrive out of order.
+
+    Methods: 'stresses' (batched calculate_torus_stresses), 'fem' (fem_job in
+    a worker process), 'stats' and 'shutdown'. FEM jobs are routed by model
+    key to one of n_workers single-process executors so that each worker's
+    mesh and factorization cache keeps serving the same models.
+    """
+
+    def __init__(self, address=default_address, n_workers=2, max_delay=0):
+        self.address = address
+        self.batcher = StressBatcher(max_delay)
+        self.workers = [ProcessPoolExecutor(max_workers=1) for _ in range(max(1, n_workers))]
+        self.started = time.time()
+        self.counts = {}
+        self.fem_cache_hits = 0
+        self.stopped = None
+
+    async def start(self):
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Start the worker processes (and their imports) before the first request
+        await asyncio.gather(*(loop.run_in_executor(worker, os.getpid) for worker in self.workers))
+        if self.address.startswith('unix:'):
+            path = self.address[len('unix:'):]
+            if os.path.exists(path):
+                os.remove(path)
+            self.server = await asyncio.start_unix_server(self.handle, path, limit=2**26)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            self.server = await asyncio.start_server(self.handle, host, int(port), limit=2**26)
+        return self
+
+    async def serve_until_shutdown(self):
+        async with self.server:
+            await self.stopped.wait()
+
+    def close(self):
+        for worker in self.workers:
+            worker.shutdown(cancel_futures=True)
+        if self.address.startswith('unix:') and os.path.exists(self.address[len('unix:'):]):
+            os.remove(self.address[len('unix:'):])
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self.respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError, asyncio.CancelledError):
+            pass  # client gone, oversized line, or server shutting down
+        finally:
+            writer.close()
+
+    async def respond(self, line, writer, lock):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            response = {'id': request_id, 'result': await self.dispatch(request['method'], request.get('params', {}))}
+        except Exception as error:
+            response = {'id': request_id, 'error': f"{type(error).__name__}: {error}"}
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def dispatch(self, method, params):
+        self.counts[method] = self.counts.get(method, 0) + 1
+        if method == 'stresses':
+            sigma_vm, sigma_phi, sigma_theta = await self.batcher.submit(params)
+            return {'sigma_vm': sigma_vm.tolist(), 'sigma_phi': sigma_phi.tolist(), 'sigma_theta': sigma_theta.tolist()}
+        if method == 'fem':
+            key = tuple(float(params[name]) for name in ('R', 'r', 't', 'E', 'nu')) + (int(params.get('n_elements', 8)),)
+            worker = self.workers[hash(key) % len(self.workers)]
+            result = await asyncio.get_running_loop().run_in_executor(worker, functools.partial(fem_job, **params))
+            self.fem_cache_hits += result['cache_hit']
+            return result
+        if method == 'stats':
+            return {
+                'uptime': time.time() - self.started,
+                'requests': dict(self.counts),
+                'stress_batches': self.batcher.batches,
+                'mean_batch_size': self.batcher.requests / max(self.batcher.batches, 1),
+                'fem_cache_hits': self.fem_cache_hits,
+                'workers': len(self.workers)
+            }
+        if method == 'shutdown':
+            asyncio.get_running_loop().call_soon(self.stopped.set)
+            return True
+        raise ValueError(f"Unknown method '{method}'. Choose 'stresses', 'fem', 'stats' or 'shutdown'.")
+
+def serve(address=default_address, n_workers=2, max_delay=0):
+    """Run the server in the foreground until a 'shutdown' request (or Ctrl+C)"""
+    async def main():
+        server = await AnalysisServer(address, n_workers, max_delay).start()
+        try:
+            await server.serve_until_shutdown()
+        finally:
+            server.close()
+    asyncio.run(main())
+
+class AnalysisClient:
+    """
+    Thin blocking client. request() sends one request and waits for its
+    answer; request_many() writes all requests before reading, so the server
+    can batch them.
+    """
+
+    def __init__(self, address=default_address, timeout=None):
+        if address.startswith('unix:'):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(address[len('unix:'):])
+        else:
+            host, port = address.rsplit(':', 1)
+            self.socket = socket.create_connection((host, int(port)), timeout)
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 0
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def request_many(self, method, params_list):
+        """Results for many requests of one method, in order"""
+        ids = []
+        for params in params_list:
+            self.next_id += 1
+            ids.append(self.next_id)
+            self.file.write(json.dumps({'id': self.next_id, 'method': method, 'params': params}).encode() + b'\n')
+        self.file.flush()
+        responses = {}
+        while len(responses) < len(ids):
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection.")
+            response = json.loads(line)
+            responses[response['id']] = response
+        results = []
+        for request_id in ids:
+            if 'error' in responses[request_id]:
+                raise RuntimeError(responses[request_id]['error'])
+            results.append(responses[request_id]['result'])
+        return results
+
+    def request(self, method, **params):
+        return self.request_many(method, [params])[0]
+
+    def stresses(self, R, r, t, E, nu, p_int, p_ext, F_x=0, F_y=0, F_z=0, M_x=0, M_y=0, M_z=0, T=0, theta=0, phi=0, alpha=12e-6):
+        """(sigma_vm, sigma_phi, sigma_theta) arrays as calculate_torus_stresses would return them"""
+        params = {name: np.asarray(value).tolist() for name, value in zip(stress_inputs, (
+            R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi, alpha))}
+        result = self.request('stresses', **params)
+        return tuple(np.array(result[key]) for key in ('sigma_vm', 'sigma_phi', 'sigma_theta'))
+
+    def fem(self, R, r, t, E, nu, p_int, p_ext, n_elements=8, fields=False):
+        return self.request('fem', R=R, r=r, t=t, E=E, nu=nu, p_int=p_int, p_ext=p_ext, n_elements=n_elements, fields=fields)
+
+    def stats(self):
+        return self.request('stats')
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+if __name__ == "__main__":
+    # This allows the module to be run standalone for testing
+    from main import calculate_torus_stresses, fatigue_analysis
+    from modules import advanced_calculations
+    from visualization import create_advanced_animation
+    run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation)
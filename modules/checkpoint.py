@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from modules.instrumentation import count, span
+
+class Checkpointer:
+    """
+    Periodic checkpoints of a long-running analysis in one compressed .npz file.
+
+    A checkpoint holds the analysis kind, a signature of its inputs and the
+    saved state arrays; load() refuses a file written for other inputs.
+    Files are written to a temporary name and renamed, so a crash while
+    saving leaves the previous checkpoint intact. With path=None every
+    method is a no-op, so analyses call it unconditionally.
+    """
+
+    def __init__(self, path, kind, inputs, interval=60.0):
+        self.path = path
+        self.kind = kind
+        self.signature = signature(inputs)
+        self.interval = interval
+        self.last_save = time.monotonic()
+
+    def load(self):
+        """Saved state as a dict of arrays, or None when there is no checkpoint to resume"""
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        with np.load(self.path, allow_pickle=False) as data:
+            state = {key: data[key] for key in data.files}
+        if str(state.pop('_kind')) != self.kind or str(state.pop('_signature')) != self.signature:
+            raise ValueError(f"Checkpoint {self.path} was written by a different {self.kind} run; remove it to start over.")
+        count('checkpoint.resumes')
+        return state
+
+    def due(self):
+        """True when the checkpoint interval has passed since the last save"""
+        return self.path is not None and time.monotonic() - self.last_save >= self.interval
+
+    def save(self, **state):
+        if self.path is None:
+            return
+        with span('checkpoint.save'):
+            temporary = self.path + '.tmp'
+            with open(temporary, 'wb') as f:
+                np.savez_compressed(f, _kind=self.kind, _signature=self.signature, **state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+        count('checkpoint.saves')
+        self.last_save = time.monotonic()
+
+    def finish(self):
+        """Remove the checkpoint once the analysis has completed"""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+def signature(inputs):
+    """Stable hash of the analysis inputs (numbers, strings, arrays and nested sequences/dicts)"""
+    def plain(value):
+        if isinstance(value, dict):
+            return {str(key): plain(item) for key, item in sorted(value.items())}
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [plain(item) for item in value]
+        if isinstance(value, (np.generic, float, int)):
+            return repr(float(value))
+        return repr(value)
+    return hashlib.sha256(json.dumps(plain(inputs)).encode()).hexdigest()
+
+def legacy_rng_state():
+    """State of NumPy's global RandomState (used by scipy.stats rvs) as checkpoint arrays"""
+    _, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    return {'rng_keys': keys, 'rng_position': position, 'rng_has_gauss': has_gauss, 'rng_cached_gaussian': cached_gaussian}
+
+def restore_legacy_rng_state(state):
+    np.random.set_state(('MT19937', state['rng_keys'], int(state['rng_position']), int(state['rng_has_gauss']),
+                         float(state['rng_cached_gaussian'])))
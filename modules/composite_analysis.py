@@ -1,5 +1,6 @@
 import numpy as np
 from scipy.linalg import solve
+from modules.instrumentation import count
 
 def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
     print("Composite Material Analysis")
@@ -36,50 +37,334 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
 
     input("\nPress Enter to return to the main menu...")
 
-def laminate_analysis(layers):
-    n_layers = len(layers)
-    total_thickness = sum(layer[0] for layer in layers)
-    z = np.cumsum([0] + [layer[0] for layer in layers]) - total_thickness/2
+def laminate_analysis(layers, loads=None):
+    thickness, angles, E1, E2, G12, nu12 = np.asarray(layers, dtype=float).T
+    z = np.concatenate(([0.0], np.cumsum(thickness))) - np.sum(thickness)/2
 
-    A = np.zeros((3, 3))
-    B = np.zeros((3, 3))
-    D = np.zeros((3, 3))
+    # All transformed layer stiffnesses at once, shape (n_layers, 3, 3)
+    Q_bar = transform_stiffness_matrices(calculate_stiffness_matrices(E1, E2, G12, nu12), angles)
+    ABD_matrix = abd_matrices(Q_bar, z)
 
-    for i in range(n_layers):
-        thickness, angle, E1, E2, G12, nu12 = layers[i]
-        Q = calculate_stiffness_matrix(E1, E2, G12, nu12)
-        Q_bar = transform_stiffness_matrix(Q, angle)
+    # Apply loads/moments (example values, can be user inputs)
+    if loads is None:
+        N = np.array([1000, 500, 0])  # Force resultants
+        M = np.array([0, 0, 100])  # Moment resultants
+        loads = np.concatenate((N, M))
 
-        A += Q_bar * (z[i+1] - z[i])
-        B += 0.5 * Q_bar * (z[i+1]**2 - z[i]**2)
-        D += (1/3) * Q_bar * (z[i+1]**3 - z[i]**3)
+    # Solve for mid-plane strains and curvatures, one row per load vector
+    loads = np.asarray(loads, dtype=float)
+    strains = solve(ABD_matrix, loads.reshape(-1, 6).T).T.reshape(loads.shape)
 
-    ABD_matrix = np.block([[A, B], [B, D]])
+    # Calculate mid-ply stresses in each layer
+    z_mid = (z[:-1] + z[1:]) / 2
+    eps = strains[..., np.newaxis, :3] + z_mid[:, np.newaxis] * strains[..., np.newaxis, 3:]
+    stresses = np.einsum('lij,...lj->...li', Q_bar, eps)
 
-    # Apply loads/moments (example values, can be user inputs)
-    N = np.array([1000, 500, 0])  # Force resultants
-    M = np.array([0, 0, 100])  # Moment resultants
-    loads = np.concatenate((N, M))
+    return ABD_matrix, strains, stresses
 
-    # Solve for mid-plane strains and curvatures
-    strains = solve(ABD_matrix, loads)
+def calculate_stiffness_matrices(E1, E2, G12, nu12):
+    """Reduced stiffness matrices for arrays of ply properties, shape (..., 3, 3)"""
+    E1, E2, G12, nu12 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (E1, E2, G12, nu12)))
+    nu21 = nu12 * E2 / E1
+    denom = 1 - nu12 * nu21
+    Q = np.zeros(E1.shape + (3, 3))
+    Q[..., 0, 0] = E1 / denom
+    Q[..., 0, 1] = Q[..., 1, 0] = nu12 * E2 / denom
+    Q[..., 1, 1] = E2 / denom
+    Q[..., 2, 2] = G12
+    return Q
 
-    # Calculate stresses in each layer
-    stresses = []
-    for i in range(n_layers):
-        thickness, angle, E1, E2, G12, nu12 = layers[i]
-        Q = calculate_stiffness_matrix(E1, E2, G12, nu12)
-        Q_bar = transform_stiffness_matrix(Q, angle)
-        
-        eps_0 = strains[:3]
-        kappa = strains[3:]
-        z_mid = (z[i] + z[i+1]) / 2
-        
-        eps = eps_0 + z_mid * kappa
-        stress = Q_bar @ eps
-        stresses.append(stress)
+def transformation_matrices(angles):
+    """Stress transformation matrices for an array of ply angles (degrees), shape (..., 3, 3)"""
+    theta = np.radians(np.asarray(angles, dtype=float))
+    c, s = np.cos(theta), np.sin(theta)
+    T = np.empty(theta.shape + (3, 3))
+    T[..., 0, 0] = c**2
+    T[..., 0, 1] = s**2
+    T[..., 0, 2] = 2*c*s
+    T[..., 1, 0] = s**2
+    T[..., 1, 1] = c**2
+    T[..., 1, 2] = -2*c*s
+    T[..., 2, 0] = -c*s
+    T[..., 2, 1] = c*s
+    T[..., 2, 2] = c**2 - s**2
+    return T
 
-    return ABD_matrix, strains, stresses
+def strain_transformation_matrices(angles):
+    """Engineering-strain transformation matrices (global to material axes) for ply angles (degrees), shape (..., 3, 3)"""
+    theta = np.radians(np.asarray(angles, dtype=float))
+    c, s = np.cos(theta), np.sin(theta)
+    T = np.empty(theta.shape + (3, 3))
+    T[..., 0, 0] = c**2
+    T[..., 0, 1] = s**2
+    T[..., 0, 2] = c*s
+    T[..., 1, 0] = s**2
+    T[..., 1, 1] = c**2
+    T[..., 1, 2] = -c*s
+    T[..., 2, 0] = -2*c*s
+    T[..., 2, 1] = 2*c*s
+    T[..., 2, 2] = c**2 - s**2
+    return T
+
+def transform_stiffness_matrices(Q, angles):
+    """
+    Vectorized transform_stiffness_matrix for stacked Q matrices and angles:
+    Q_bar = T_eps^T Q T_eps with the engineering-strain transformation, which
+    equals T^-1 Q T^-T for the stress transformation T.
+    """
+    T = strain_transformation_matrices(angles)
+    return np.einsum('...ki,...kl,...lj->...ij', T, Q, T)
+
+def check_stiffness_transform(E=200e9, nu=0.3, angles=np.arange(0, 181, 15)):
+    """
+    Largest relative change of an isotropic ply's Q_bar over the given angles.
+    Q_bar of an isotropic material must not depend on the angle, so the
+    result should be at rounding level.
+    """
+    Q = calculate_stiffness_matrix(E, E, E / (2 * (1 + nu)), nu)
+    Q_bar = transform_stiffness_matrices(Q, angles)
+    return np.max(np.abs(Q_bar - Q)) / np.max(np.abs(Q))
+
+def abd_matrices(Q_bar, z):
+    """
+    ABD matrices for stacked laminates.
+    Q_bar has shape (..., n_layers, 3, 3) and z (..., n_layers + 1); returns (..., 6, 6).
+    """
+    z = np.asarray(z, dtype=float)
+    dz1 = np.diff(z, axis=-1)
+    dz2 = np.diff(z**2, axis=-1) / 2
+    dz3 = np.diff(z**3, axis=-1) / 3
+    A = np.einsum('...l,...lij->...ij', dz1, Q_bar)
+    B = np.einsum('...l,...lij->...ij', dz2, Q_bar)
+    D = np.einsum('...l,...lij->...ij', dz3, Q_bar)
+    return np.concatenate((np.concatenate((A, B), axis=-1), np.concatenate((B, D), axis=-1)), axis=-2)
+
+def stacking_sequence_sweep(ply, angle_options, n_plies, loads=None, symmetric=False, sequences=None,
+                            max_strain=None, full_output=True, chunk_size=50000, max_candidates=1000000):
+    """
+    Evaluate every stacking sequence of n_plies drawn from angle_options.
+
+    ply is (thickness, E1, E2, G12, nu12) shared by all plies. With symmetric=True
+    only the upper half of the laminate is enumerated and mirrored. Explicit
+    candidate sequences (n_candidates, n_plies) can be passed instead.
+    Candidates are decoded and evaluated chunk_size at a time, so the ABD and
+    strain work arrays stay bounded. Returns the compliance (strain energy)
+    per candidate and the stiffest layup 'best' with its 'best_compliance';
+    with max_strain, 'best' is restricted to candidates whose in-plane
+    mid-plane strains all stay within max_strain ('feasible'), and is None if
+    there are none. full_output=True also returns the sequences, ABD matrices
+    and mid-plane strains for every load vector of all candidates; that is
+    refused above max_candidates, as those arrays grow with the candidate count.
+    """
+    thickness, E1, E2, G12, nu12 = ply
+    angle_options = np.unique(np.asarray(angle_options, dtype=float))
+
+    if sequences is None:
+        n_free = (n_plies + 1) // 2 if symmetric else n_plies
+        n_candidates = len(angle_options) ** n_free
+    else:
+        sequences = np.asarray(sequences, dtype=float)
+        angle_options, explicit_idx = np.unique(sequences, return_inverse=True)
+        explicit_idx = explicit_idx.reshape(sequences.shape)
+        n_candidates, n_plies = sequences.shape
+    if full_output and n_candidates > max_candidates:
+        raise ValueError(f"{n_candidates} candidate sequences exceed max_candidates={max_candidates} with full_output=True; "
+                         f"use full_output=False, symmetric=True or fewer angles/plies, or raise max_candidates")
+
+    def candidate_indices(start, stop):
+        if sequences is not None:
+            return explicit_idx[start:stop]
+        idx = np.stack(np.unravel_index(np.arange(start, stop), (len(angle_options),) * n_free), axis=1)
+        if symmetric:
+            idx = np.concatenate((idx, idx[:, :n_plies // 2][:, ::-1]), axis=1)
+        return idx
+
+    # Only one Q-bar per distinct angle is needed; candidates gather from it
+    Q = calculate_stiffness_matrix(E1, E2, G12, nu12)
+    Q_bar_options = transform_stiffness_matrices(Q, angle_options)
+    z = (np.arange(n_plies + 1) - n_plies/2) * thickness
+
+    if loads is None:
+        loads = np.array([1000, 500, 0, 0, 0, 100])
+    loads = np.atleast_2d(np.asarray(loads, dtype=float))
+
+    compliance = np.empty(n_candidates)
+    feasible = np.ones(n_candidates, dtype=bool)
+    if full_output:
+        ABD = np.empty((n_candidates, 6, 6))
+        strains = np.empty((n_candidates,) + loads.shape)
+    best, best_compliance = None, np.inf
+    for start in range(0, n_candidates, chunk_size):
+        count('stacking_sequence_sweep.chunks')
+        stop = min(start + chunk_size, n_candidates)
+        idx = candidate_indices(start, stop)
+        chunk_ABD = abd_matrices(Q_bar_options[idx], z)
+        chunk_strains = np.linalg.solve(chunk_ABD, np.broadcast_to(loads.T, (len(idx),) + loads.T.shape)).transpose(0, 2, 1)
+        compliance[start:stop] = np.sum(np.einsum('lk,clk->cl', loads, chunk_strains), axis=-1)
+        if max_strain is not None:
+            feasible[start:stop] = np.max(np.abs(chunk_strains[..., :3]), axis=(1, 2)) <= max_strain
+        if full_output:
+            ABD[start:stop] = chunk_ABD
+            strains[start:stop] = chunk_strains
+
+        # Keep the running best among this chunk's feasible candidates
+        candidates = np.flatnonzero(feasible[start:stop])
+        if len(candidates):
+            local = candidates[np.argmin(compliance[start:stop][candidates])]
+            if compliance[start + local] < best_compliance:
+                best, best_compliance = angle_options[idx[local]], compliance[start + local]
+
+    result = {'compliance': compliance, 'best': best, 'best_compliance': best_compliance}
+    if max_strain is not None:
+        result['feasible'] = feasible
+    if full_output:
+        result.update({'sequences': angle_options[candidate_indices(0, n_candidates)], 'ABD': ABD, 'strains': strains})
+    return result
+
+def lightest_layup(ply, angle_options, ply_counts, max_strain, loads=None, density=1600, symmetric=False, chunk_size=50000):
+    """
+    Find the thinnest (and so lightest) laminate that keeps every mid-plane
+    strain component below max_strain, sweeping ply counts in increasing order.
+    Only the running best of each sweep is kept, so large sweeps stay in memory.
+    Returns (sequence, mass per unit area) or (None, None) if no candidate passes.
+    """
+    for n_plies in sorted(ply_counts):
+        sweep = stacking_sequence_sweep(ply, angle_options, n_plies, loads, symmetric,
+                                        max_strain=max_strain, full_output=False, chunk_size=chunk_size)
+        if sweep['best'] is not None:
+            return sweep['best'], density * ply[0] * n_plies
+    return None, None
+
+def ply_point_stresses(Q_bar, z, strains, angles):
+    """
+    Stresses at the bottom, middle and top of every ply in material axes.
+    strains has shape (..., 6); returns (..., n_layers, 3, 3) ordered as
+    (layer, [bottom, mid, top], [sigma_1, sigma_2, tau_12]).
+    """
+    z_points = np.stack((z[:-1], (z[:-1] + z[1:]) / 2, z[1:]), axis=-1)
+    eps = strains[..., np.newaxis, np.newaxis, :3] + z_points[..., np.newaxis] * strains[..., np.newaxis, np.newaxis, 3:]
+    sigma_xy = np.einsum('lij,...lpj->...lpi', Q_bar, eps)
+    T = transformation_matrices(angles)
+    return np.einsum('lij,...lpj->...lpi', T, sigma_xy)
+
+def tsai_wu_index(sigma, strengths):
+    """Tsai-Wu failure index for material-axis stresses (..., 3); failure at >= 1"""
+    X_t, X_c, Y_t, Y_c, S = strengths
+    s1, s2, t12 = sigma[..., 0], sigma[..., 1], sigma[..., 2]
+    F1 = 1/X_t - 1/X_c
+    F2 = 1/Y_t - 1/Y_c
+    F11 = 1/(X_t*X_c)
+    F22 = 1/(Y_t*Y_c)
+    F66 = 1/S**2
+    F12 = -0.5 * np.sqrt(F11*F22)
+    return F1*s1 + F2*s2 + F11*s1**2 + F22*s2**2 + F66*t12**2 + 2*F12*s1*s2
+
+def hashin_index(sigma, strengths):
+    """Largest of the plane-stress Hashin fibre/matrix failure indices; failure at >= 1"""
+    X_t, X_c, Y_t, Y_c, S = strengths
+    s1, s2, t12 = sigma[..., 0], sigma[..., 1], sigma[..., 2]
+    fibre = np.where(s1 >= 0, (s1/X_t)**2 + (t12/S)**2, (s1/X_c)**2)
+    matrix = np.where(s2 >= 0,
+                      (s2/Y_t)**2 + (t12/S)**2,
+                      (s2/(2*S))**2 + ((Y_c/(2*S))**2 - 1) * s2/Y_c + (t12/S)**2)
+    return np.maximum(fibre, matrix)
+
+failure_criteria = {
+    'tsai_wu': tsai_wu_index,
+    'hashin': hashin_index
+}
+
+def torus_membrane_resultants(layers, R, r, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, calculate_torus_stresses, theta, phi):
+    """
+    Membrane resultants [N_hoop, N_meridional, 0, 0, 0, 0] over a (theta, phi) grid.
+    The laminate enters calculate_torus_stresses through its total thickness and
+    effective in-plane modulus and Poisson's ratio from the A matrix. Only the
+    load-proportional (pressure and force) part of its stresses is kept: the
+    stresses of an unloaded call, which hold the load-independent bending term,
+    are subtracted, and the isotropic thermal term is left out (T = 0) as the
+    laminate has no expansion coefficients here. The resultants therefore scale
+    linearly with the loads and vanish for an unloaded torus.
+    """
+    thickness, angles, E1, E2, G12, nu12 = np.asarray(layers, dtype=float).T
+    h = np.sum(thickness)
+    z = np.concatenate(([0.0], np.cumsum(thickness))) - h/2
+    Q_bar = transform_stiffness_matrices(calculate_stiffness_matrices(E1, E2, G12, nu12), angles)
+    a = np.linalg.inv(abd_matrices(Q_bar, z)[:3, :3])
+    E_x = 1 / (h * a[0, 0])
+    nu_xy = -a[0, 1] / a[0, 0]
+
+    _, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, h, E_x, nu_xy, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, 0, theta, phi)
+    _, sigma_phi_0, sigma_theta_0 = calculate_torus_stresses(R, r, h, E_x, nu_xy, 0, 0, 0, 0, 0, 0, 0, 0, 0, theta, phi)
+    resultants = np.zeros(np.broadcast(sigma_phi, sigma_theta).shape + (6,))
+    resultants[..., 0] = (sigma_phi - sigma_phi_0) * h
+    resultants[..., 1] = (sigma_theta - sigma_theta_0) * h
+    return resultants
+
+def torus_failure_map(layers, strengths, R, r, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, calculate_torus_stresses, n_grid=100, criterion='tsai_wu'):
+    """
+    Failure index at the bottom/mid/top of every ply over a full (theta, phi) grid.
+
+    strengths is (X_t, X_c, Y_t, Y_c, S), with compressive strengths positive.
+    The laminate x-axis is aligned with the hoop direction and is loaded by the
+    membrane resultants of torus_membrane_resultants. Returns theta, phi, the
+    failure indices (n_grid, n_grid, n_layers, 3) and the mid-plane strains.
+    """
+    thickness, angles, E1, E2, G12, nu12 = np.asarray(layers, dtype=float).T
+    z = np.concatenate(([0.0], np.cumsum(thickness))) - np.sum(thickness)/2
+    Q_bar = transform_stiffness_matrices(calculate_stiffness_matrices(E1, E2, G12, nu12), angles)
+    ABD = abd_matrices(Q_bar, z)
+
+    theta, phi = np.meshgrid(np.linspace(0, 2*np.pi, n_grid), np.linspace(0, 2*np.pi, n_grid))
+    resultants = torus_membrane_resultants(layers, R, r, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, calculate_torus_stresses, theta, phi)
+
+    # One factorised solve for every grid point
+    strains = solve(ABD, resultants.reshape(-1, 6).T).T.reshape(resultants.shape)
+    sigma = ply_point_stresses(Q_bar, z, strains, angles)
+    index = failure_criteria[criterion](sigma, strengths)
+
+    return theta, phi, index, strains
+
+def first_ply_failure_load(sigma, strengths, criterion='tsai_wu', tol=1e-6, max_iter=100, sigma_fixed=None):
+    """
+    Load factor at which the first ply fails, for every point at once.
+
+    sigma holds the load-proportional material-axis stresses
+    (..., n_layers, n_points, 3) for the reference load, and sigma_fixed
+    (broadcastable to sigma) any part that does not scale with the load, such
+    as residual stresses. Only sigma is scaled: the index is evaluated at
+    sigma_fixed + factor * sigma, so a vectorized bisection over all points
+    replaces repeated full reruns. Returns the per-point load factor (...,):
+    0 where sigma_fixed alone already fails, inf where the point does not fail
+    within 2**max_iter times the reference load.
+    """
+    index_fn = failure_criteria[criterion]
+    sigma_fixed = np.zeros_like(sigma) if sigma_fixed is None else np.asarray(sigma_fixed, dtype=float)
+
+    def peak_index(factor):
+        return np.max(index_fn(sigma_fixed + factor[..., np.newaxis, np.newaxis, np.newaxis] * sigma, strengths), axis=(-2, -1))
+
+    lo = np.zeros(sigma.shape[:-3])
+    failed_at_zero = peak_index(lo) >= 1
+    hi = np.where(failed_at_zero, 0.0, 1.0)
+    # Grow the upper bracket until every point has failed
+    for _ in range(max_iter):
+        count('first_ply_failure.iterations')
+        failed = failed_at_zero | (peak_index(hi) >= 1)
+        if np.all(failed):
+            break
+        lo = np.where(failed, lo, hi)
+        hi = np.where(failed, hi, 2*hi)
+
+    for _ in range(max_iter):
+        count('first_ply_failure.iterations')
+        mid = (lo + hi) / 2
+        failed = peak_index(mid) >= 1
+        lo = np.where(failed, lo, mid)
+        hi = np.where(failed, mid, hi)
+        if np.all(hi - lo <= tol * hi):
+            break
+
+    return np.where(peak_index(hi) >= 1, hi, np.inf)
 
 def calculate_stiffness_matrix(E1, E2, G12, nu12):
     nu21 = nu12 * E2 / E1
@@ -93,12 +378,13 @@ def calculate_stiffness_matrix(E1, E2, G12, nu12):
 def transform_stiffness_matrix(Q, angle):
     theta = np.radians(angle)
     c, s = np.cos(theta), np.sin(theta)
-    T = np.array([
-        [c**2, s**2, 2*c*s],
-        [s**2, c**2, -2*c*s],
-        [-c*s, c*s, c**2 - s**2]
+    # Engineering-strain (Reuter-adjusted) transformation; T_eps^T Q T_eps = T^-1 Q T^-T
+    T_eps = np.array([
+        [c**2, s**2, c*s],
+        [s**2, c**2, -c*s],
+        [-2*c*s, 2*c*s, c**2 - s**2]
     ])
-    return T.T @ Q @ T
+    return T_eps.T @ Q @ T_eps
 
 if __name__ == "__main__":
     from main import calculate_torus_stresses, fatigue_analysis
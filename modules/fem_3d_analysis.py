@@ -1,7 +1,9 @@
 import numpy as np
-from scipy.sparse import csr_matrix
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import coo_matrix, csr_matrix, identity, kron
 from scipy.sparse.linalg import spsolve
 from sklearn.neighbors import KDTree
+from modules.instrumentation import cache_access, count, report, span, traced
 
 def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
     print("3D Finite Element Analysis")
@@ -15,33 +17,69 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
     p_int = float(input("Enter internal pressure (p_int): "))
     p_ext = float(input("Enter external pressure (p_ext): "))
     n_elements = int(input("Enter number of elements: "))
+    n_sectors = int(input("Enter number of cyclic symmetry sectors (1 for full model): ") or 1)
+    target_error = float(input("Enter target relative error for adaptive refinement (0 for none): ") or 0)
 
-    # Generate mesh
-    nodes, elements = generate_torus_mesh(R, r, t, n_elements)
+    if target_error > 0:
+        # Refine the n_elements grid where the ZZ error estimate is largest
+        nodes, elements, U, _, history = adaptive_refinement(R, r, t, E, nu, p_int, p_ext, n_elements, target_error)
+        print(f"Adaptive refinement: {history[-1][0]} DOFs, estimated error {history[-1][1]:.2%}")
+    elif n_sectors > 1:
+        # Solve one sector per load harmonic and rebuild the full ring
+        nodes, elements, U = cyclic_symmetry_analysis(R, r, t, E, nu, p_int, p_ext, n_elements, n_sectors)
+    else:
+        # Generate mesh
+        nodes, elements = generate_torus_mesh(R, r, t, n_elements)
 
-    # Assemble global stiffness matrix and force vector
-    K, F = assemble_system(nodes, elements, E, nu, p_int, p_ext)
+        # Assemble global stiffness matrix and force vector
+        K, F = assemble_system(nodes, elements, E, nu, p_int, p_ext)
 
-    # Solve system
-    U = solve_system(K, F)
+        # Solve system
+        U = solve_system(K, F, rigid_body_constraints(nodes))
 
     # Post-process results
     stresses, strains = post_process(nodes, elements, U, E, nu)
+    nodal_stresses = recover_nodal_stresses(nodes, elements, U, E, nu)
+    principal = principal_stresses(nodal_stresses)
 
     # Display results
     print("\nFEM Analysis Results:")
     print(f"Max displacement: {np.max(np.abs(U)):.4e}")
-    print(f"Max von Mises stress: {np.max(stresses):.4e}")
+    print(f"Max von Mises stress: {np.max(von_mises(nodal_stresses)):.4e}")
+    print(f"Max principal stress: {np.max(principal[:, 0]):.4e}")
+    print(f"Min principal stress: {np.min(principal[:, 2]):.4e}")
     print(f"Max strain: {np.max(strains):.4e}")
 
+    # Probe the mid-surface at the inner equator, outer equator and crown
+    results = FEMResults(nodes, elements, U, E, nu)
+    probes = {'Inner equator': (R - r, 0, 0), 'Outer equator': (R + r, 0, 0), 'Crown': (R, 0, r)}
+    values = results.probe(np.array(list(probes.values())))
+    for name, vm, u in zip(probes, values['von_mises'], values['displacement']):
+        print(f"{name}: von Mises {vm:.4e}, displacement {np.linalg.norm(u):.4e}")
+
     # Visualize results
     create_advanced_animation(nodes, elements, U, stresses)
 
+    # Stage timings when instrumentation is enabled (TORUS_TRACE=1)
+    report()
+
     input("\nPress Enter to return to the main menu...")
 
+@traced('fem.mesh')
 def generate_torus_mesh(R, r, t, n):
-    theta = np.linspace(0, 2*np.pi, n)
-    phi = np.linspace(0, 2*np.pi, n)
+    # Both angles wrap around, so the mesh is a closed torus without seams
+    theta = np.linspace(0, 2*np.pi, n, endpoint=False)
+    phi = np.linspace(0, 2*np.pi, n, endpoint=False)
+    return torus_grid_mesh(R, r, t, phi, theta)
+
+def torus_grid_mesh(R, r, t, phi, theta, closed=True):
+    """
+    Hexahedral mesh on a (phi, theta) grid with two elements through the
+    thickness. phi always wraps around the tube; theta wraps around the major
+    axis only when closed, otherwise the grid spans an open sector.
+    Node (i, j, k) of the phi, theta and thickness grid is i*n_theta*3 + j*3 + k.
+    """
+    n_phi, n_theta = len(phi), len(theta)
     rho = np.linspace(r - t/2, r + t/2, 3)  # 3 layers for thickness
     theta, phi, rho = np.meshgrid(theta, phi, rho)
     
@@ -51,34 +89,24 @@ def generate_torus_mesh(R, r, t, n):
     
     nodes = np.vstack((x.ravel(), y.ravel(), z.ravel())).T
     
-    elements = []
-    for i in range(n-1):
-        for j in range(n-1):
-            for k in range(2):
-                element = [
-                    i*n*3 + j*3 + k,
-                    i*n*3 + j*3 + k + 1,
-                    (i+1)*n*3 + j*3 + k + 1,
-                    (i+1)*n*3 + j*3 + k,
-                    i*n*3 + j*3 + k + 3,
-                    i*n*3 + j*3 + k + 4,
-                    (i+1)*n*3 + j*3 + k + 4,
-                    (i+1)*n*3 + j*3 + k + 3
-                ]
-                elements.append(element)
-    
-    return nodes, np.array(elements)
-
-def assemble_system(nodes, elements, E, nu, p_int, p_ext):
-    n_nodes = len(nodes)
-    n_elements = len(elements)
+    n_el_theta = n_theta if closed else n_theta - 1
+    i, j, k = np.meshgrid(np.arange(n_phi), np.arange(n_el_theta), np.arange(2), indexing='ij')
+    i1, j1 = (i + 1) % n_phi, (j + 1) % n_theta
+    elements = np.stack([
+        i*n_theta*3 + j*3 + k,
+        i*n_theta*3 + j*3 + k + 1,
+        i1*n_theta*3 + j*3 + k + 1,
+        i1*n_theta*3 + j*3 + k,
+        i*n_theta*3 + j1*3 + k,
+        i*n_theta*3 + j1*3 + k + 1,
+        i1*n_theta*3 + j1*3 + k + 1,
+        i1*n_theta*3 + j1*3 + k
+    ], axis=-1).reshape(-1, 8)
     
-    # Initialize global stiffness matrix and force vector
-    K = np.zeros((3*n_nodes, 3*n_nodes))
-    F = np.zeros(3*n_nodes)
-    
-    # Element stiffness matrix for 8-node hexahedral element
-    D = E / ((1 + nu) * (1 - 2*nu)) * np.array([
+    return nodes, elements
+
+def elasticity_matrix(E, nu):
+    return E / ((1 + nu) * (1 - 2*nu)) * np.array([
         [1-nu, nu, nu, 0, 0, 0],
         [nu, 1-nu, nu, 0, 0, 0],
         [nu, nu, 1-nu, 0, 0, 0],
@@ -86,49 +114,134 @@ def assemble_system(nodes, elements, E, nu, p_int, p_ext):
         [0, 0, 0, 0, (1-2*nu)/2, 0],
         [0, 0, 0, 0, 0, (1-2*nu)/2]
     ])
+
+def hex_shape_functions(points):
+    """Trilinear shape functions N (..., 8) at natural coordinates (..., 3)"""
+    return np.prod(1 + hex_corners * points[..., np.newaxis, :], axis=-1) / 8
+
+def hex_shape_derivatives(points):
+    """Natural derivatives dN/dxi (..., 8, 3) at natural coordinates (..., 3)"""
+    terms = 1 + hex_corners * points[..., np.newaxis, :]
+    dN = np.empty(terms.shape)
+    dN[..., 0] = hex_corners[:, 0] * terms[..., 1] * terms[..., 2] / 8
+    dN[..., 1] = hex_corners[:, 1] * terms[..., 0] * terms[..., 2] / 8
+    dN[..., 2] = hex_corners[:, 2] * terms[..., 0] * terms[..., 1] / 8
+    return dN
+
+def element_b_matrices(nodes, elements, points=None):
+    """
+    Strain-displacement matrices B (n_elements, n_points, 6, 24) and Jacobian
+    determinants (n_elements, n_points) of 8-node hexahedra, at the 2x2x2 Gauss
+    points unless other natural coordinates are given.
+    """
+    if points is None:
+        points = gauss_points
+    dN = hex_shape_derivatives(points)
+    X = nodes[elements]
+    J = np.einsum('gai,eaj->egij', dN, X)
+    det_J = np.linalg.det(J)
+    dN_dx = np.linalg.solve(J, np.broadcast_to(dN.transpose(0, 2, 1), J.shape[:2] + (3, 8)))
     
-    for el in elements:
-        el_nodes = nodes[el]
-        J = el_nodes[1:] - el_nodes[0]
-        det_J = np.linalg.det(J)
-        B = np.zeros((6, 24))
-        
-        for i in range(8):
-            dN = np.array([
-                [(-1)**(i+1), 0, 0],
-                [0, (-1)**((i//2)+1), 0],
-                [0, 0, (-1)**((i//4)+1)]
-            ]) / 8
-            B_i = np.zeros((6, 3))
-            B_i[:3, :] = dN
-            B_i[3:, :] = dN[[1,2,0], :]
-            B[:, 3*i:3*(i+1)] = B_i
-        
-        k_el = det_J * B.T @ D @ B
-        
-        for i in range(8):
-            for j in range(8):
-                K[3*el[i]:3*(el[i]+1), 3*el[j]:3*(el[j]+1)] += k_el[3*i:3*(i+1), 3*j:3*(j+1)]
-        
-        # Apply pressure loads
-        for face in range(6):
-            face_nodes = el[face_connectivity[face]]
-            face_center = np.mean(nodes[face_nodes], axis=0)
-            normal = face_normals[face]
-            pressure = p_int if np.dot(face_center - nodes[el[0]], normal) > 0 else p_ext
-            F[3*face_nodes] += pressure * normal[0] * det_J / 4
-            F[3*face_nodes+1] += pressure * normal[1] * det_J / 4
-            F[3*face_nodes+2] += pressure * normal[2] * det_J / 4
-    
-    return csr_matrix(K), F
-
-def solve_system(K, F):
+    B = np.zeros(J.shape[:2] + (6, 24))
+    B[..., 0, 0::3] = dN_dx[..., 0, :]
+    B[..., 1, 1::3] = dN_dx[..., 1, :]
+    B[..., 2, 2::3] = dN_dx[..., 2, :]
+    B[..., 3, 0::3] = dN_dx[..., 1, :]
+    B[..., 3, 1::3] = dN_dx[..., 0, :]
+    B[..., 4, 1::3] = dN_dx[..., 2, :]
+    B[..., 4, 2::3] = dN_dx[..., 1, :]
+    B[..., 5, 0::3] = dN_dx[..., 2, :]
+    B[..., 5, 2::3] = dN_dx[..., 0, :]
+    return B, det_J
+
+def element_stiffness_matrices(nodes, elements, D, chunk_size=2000):
+    """Element stiffness matrices (n_elements, 24, 24) by 2x2x2 Gauss quadrature"""
+    k_el = np.empty((len(elements), 24, 24))
+    for start in range(0, len(elements), chunk_size):
+        B, det_J = element_b_matrices(nodes, elements[start:start + chunk_size])
+        k_el[start:start + chunk_size] = np.einsum('egki,kl,eglj,eg->eij', B, D, B, np.abs(det_J), optimize=True)
+    return k_el
+
+def element_dofs(elements):
+    return (3 * elements[:, :, np.newaxis] + np.arange(3)).reshape(len(elements), 24)
+
+def assemble_matrix(k_el, elements, n_nodes):
+    dofs = element_dofs(elements)
+    rows = np.repeat(dofs, 24, axis=1).ravel()
+    cols = np.tile(dofs, (1, 24)).ravel()
+    return coo_matrix((k_el.ravel(), (rows, cols)), shape=(3*n_nodes, 3*n_nodes)).tocsr()
+
+def pressure_loads(nodes, elements, p_int, p_ext):
+    """
+    Nodal forces from pressure on the inner (xi = -1) and outer (xi = +1)
+    boundary faces. p_int and p_ext may be scalars or one value per element.
+    """
+    n_elements = len(elements)
+    pressure = np.concatenate((np.broadcast_to(p_int, n_elements), np.broadcast_to(p_ext, n_elements)))
+    return pressure_load_matrix(nodes, elements) @ pressure
+
+def pressure_load_matrix(nodes, elements):
+    """
+    Sparse matrix (n_dofs, 2*n_elements) mapping per-element inner then outer
+    face pressures to nodal forces, for loads that change while the mesh does not.
+    """
+    n_elements = len(elements)
+    faces = np.concatenate((elements[:, thickness_faces[0]], elements[:, thickness_faces[1]]))
+    
+    # A face is on the surface when no other element shares it
+    _, inverse, counts = np.unique(np.sort(faces, axis=1), axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.ravel()] == 1
+    faces, columns = faces[boundary], np.arange(2 * n_elements)[boundary]
+    owner = np.tile(np.arange(n_elements), 2)[boundary]
+    
+    corners = nodes[faces]
+    area = 0.5 * np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1])
+    # Pressure pushes into the wall, i.e. towards the owning element
+    into_element = np.mean(nodes[elements[owner]], axis=1) - np.mean(corners, axis=1)
+    area *= np.sign(np.sum(area * into_element, axis=1))[:, np.newaxis]
+    
+    # Each face node takes a quarter of the face force
+    rows = 3 * faces[:, :, np.newaxis] + np.arange(3)
+    values = np.broadcast_to(area[:, np.newaxis, :] / 4, rows.shape)
+    cols = np.broadcast_to(columns[:, np.newaxis, np.newaxis], rows.shape)
+    return coo_matrix((values.ravel(), (rows.ravel(), cols.ravel())), shape=(3 * len(nodes), 2 * n_elements)).tocsr()
+
+@traced('fem.assemble')
+def assemble_system(nodes, elements, E, nu, p_int, p_ext):
+    n_nodes = len(nodes)
+    
+    # Element stiffness matrices for 8-node hexahedral elements, assembled in one sparse pass
+    D = elasticity_matrix(E, nu)
+    with span('fem.element_matrices', n_elements=len(elements)):
+        k_el = element_stiffness_matrices(nodes, elements, D)
+    with span('fem.scatter'):
+        K = assemble_matrix(k_el, elements, n_nodes)
+    
+    # Apply pressure loads
+    with span('fem.pressure_loads'):
+        F = pressure_loads(nodes, elements, p_int, p_ext)
+    
+    return K, F
+
+def rigid_body_constraints(nodes):
+    """
+    Six DOFs (3-2-1 scheme) that remove rigid body motion without restraining
+    self-equilibrated loads such as pressure.
+    """
+    a, b, c = np.argmax(nodes[:, 0]), np.argmin(nodes[:, 0]), np.argmax(nodes[:, 1])
+    return np.array([3*a, 3*a + 1, 3*a + 2, 3*b + 1, 3*b + 2, 3*c + 2])
+
+@traced('fem.solve')
+def solve_system(K, F, fixed_dofs=None):
     # Apply boundary conditions (fix some nodes)
-    fixed_dofs = np.arange(3)  # Fix first node for simplicity
+    if fixed_dofs is None:
+        fixed_dofs = np.arange(3)  # Fix first node for simplicity
     free_dofs = np.setdiff1d(np.arange(K.shape[0]), fixed_dofs)
+    count('fem.solve.dofs', len(free_dofs))
+    count('fem.solve.nnz', K.nnz)
     
-    # Solve the system
-    U_free = spsolve(K[free_dofs][:, free_dofs], F[free_dofs])
+    # Solve the system; K is symmetric, so order for A^T + A rather than the default column ordering
+    U_free = spsolve(K[free_dofs][:, free_dofs].tocsc(), F[free_dofs], permc_spec='MMD_AT_PLUS_A')
     
     # Reconstruct full displacement vector
     U = np.zeros(K.shape[0])
@@ -136,41 +249,476 @@ def solve_system(K, F):
     
     return U
 
+@traced('fem.post_process')
 def post_process(nodes, elements, U, E, nu):
-    n_elements = len(elements)
-    stresses = np.zeros((n_elements, 6))
-    strains = np.zeros((n_elements, 6))
+    """
+    Element-centre stresses and strains (n_elements, 6) for all elements in one
+    contraction. U may hold one load case per column, giving (n_cases, n_elements, 6).
+    """
+    D = elasticity_matrix(E, nu)
+    B, _ = element_b_matrices(nodes, elements, np.zeros((1, 3)))
+    strains = np.einsum('ejk,ek...->...ej', B[:, 0], U[element_dofs(elements)])
+    stresses = strains @ D.T
     
-    D = E / ((1 + nu) * (1 - 2*nu)) * np.array([
-        [1-nu, nu, nu, 0, 0, 0],
-        [nu, 1-nu, nu, 0, 0, 0],
-        [nu, nu, 1-nu, 0, 0, 0],
-        [0, 0, 0, (1-2*nu)/2, 0, 0],
-        [0, 0, 0, 0, (1-2*nu)/2, 0],
-        [0, 0, 0, 0, 0, (1-2*nu)/2]
-    ])
+    return stresses, strains
+
+def nodal_averaging_matrix(elements, n_nodes):
+    """
+    Sparse incidence matrix (n_nodes, n_elements*8) that averages element-corner
+    values (ordered element by element) onto the nodes.
+    """
+    corners = elements.ravel()
+    valence = np.bincount(corners, minlength=n_nodes)
+    weights = 1.0 / np.maximum(valence, 1)
+    return coo_matrix((weights[corners], (corners, np.arange(len(corners)))), shape=(n_nodes, len(corners))).tocsr()
+
+@traced('fem.stress_recovery')
+def recover_nodal_stresses(nodes, elements, U, E, nu, averaging=None):
+    """
+    Nodal stresses (n_nodes, 6): Gauss-point stresses are extrapolated to the
+    element corners and averaged through the incidence matrix. Pass averaging
+    from nodal_averaging_matrix to reuse it across calls; U may hold one load
+    case per column, giving (n_cases, n_nodes, 6).
+    """
+    if averaging is None:
+        averaging = nodal_averaging_matrix(elements, len(nodes))
+    sigma, _ = element_gauss_stresses(nodes, elements, U, elasticity_matrix(E, nu))
+    corners = np.einsum('ag,...egc->...eac', gauss_extrapolation, sigma)
+    
+    # One sparse product for all cases and components
+    cases = corners.shape[:-3]
+    corners = np.moveaxis(corners.reshape(cases + (-1, 6)), -2, 0).reshape(averaging.shape[1], -1)
+    nodal = (averaging @ corners).reshape((len(nodes),) + cases + (6,))
+    return np.moveaxis(nodal, 0, -2)
+
+def principal_stresses(stress):
+    """Principal stresses (..., 3), largest first, of Voigt stress vectors (..., 6)"""
+    s = np.asarray(stress)
+    tensor = np.stack([
+        np.stack([s[..., 0], s[..., 3], s[..., 5]], axis=-1),
+        np.stack([s[..., 3], s[..., 1], s[..., 4]], axis=-1),
+        np.stack([s[..., 5], s[..., 4], s[..., 2]], axis=-1)
+    ], axis=-2)
+    return np.linalg.eigvalsh(tensor)[..., ::-1]
+
+def generate_sector_mesh(R, r, t, n, n_sectors):
+    """
+    Mesh of one 2*pi/n_sectors sector of the torus from generate_torus_mesh(R, r, t, n).
+    Returns nodes, elements and the node indices on the theta = 0 (left) and
+    theta = 2*pi/n_sectors (right) cut faces, matched pairwise.
+    """
+    if n % n_sectors:
+        raise ValueError("n must be a multiple of n_sectors")
+    m = n // n_sectors
+    phi = np.linspace(0, 2*np.pi, n, endpoint=False)
+    theta = np.linspace(0, 2*np.pi / n_sectors, m + 1)
+    nodes, elements = torus_grid_mesh(R, r, t, phi, theta, closed=False)
+    
+    i, k = np.meshgrid(np.arange(n), np.arange(3), indexing='ij')
+    left = (i*(m + 1)*3 + k).ravel()
+    right = left + m*3
+    return nodes, elements, left, right
+
+def rotation_z(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def cyclic_transformation(n_nodes, left, right, harmonic, n_sectors):
+    """
+    Sparse complex matrix T mapping the independent sector DOFs (everything
+    except the right cut face) to all sector DOFs. Right-face displacements
+    follow from the left face of the next sector: u_right = exp(i h alpha) R(alpha) u_left.
+    """
+    alpha = 2*np.pi / n_sectors
+    independent = np.setdiff1d(np.arange(3*n_nodes), (3*right[:, np.newaxis] + np.arange(3)).ravel())
+    column = np.full(3*n_nodes, -1)
+    column[independent] = np.arange(len(independent))
     
-    for i, el in enumerate(elements):
-        el_nodes = nodes[el]
-        J = el_nodes[1:] - el_nodes[0]
-        B = np.zeros((6, 24))
+    block = np.exp(1j * harmonic * alpha) * rotation_z(alpha)
+    a, b = np.meshgrid(np.arange(3), np.arange(3), indexing='ij')
+    rows = np.concatenate((independent, (3*right[:, np.newaxis, np.newaxis] + a).ravel()))
+    cols = np.concatenate((column[independent], column[3*left[:, np.newaxis, np.newaxis] + b].ravel()))
+    values = np.concatenate((np.ones(len(independent)), np.tile(block.ravel(), len(right))))
+    return coo_matrix((values, (rows, cols)), shape=(3*n_nodes, len(independent))).tocsr()
+
+def sector_pressures(p, n_sectors, n_elements):
+    """Broadcast a scalar, per-sector or per-element pressure to (n_sectors, n_elements)"""
+    p = np.asarray(p, dtype=float)
+    if p.ndim == 1:
+        p = p[:, np.newaxis]
+    return np.broadcast_to(p, (n_sectors, n_elements))
+
+def _solve_harmonic(args):
+    """Solve one circumferential harmonic on the sector (top level so it can run in a worker process)"""
+    K, F, left, right, harmonic, n_sectors = args
+    T = cyclic_transformation(K.shape[0] // 3, left, right, harmonic, n_sectors)
+    K_h = (T.conj().T @ K @ T).tocsc()
+    if harmonic in (0, 1, n_sectors - 1):
+        # These harmonics contain the rigid body modes of the free ring; weak springs
+        # make them solvable without loading a self-equilibrated structure
+        K_h = K_h + 1e-9 * np.mean(np.abs(K_h.diagonal())) * identity(K_h.shape[0], format='csc')
+    return T @ spsolve(K_h, T.conj().T @ F)
+
+def cyclic_symmetry_analysis(R, r, t, E, nu, p_int, p_ext, n, n_sectors, n_workers=1):
+    """
+    Solve the torus of generate_torus_mesh(R, r, t, n) on a single sector.
+
+    p_int and p_ext are scalars, one value per sector (n_sectors,) or one value
+    per sector element (n_sectors, n_sector_elements). The sector loads are split
+    into circumferential Fourier harmonics, each harmonic is solved on the sector
+    with a cyclic constraint (optionally in n_workers processes) and the ring is
+    rebuilt by the inverse transform. Harmonics without load are skipped, so a
+    uniform pressure costs one sector solve.
+    Returns nodes, elements and U in the numbering of generate_torus_mesh.
+    """
+    with span('fem.cyclic.mesh'):
+        nodes, elements, left, right = generate_sector_mesh(R, r, t, n, n_sectors)
+    
+    with span('fem.cyclic.assemble'):
+        K = assemble_matrix(element_stiffness_matrices(nodes, elements, elasticity_matrix(E, nu)), elements, len(nodes))
+    
+    # Harmonic load amplitudes f_h = (1/N) sum_s f_s exp(-i h s alpha); pressure loads are linear in p
+    with span('fem.cyclic.loads'):
+        p_int = np.fft.fft(sector_pressures(p_int, n_sectors, len(elements)), axis=0) / n_sectors
+        p_ext = np.fft.fft(sector_pressures(p_ext, n_sectors, len(elements)), axis=0) / n_sectors
+        scale = max(np.max(np.abs(p_int)), np.max(np.abs(p_ext)), np.finfo(float).tiny)
+        tasks = []
+        for h in range(n_sectors // 2 + 1):
+            if max(np.max(np.abs(p_int[h])), np.max(np.abs(p_ext[h]))) <= 1e-12 * scale:
+                continue
+            F_h = (pressure_loads(nodes, elements, p_int[h].real, p_ext[h].real)
+                   + 1j * pressure_loads(nodes, elements, p_int[h].imag, p_ext[h].imag))
+            tasks.append((K, F_h, left, right, h, n_sectors))
+    count('fem.cyclic.harmonics', len(tasks))
+    count('fem.solve.dofs', len(tasks) * (K.shape[0] - 3*len(right)))
+    
+    with span('fem.cyclic.solve', harmonics=len(tasks)):
+        if n_workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(n_workers) as executor:
+                solutions = list(executor.map(_solve_harmonic, tasks))
+        else:
+            solutions = [_solve_harmonic(task) for task in tasks]
+    
+    with span('fem.cyclic.expand'):
+        # Conjugate symmetry of a real field fills harmonics above N/2
+        U_h = np.zeros((n_sectors, K.shape[0]), dtype=complex)
+        for (_, _, _, _, h, _), U in zip(tasks, solutions):
+            U_h[h] = U
+            if 0 < h < n_sectors - h:
+                U_h[n_sectors - h] = U.conj()
+        # u_s = sum_h U_h exp(i h s alpha) in the sector frame, then rotated into place
+        U_s = (np.fft.ifft(U_h, axis=0) * n_sectors).real.reshape(n_sectors, -1, 3)
+        rotations = np.stack([rotation_z(2*np.pi * s / n_sectors) for s in range(n_sectors)])
+        U_s = np.einsum('sij,snj->sni', rotations, U_s)
+        
+        # Drop each sector's right face (it is the next sector's left face) and interleave into ring order
+        m = n // n_sectors
+        U_s = U_s.reshape(n_sectors, n, m + 1, 3, 3)[:, :, :m]
+        U = U_s.transpose(1, 0, 2, 3, 4).reshape(-1)
+    
+    full_nodes, full_elements = generate_torus_mesh(R, r, t, n)
+    return full_nodes, full_elements, U
+
+def element_gauss_stresses(nodes, elements, U, D, chunk_size=2000):
+    """
+    Stresses (n_elements, 8, 6) at the 2x2x2 Gauss points and the Jacobian
+    determinants (n_elements, 8); U may hold one load case per column, giving
+    (n_cases, n_elements, 8, 6).
+    """
+    U_e = U[element_dofs(elements)]
+    sigma = np.empty(U_e.shape[2:] + (len(elements), 8, 6))
+    det_J = np.empty((len(elements), 8))
+    for start in range(0, len(elements), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        B, det_J[chunk] = element_b_matrices(nodes, elements[chunk])
+        sigma[..., chunk, :, :] = np.einsum('ij,egjk,ek...->...egi', D, B, U_e[chunk], optimize=True)
+    return sigma, det_J
+
+def zz_error_estimate(nodes, elements, U, E, nu, constraints=None):
+    """
+    Zienkiewicz-Zhu error estimate. Gauss-point stresses are extrapolated to
+    the element corners and averaged onto the nodes; the recovered field is
+    interpolated back to the Gauss points and compared with the raw element
+    stresses in the energy norm. constraints is the (P, regular) pair from
+    hanging_node_constraints, so hanging nodes follow their edge.
+    Returns the element error indicators and the relative error of the solution.
+    """
+    D = elasticity_matrix(E, nu)
+    sigma, det_J = element_gauss_stresses(nodes, elements, U, D)
+    N_gauss = hex_shape_functions(gauss_points)
+    
+    # Nodal recovery by averaging the extrapolated corner stresses
+    sigma_corners = np.einsum('ag,egc->eac', gauss_extrapolation, sigma).reshape(-1, 6)
+    sigma_nodes = nodal_averaging_matrix(elements, len(nodes)) @ sigma_corners
+    if constraints is not None:
+        P, regular = constraints
+        sigma_nodes = P @ sigma_nodes[regular]
+    
+    sigma_star = np.einsum('ga,eac->egc', N_gauss, sigma_nodes[elements])
+    C = np.linalg.inv(D)
+    error = sigma_star - sigma
+    eta = np.einsum('egi,ij,egj,eg->e', error, C, error, np.abs(det_J))
+    energy = np.einsum('egi,ij,egj,eg->', sigma, C, sigma, np.abs(det_J))
+    return np.sqrt(eta), np.sqrt(np.sum(eta) / (energy + np.sum(eta)))
+
+def quadtree_mesh(R, r, t, n, cells, max_level):
+    """
+    Hexahedral mesh from quadtree leaf cells (level, i, j) over the (phi, theta)
+    grid of generate_torus_mesh(R, r, t, n); a level-l cell spans 2*pi/(n*2**l)
+    in both angles. Each cell gives two elements through the thickness.
+    Returns nodes, elements, per-element cell keys (for caching element
+    matrices) and the hanging nodes as rows (node, edge end a, edge end b).
+    """
+    n_fine = n * 2**max_level
+    cells = np.asarray(cells)
+    size = 2**(max_level - cells[:, 0])
+    I0, J0 = cells[:, 1] * size, cells[:, 2] * size
+    
+    # Corner (phi, theta, thickness) offsets in element node order
+    corner_i = np.array([0, 0, 1, 1, 0, 0, 1, 1])
+    corner_j = np.array([0, 0, 0, 0, 1, 1, 1, 1])
+    corner_k = np.array([0, 1, 1, 0, 0, 1, 1, 0])
+    k = np.arange(2)
+    
+    def node_key(I, J, kk):
+        return ((I % n_fine) * n_fine + J % n_fine) * 3 + kk
+    
+    keys = node_key((I0[:, np.newaxis, np.newaxis] + size[:, np.newaxis, np.newaxis] * corner_i),
+                    (J0[:, np.newaxis, np.newaxis] + size[:, np.newaxis, np.newaxis] * corner_j),
+                    k[:, np.newaxis] + corner_k).reshape(-1, 8)
+    node_keys, elements = np.unique(keys, return_inverse=True)
+    elements = elements.reshape(-1, 8)
+    
+    I, J, kk = node_keys // 3 // n_fine, node_keys // 3 % n_fine, node_keys % 3
+    phi, theta = 2*np.pi * I / n_fine, 2*np.pi * J / n_fine
+    rho = r - t/2 + kk * t/2
+    nodes = np.column_stack(((R + rho*np.cos(phi)) * np.cos(theta), (R + rho*np.cos(phi)) * np.sin(theta), rho*np.sin(phi)))
+    
+    element_keys = ((cells[:, 0, np.newaxis] * n_fine + I0[:, np.newaxis]) * n_fine + J0[:, np.newaxis]) * 2 + k
+    
+    # A node at the midpoint of a cell edge hangs on that edge (2:1 balance allows no other case)
+    half = size // 2
+    edges = [(half, 0, 0, 0, size, 0), (half, size, 0, size, size, size),
+             (0, half, 0, 0, 0, size), (size, half, size, 0, size, size)]
+    hanging = []
+    for mi, mj, ai, aj, bi, bj in edges:
+        for kk in range(3):
+            mid = node_key(I0 + mi, J0 + mj, kk)
+            position = np.minimum(np.searchsorted(node_keys, mid), len(node_keys) - 1)
+            found = (node_keys[position] == mid) & (size > 1)
+            hanging.append(np.column_stack((position, np.searchsorted(node_keys, node_key(I0 + ai, J0 + aj, kk)),
+                                            np.searchsorted(node_keys, node_key(I0 + bi, J0 + bj, kk))))[found])
+    hanging = np.unique(np.concatenate(hanging), axis=0)
+    
+    return nodes, elements, element_keys.ravel(), hanging
+
+def hanging_node_constraints(n_nodes, hanging):
+    """
+    Node interpolation P (n_nodes, n_regular) with u_nodes = P u_regular: regular
+    nodes map to themselves and a hanging node to the mean of its edge ends.
+    Returns P and the regular node indices.
+    """
+    is_hanging = np.zeros(n_nodes, dtype=bool)
+    is_hanging[hanging[:, 0]] = True
+    regular = np.flatnonzero(~is_hanging)
+    C = coo_matrix((np.concatenate((np.ones(len(regular)), np.full(2*len(hanging), 0.5))),
+                    (np.concatenate((regular, hanging[:, 0], hanging[:, 0])),
+                     np.concatenate((regular, hanging[:, 1], hanging[:, 2])))), shape=(n_nodes, n_nodes)).tocsr()
+    # Edge ends may hang on a coarser edge themselves; substitute until only regular nodes remain
+    P = C
+    while P[:, is_hanging].nnz:
+        P = C @ P
+    return P[:, regular], regular
+
+def cell_children(cell):
+    level, i, j = cell
+    return [(level + 1, 2*i + di, 2*j + dj) for di in (0, 1) for dj in (0, 1)]
+
+def refine_cells(cells, marked):
+    """Replace the marked (level, i, j) cells by their four children"""
+    for cell in marked:
+        cells.discard(cell)
+        cells.update(cell_children(cell))
+    return cells
+
+def balance_cells(cells, n):
+    """Refine cells until edge neighbours differ by at most one level (2:1 balance)"""
+    def containing_cell(level, i, j):
+        for l in range(level, -1, -1):
+            cell = (l, i >> (level - l), j >> (level - l))
+            if cell in cells:
+                return cell
+        return None
+    
+    stack = list(cells)
+    while stack:
+        cell = stack.pop()
+        level, i, j = cell
+        if cell not in cells or level < 2:
+            continue
+        # Every edge neighbour of the parent must be at least at the parent level
+        parent_level, size = level - 1, n * 2**(level - 1)
+        for ni, nj in ((i//2 - 1, j//2), (i//2 + 1, j//2), (i//2, j//2 - 1), (i//2, j//2 + 1)):
+            neighbour = containing_cell(parent_level, ni % size, nj % size)
+            if neighbour is not None and neighbour[0] < parent_level:
+                refine_cells(cells, [neighbour])
+                stack.extend(cell_children(neighbour))
+                stack.append(cell)
+    return cells
+
+@traced('fem.adaptive')
+def adaptive_refinement(R, r, t, E, nu, p_int, p_ext, n=8, target_error=0.05, max_level=3, max_iterations=10, fraction=0.5):
+    """
+    h-adaptive analysis: solve, estimate the ZZ error, subdivide the cells that
+    carry `fraction` of the squared error (Dorfler marking), balance, and repeat
+    until the relative error reaches target_error. Refinement is in (phi, theta) only;
+    element matrices of unchanged cells are reused between iterations.
+    p_int and p_ext are scalars or functions of the element-centre (phi, theta).
+    Returns nodes, elements, U, the element errors and the history of (n_dofs, error).
+    """
+    D = elasticity_matrix(E, nu)
+    cells = {(0, i, j) for i in range(n) for j in range(n)}
+    element_cache = {}
+    history = []
+    
+    for iteration in range(max_iterations):
+        with span('fem.adaptive.mesh', iteration=iteration):
+            cell_list = sorted(cells)
+            nodes, elements, keys, hanging = quadtree_mesh(R, r, t, n, cell_list, max_level)
+            P, regular = hanging_node_constraints(len(nodes), hanging)
+            T = kron(P, identity(3), format='csr')
+        
+        with span('fem.adaptive.assemble'):
+            missing = [e for e, key in enumerate(keys) if key not in element_cache]
+            for e, key in enumerate(keys):
+                cache_access('fem.element_matrices', key in element_cache)
+            if missing:
+                k_new = element_stiffness_matrices(nodes, elements[missing], D)
+                element_cache.update(zip(keys[missing], k_new))
+            K = assemble_matrix(np.stack([element_cache[key] for key in keys]), elements, len(nodes))
+            
+            centre = np.mean(nodes[elements], axis=1)
+            phi = np.arctan2(centre[:, 2], np.hypot(centre[:, 0], centre[:, 1]) - R)
+            theta = np.arctan2(centre[:, 1], centre[:, 0])
+            pressures = [p(phi, theta) if callable(p) else p for p in (p_int, p_ext)]
+            F = pressure_loads(nodes, elements, *pressures)
+        
+        U = T @ solve_system(T.T @ K @ T, T.T @ F, rigid_body_constraints(nodes[regular]))
+        
+        with span('fem.adaptive.estimate'):
+            errors, relative_error = zz_error_estimate(nodes, elements, U, E, nu, (P, regular))
+        history.append((3 * len(regular), relative_error))
+        count('fem.adaptive.iterations')
         
-        for j in range(8):
-            dN = np.array([
-                [(-1)**(j+1), 0, 0],
-                [0, (-1)**((j//2)+1), 0],
-                [0, 0, (-1)**((j//4)+1)]
-            ]) / 8
-            B_j = np.zeros((6, 3))
-            B_j[:3, :] = dN
-            B_j[3:, :] = dN[[1,2,0], :]
-            B[:, 3*j:3*(j+1)] = B_j
+        if relative_error <= target_error:
+            break
         
-        el_U = U[np.repeat(3*el, 3) + np.tile(np.arange(3), 8)]
-        strains[i] = B @ el_U
-        stresses[i] = D @ strains[i]
+        # Dorfler marking: the largest cell errors that together make up `fraction` of the squared error
+        cell_errors = np.sum(errors.reshape(-1, 2)**2, axis=1)
+        cell_errors[np.array([cell[0] for cell in cell_list]) >= max_level] = 0
+        order = np.argsort(cell_errors)[::-1]
+        n_marked = np.searchsorted(np.cumsum(cell_errors[order]), fraction * np.sum(cell_errors)) + 1
+        marked = [cell_list[c] for c in order[:n_marked] if cell_errors[c] > 0]
+        if not marked:
+            break
+        balance_cells(refine_cells(cells, marked), n)
     
-    return stresses, strains
+    return nodes, elements, U, errors, history
+
+def von_mises(stress):
+    """Von Mises stress of Voigt stress vectors (..., 6) ordered xx, yy, zz, xy, yz, zx"""
+    s = np.asarray(stress)
+    return np.sqrt(0.5 * ((s[..., 0] - s[..., 1])**2 + (s[..., 1] - s[..., 2])**2 + (s[..., 2] - s[..., 0])**2)
+                   + 3 * np.sum(s[..., 3:]**2, axis=-1))
+
+class FEMResults:
+    """
+    Queryable view of a solved mesh. KD-trees over the nodes and element
+    centroids are built once; probes, radius queries and interpolation at
+    arbitrary points are then O(log n) per point.
+    """
+
+    def __init__(self, nodes, elements, U, E, nu, n_candidates=8):
+        self.nodes = nodes
+        self.elements = elements
+        self.U = U
+        self.D = elasticity_matrix(E, nu)
+        self.n_candidates = n_candidates
+        self.centroids = np.mean(nodes[elements], axis=1)
+        self.node_tree = KDTree(nodes)
+        self.centroid_tree = KDTree(self.centroids)
+        
+        self.element_stresses, _ = post_process(nodes, elements, U, E, nu)
+    
+    def nearest_nodes(self, points, k=1):
+        """Distances and indices (n_points, k) of the nearest nodes"""
+        return self.node_tree.query(np.atleast_2d(points), k=k)
+    
+    def nodes_within(self, points, radius):
+        """Node indices within radius of each point (one array per point)"""
+        return self.node_tree.query_radius(np.atleast_2d(points), r=radius)
+    
+    def elements_within(self, points, radius):
+        """Indices of the elements whose centroid lies within radius of each point"""
+        return self.centroid_tree.query_radius(np.atleast_2d(points), r=radius)
+    
+    def locate(self, points, tol=1e-8, max_iter=20):
+        """
+        Containing element and natural coordinates of each point. The nearest
+        centroids are candidates; each is inverted by Newton iteration on
+        x(xi) = N(xi) X_e. Points outside every candidate (e.g. just off the
+        faceted surface) take the closest candidate with xi clipped to the element.
+        Returns elements (n_points,), xi (n_points, 3) and an inside flag.
+        """
+        points = np.atleast_2d(points)
+        _, candidates = self.centroid_tree.query(points, k=min(self.n_candidates, len(self.elements)))
+        X = self.nodes[self.elements[candidates]].reshape(-1, 8, 3)
+        target = np.repeat(points, candidates.shape[1], axis=0)
+        xi = np.zeros((len(X), 3))
+        active = np.arange(len(X))
+        for _ in range(max_iter):
+            residual = np.einsum('na,nai->ni', hex_shape_functions(xi[active]), X[active]) - target[active]
+            J = np.einsum('nai,naj->nji', hex_shape_derivatives(xi[active]), X[active])
+            step = np.linalg.solve(J, residual[..., np.newaxis])[..., 0]
+            xi[active] = np.clip(xi[active] - step, -2, 2)
+            # Stop on convergence, and drop candidates that have left the element for good
+            keep = (np.max(np.abs(step), axis=1) > tol) & (np.max(np.abs(xi[active]), axis=1) < 2)
+            active = active[keep]
+            if not len(active):
+                break
+        
+        # Prefer the candidate whose natural coordinates are least outside [-1, 1]
+        xi = xi.reshape(candidates.shape + (3,))
+        excess = np.max(np.abs(xi), axis=-1)
+        best = np.argmin(excess, axis=1)
+        rows = np.arange(len(points))
+        return candidates[rows, best], np.clip(xi[rows, best], -1, 1), excess[rows, best] <= 1 + 1e-6
+    
+    def displacement(self, points, location=None):
+        """Interpolated displacement (n_points, 3); location is a previous locate() result"""
+        elements, xi, _ = location or self.locate(points)
+        u_e = self.U.reshape(-1, 3)[self.elements[elements]]
+        return np.einsum('na,nai->ni', hex_shape_functions(xi), u_e)
+    
+    def stress(self, points, location=None):
+        """Stress (n_points, 6) from the displacement gradient at each point"""
+        elements, xi, _ = location or self.locate(points)
+        X = self.nodes[self.elements[elements]]
+        u_e = self.U.reshape(-1, 3)[self.elements[elements]]
+        dN = hex_shape_derivatives(xi)
+        J = np.einsum('nai,naj->nij', dN, X)
+        dN_dx = np.linalg.solve(J, dN.transpose(0, 2, 1))
+        grad = np.einsum('nia,naj->nij', dN_dx, u_e)  # grad[i, j] = du_j / dx_i
+        strain = np.stack([grad[:, 0, 0], grad[:, 1, 1], grad[:, 2, 2],
+                           grad[:, 0, 1] + grad[:, 1, 0], grad[:, 1, 2] + grad[:, 2, 1], grad[:, 0, 2] + grad[:, 2, 0]], axis=1)
+        return strain @ self.D.T
+    
+    def probe(self, points):
+        """Displacement, stress and von Mises stress at each point, plus whether it lies inside the mesh"""
+        location = self.locate(points)
+        stress = self.stress(points, location)
+        return {'displacement': self.displacement(points, location), 'stress': stress,
+                'von_mises': von_mises(stress), 'element': location[0], 'inside': location[2]}
 
 # Face connectivity and normals for hexahedral elements
 face_connectivity = [
@@ -191,6 +739,30 @@ face_normals = [
     [-1, 0, 0]
 ]
 
+# Natural coordinates of the hexahedron corners in element node order
+# (xi through the thickness, eta around the tube, zeta around the major axis)
+hex_corners = np.array([
+    [-1, -1, -1],
+    [1, -1, -1],
+    [1, 1, -1],
+    [-1, 1, -1],
+    [-1, -1, 1],
+    [1, -1, 1],
+    [1, 1, 1],
+    [-1, 1, 1]
+])
+
+gauss_points = hex_corners / np.sqrt(3)
+
+# Maps the eight Gauss-point values of a field to the element corners
+gauss_extrapolation = np.linalg.inv(np.prod(1 + hex_corners * gauss_points[:, np.newaxis, :], axis=-1) / 8)
+
+# Inner (xi = -1) and outer (xi = +1) faces, corners in cyclic order
+thickness_faces = [
+    [0, 3, 7, 4],
+    [1, 2, 6, 5]
+]
+
 if __name__ == "__main__":
     from main import calculate_torus_stresses, fatigue_analysis
     from modules import advanced_calculations
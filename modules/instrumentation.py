@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Instrumentation is off unless enabled here or through TORUS_TRACE=1 (TORUS_TRACE=memory also traces memory)
+enabled = os.environ.get('TORUS_TRACE', '') not in ('', '0')
+trace_memory = os.environ.get('TORUS_TRACE', '') == 'memory'
+if trace_memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+events = []
+counters = {}
+_local = threading.local()
+_origin = time.perf_counter_ns()
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_span = _NullSpan()
+
+class Span:
+    """Timed region recorded as a Chrome trace 'complete' event"""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.children = 0
+        self.peak = 0
+
+    def __enter__(self):
+        stack = _stack()
+        if trace_memory and tracemalloc.is_tracing():
+            # Hand the peak seen so far to the enclosing spans before resetting it
+            current, peak = tracemalloc.get_traced_memory()
+            for parent in stack:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        stack = _stack()
+        stack.pop()
+        duration = end - self.start
+        if stack:
+            stack[-1].children += duration
+        event = {
+            'name': self.name,
+            'ph': 'X',
+            'ts': (self.start - _origin) / 1e3,
+            'dur': duration / 1e3,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': dict(self.args, self_us=(duration - self.children) / 1e3)
+        }
+        if trace_memory and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            event['args']['peak_bytes'] = self.peak - self.base
+        events.append(event)
+        return False
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def enable(memory=False):
+    """Start recording spans and counters; memory=True also tracks tracemalloc peaks per span"""
+    global enabled, trace_memory
+    enabled = True
+    trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global enabled, trace_memory
+    enabled = False
+    if trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    trace_memory = False
+
+def reset():
+    events.clear()
+    counters.clear()
+
+def span(name, **args):
+    """Context manager timing a region; a shared no-op object when disabled"""
+    if not enabled:
+        return _null_span
+    return Span(name, args)
+
+def traced(name=None):
+    """Decorator running the whole function inside a span"""
+    def decorator(func):
+        label = name or func.__module__.split('.')[-1] + '.' + func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(label, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """Add to a named counter such as solver iterations"""
+    if not enabled:
+        return
+    counters[name] = counters.get(name, 0) + value
+    events.append({
+        'name': name,
+        'ph': 'C',
+        'ts': (time.perf_counter_ns() - _origin) / 1e3,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': {'value': counters[name]}
+    })
+
+def cache_access(name, hit):
+    """Record a cache lookup; the summary reports the hit rate per cache"""
+    if enabled:
+        count(name + ('.hits' if hit else '.misses'))
+
+def export_chrome_trace(path):
+    """Write the recorded events in Chrome trace-event format (chrome://tracing, Perfetto)"""
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def summary():
+    """Aggregate spans by name into rows sorted by total time"""
+    rows = {}
+    for event in events:
+        if event['ph'] != 'X':
+            continue
+        row = rows.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'total_ms': 0.0,
+                                              'self_ms': 0.0, 'max_ms': 0.0, 'peak_bytes': None})
+        row['calls'] += 1
+        row['total_ms'] += event['dur'] / 1e3
+        row['self_ms'] += event['args']['self_us'] / 1e3
+        row['max_ms'] = max(row['max_ms'], event['dur'] / 1e3)
+        if 'peak_bytes' in event['args']:
+            row['peak_bytes'] = max(row['peak_bytes'] or 0, event['args']['peak_bytes'])
+    return sorted(rows.values(), key=lambda row: row['total_ms'], reverse=True)
+
+def report(path=None):
+    """Print the summary and optionally write the trace (default path from TORUS_TRACE_FILE); no-op when disabled"""
+    if not enabled:
+        return
+    print_summary()
+    path = path or os.environ.get('TORUS_TRACE_FILE')
+    if path:
+        export_chrome_trace(path)
+        print(f"Trace written to {path}")
+
+def cache_hit_rates():
+    rates = {}
+    for name in counters:
+        if name.endswith('.hits') or name.endswith('.misses'):
+            cache = name.rsplit('.', 1)[0]
+            hits = counters.get(cache + '.hits', 0)
+            rates[cache] = hits / (hits + counters.get(cache + '.misses', 0))
+    return rates
+
+def print_summary():
+    rows = summary()
+    if not rows and not counters:
+        print("No instrumentation data recorded")
+        return
+    print(f"\n{'Span':40s} {'Calls':>6s} {'Total ms':>10s} {'Self ms':>10s} {'Max ms':>10s} {'Peak MiB':>9s}")
+    for row in rows:
+        peak = f"{row['peak_bytes']/2**20:9.2f}" if row['peak_bytes'] is not None else f"{'-':>9s}"
+        print(f"{row['name']:40s} {row['calls']:6d} {row['total_ms']:10.2f} {row['self_ms']:10.2f} {row['max_ms']:10.2f} {peak}")
+    rates = cache_hit_rates()
+    plain = {name: value for name, value in counters.items() if not name.endswith(('.hits', '.misses'))}
+    if plain:
+        print(f"\n{'Counter':40s} {'Value':>12s}")
+        for name, value in sorted(plain.items()):
+            print(f"{name:40s} {value:12g}")
+    if rates:
+        print(f"\n{'Cache':40s} {'Hit rate':>12s}")
+        for name, rate in sorted(rates.items()):
+            print(f"{name:40s} {rate:12.1%}")
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import numpy as np
+from modules.instrumentation import cache_access, span
+
+# Numeric material columns; NULL (unknown) values come back as NaN in arrays
+material_fields = ('E', 'nu', 'density', 'alpha', 'yield_stress', 'S_ut', 'K_IC', 'conductivity', 'specific_heat')
+
+# Load and geometry columns of a configuration, in calculate_torus_stresses order around E and nu
+configuration_fields = ('R', 'r', 't', 'p_int', 'p_ext', 'F_x', 'F_y', 'F_z', 'M_x', 'M_y', 'M_z', 'T')
+
+# SQL column names are case-insensitive, so R/r and t/T are stored under descriptive names
+configuration_columns = ('major_radius', 'minor_radius', 'thickness', 'p_int', 'p_ext', 'F_x', 'F_y', 'F_z',
+                         'M_x', 'M_y', 'M_z', 'temperature_change')
+
+# Representative room-temperature properties (SI units):
+# name, class, E, nu, density, alpha, yield_stress, S_ut, K_IC, conductivity, specific_heat
+seed_materials = [
+    ("Structural steel", "steel", 200e9, 0.3, 7800, 12e-6, 250e6, 500e6, 50e6, 50, 490),
+    ("API 5L X70 steel", "steel", 200e9, 0.3, 7850, 12e-6, 485e6, 570e6, 100e6, 45, 470),
+    ("Stainless steel 304", "steel", 193e9, 0.29, 8000, 17.3e-6, 215e6, 505e6, 150e6, 16.2, 500),
+    ("Inconel 718", "nickel", 200e9, 0.29, 8190, 13e-6, 1030e6, 1240e6, 100e6, 11.4, 435),
+    ("Aluminium 6061-T6", "aluminium", 70e9, 0.33, 2700, 23.6e-6, 276e6, 310e6, 29e6, 167, 896),
+    ("Aluminium 2219-T87", "aluminium", 73e9, 0.33, 2840, 22.3e-6, 393e6, 476e6, 36e6, 121, 864),
+    ("Titanium Ti-6Al-4V", "titanium", 114e9, 0.34, 4430, 8.6e-6, 880e6, 950e6, 75e6, 6.7, 526),
+    ("Copper conductor", "copper", 100e9, 0.3, 8900, 17e-6, 250e6, 350e6, None, 390, 385),
+    ("Carbon-carbon composite", "composite", 50e9, 0.3, 1800, 1.5e-6, None, 150e6, None, 40, 710),
+    ("Natural rubber", "elastomer", 0.01e9, 0.45, 1100, 220e-6, None, 25e6, None, 0.15, 1900),
+    ("Aramid fabric laminate", "fabric", 0.5e9, 0.45, 1400, -2e-6, None, 1000e6, None, 0.04, 1420),
+]
+
+# name, material, R, r, t, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T
+seed_configurations = [
+    ("Pressure Vessel", "Structural steel", 1.0, 0.25, 0.02, 10e6, 1e5, 0, 0, -9.81*1000, 0, 0, 0, 25),
+    ("Tokamak Fusion Reactor", "Structural steel", 6.2, 2.0, 0.05, 1e-6, 1e5, 0, 0, 0, 1e6, 1e6, 1e6, 100),
+    ("Submarine Hull Section", "Structural steel", 5.0, 1.5, 0.1, 1e5, 2e7, 1e6, 1e6, 1e6, 1e7, 1e7, 1e7, -10),
+    ("Space Station Module", "Aluminium 6061-T6", 2.0, 1.0, 0.01, 1e5, 0, 1e3, 1e3, 1e3, 1e4, 1e4, 1e4, 100),
+    ("Pneumatic Tire", "Natural rubber", 0.3, 0.1, 0.01, 2.5e5, 1e5, 5e3, 0, 5e3, 100, 100, 100, 30),
+    ("Nuclear Reactor Containment", "Structural steel", 10.0, 3.0, 0.5, 5e6, 1e5, 0, 0, -9.81e6, 1e7, 1e7, 1e7, 300),
+    ("Particle Accelerator Ring", "Structural steel", 50.0, 0.5, 0.05, 1e-9, 1e5, 0, 0, 0, 1e5, 1e5, 1e5, 20),
+    ("Offshore Oil Pipeline", "API 5L X70 steel", 500.0, 0.5, 0.05, 10e6, 20e6, 1e6, 1e6, 1e6, 1e7, 1e7, 1e7, 5),
+    ("Wind Turbine Blade Root", "Aluminium 6061-T6", 2.0, 0.5, 0.1, 1e5, 1e5, 1e5, 1e5, 1e5, 1e7, 1e7, 1e7, 30),
+    ("Aircraft Engine Nacelle", "Aluminium 6061-T6", 1.5, 1.0, 0.02, 1e5, 8e4, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 100),
+    ("Hydroelectric Dam Penstock", "Structural steel", 5.0, 2.0, 0.1, 2e6, 1e5, 0, 0, -9.81e5, 1e6, 1e6, 1e6, 15),
+    ("Cryogenic Storage Tank", "Structural steel", 3.0, 1.5, 0.05, 5e5, 1e5, 0, 0, -9.81e4, 1e5, 1e5, 1e5, -200),
+    ("Roller Coaster Loop", "Structural steel", 10.0, 1.0, 0.05, 1e5, 1e5, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 25),
+    ("Satellite Fuel Tank", "Aluminium 6061-T6", 0.5, 0.25, 0.005, 2e6, 0, 100, 100, 100, 1e3, 1e3, 1e3, 50),
+    ("Superconducting Magnet Coil", "Copper conductor", 1.0, 0.2, 0.02, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, -270),
+    ("Bicycle Tire", "Natural rubber", 0.3, 0.025, 0.003, 8e5, 1e5, 500, 0, 500, 10, 10, 10, 25),
+    ("Industrial Centrifuge", "Structural steel", 0.5, 0.2, 0.01, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 50),
+    ("Spacecraft Heat Shield", "Carbon-carbon composite", 2.0, 1.0, 0.1, 1e5, 0, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 1500),
+    ("Underwater Habitat", "Structural steel", 5.0, 2.0, 0.1, 1e5, 3e6, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 10),
+    ("MRI Machine Bore", "Structural steel", 1.0, 0.5, 0.05, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 20),
+    ("Hypersonic Aircraft Fuselage", "Structural steel", 20.0, 2.0, 0.1, 1e5, 5e4, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 800),
+    ("Geothermal Well Casing", "API 5L X70 steel", 1.0, 0.1, 0.02, 20e6, 50e6, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 300),
+    ("Vacuum Chamber", "Structural steel", 2.0, 1.0, 0.05, 0, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 25),
+    ("Inflatable Space Habitat", "Aramid fabric laminate", 5.0, 2.5, 0.001, 1e5, 0, 100, 100, 100, 1e3, 1e3, 1e3, 25),
+    ("Hyperloop Tube Section", "Structural steel", 5.0, 1.5, 0.05, 1e3, 1e5, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 30),
+]
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS materials (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    class TEXT NOT NULL,
+    {', '.join(field + ' REAL' for field in material_fields)}
+);
+CREATE INDEX IF NOT EXISTS materials_class ON materials (class);
+CREATE INDEX IF NOT EXISTS materials_E ON materials (E);
+CREATE INDEX IF NOT EXISTS materials_density ON materials (density);
+CREATE INDEX IF NOT EXISTS materials_yield_stress ON materials (yield_stress);
+CREATE TABLE IF NOT EXISTS configurations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    material TEXT NOT NULL REFERENCES materials (name),
+    {', '.join(column + ' REAL NOT NULL' for column in configuration_columns)}
+);
+CREATE INDEX IF NOT EXISTS configurations_material ON configurations (material);
+"""
+
+def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
+    print("Material and Configuration Database")
+    db = default_database()
+
+    classes = db.material_classes()
+    print("\nMaterial classes: " + ", ".join(classes))
+    material_class = input("Enter material class to compare (leave empty for all): ").strip() or None
+    min_yield = input("Enter minimum yield stress (leave empty for no limit): ").strip()
+    table = db.find_materials(material_class, yield_stress=(float(min_yield), None) if min_yield else None)
+    if not len(table['name']):
+        print("No materials match")
+        input("\nPress Enter to return to the main menu...")
+        return
+
+    names = db.configuration_names()
+    for i, name in enumerate(names):
+        print(f"{i + 1}. {name}")
+    configuration = db.configuration(names[int(input("Enter the configuration to evaluate: ")) - 1])
+
+    # One broadcast stress evaluation over every material and the whole surface
+    theta, phi = np.meshgrid(np.linspace(0, 2*np.pi, 90), np.linspace(0, 2*np.pi, 90))
+    column = lambda values: np.asarray(values)[:, np.newaxis, np.newaxis]
+    R, r, t, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T = (configuration[field] for field in configuration_fields)
+    sigma_vm, _, _ = calculate_torus_stresses(R, r, t, column(table['E']), column(table['nu']), p_int, p_ext,
+                                              F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi, alpha=column(table['alpha']))
+    peak = np.max(sigma_vm, axis=(1, 2))
+    utilization = peak / table['yield_stress']
+    mass = 4 * np.pi**2 * R * r * t * table['density']
+
+    print(f"\n{configuration['name']} ({configuration['material']} in the catalogue):")
+    print(f"{'Material':28s} {'Class':10s} {'Peak vM (Pa)':>14s} {'Utilization':>12s} {'Mass (kg)':>12s}")
+    for i in np.argsort(utilization):
+        print(f"{table['name'][i]:28s} {table['class'][i]:10s} {peak[i]:14.4e} {utilization[i]:12.3g} {mass[i]:12.4g}")
+
+    input("\nPress Enter to return to the main menu...")
+
+class MaterialDatabase:
+    """
+    SQLite store of materials and torus configurations.
+
+    path=None keeps the database in memory; a file path is created and seeded
+    on first use. Name, class and property-range queries go through indexed
+    SQL; the material table is also loaded once into NumPy columns, which
+    serve name lookups and bulk property arrays without per-row work.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ':memory:'
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(schema)
+        if not self.connection.execute("SELECT COUNT(*) FROM materials").fetchone()[0]:
+            self.add_materials(seed_materials)
+            self.add_configurations(seed_configurations)
+        self._table = None
+
+    def close(self):
+        self.connection.close()
+
+    def add_materials(self, rows):
+        """Insert or replace materials given as (name, class, *material_fields) rows"""
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO materials (name, class, {', '.join(material_fields)}) "
+                f"VALUES ({', '.join('?' * (2 + len(material_fields)))})", rows)
+        self._table = None
+
+    def add_configurations(self, rows):
+        """Insert or replace configurations given as (name, material, *configuration_fields) rows"""
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO configurations (name, material, {', '.join(configuration_columns)}) "
+                f"VALUES ({', '.join('?' * (2 + len(configuration_fields)))})", rows)
+
+    def material_table(self):
+        """All materials as NumPy columns ('name', 'class' and material_fields), loaded once"""
+        cache_access('material_database.table', self._table is not None)
+        if self._table is None:
+            with span('material_database.load'):
+                rows = self.connection.execute(
+                    f"SELECT name, class, {', '.join(material_fields)} FROM materials ORDER BY name").fetchall()
+                self._table = self._columns(rows)
+                self._index = {name: i for i, name in enumerate(self._table['name'])}
+        return self._table
+
+    def material(self, name):
+        """Properties of one material as a dict (unknown values are NaN)"""
+        table = self.material_table()
+        if name not in self._index:
+            raise KeyError(f"Unknown material '{name}'.")
+        i = self._index[name]
+        return {field: (values[i].item() if field not in ('name', 'class') else values[i]) for field, values in table.items()}
+
+    def material_properties(self, names, fields=material_fields):
+        """Array (len(names), len(fields)) of properties for many materials, from the cached table"""
+        table = self.material_table()
+        missing = [name for name in names if name not in self._index]
+        if missing:
+            raise KeyError(f"Unknown materials: {', '.join(missing)}.")
+        rows = np.fromiter((self._index[name] for name in names), dtype=int, count=len(names))
+        return np.column_stack([table[field][rows] for field in fields])
+
+    def material_classes(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT class FROM materials ORDER BY class")]
+
+    def find_materials(self, material_class=None, **ranges):
+        """
+        Materials of a class and/or with properties in ranges, e.g.
+        find_materials('steel', yield_stress=(300e6, None)); a None bound is
+        open. Returns NumPy columns like material_table.
+        """
+        conditions, values = [], []
+        if material_class is not None:
+            conditions.append("class = ?")
+            values.append(material_class)
+        for field, bounds in ranges.items():
+            if field not in material_fields:
+                raise ValueError(f"Unknown material property '{field}'. Choose from {', '.join(material_fields)}.")
+            if bounds is None:
+                continue
+            low, high = bounds
+            if low is not None:
+                conditions.append(f"{field} >= ?")
+                values.append(low)
+            if high is not None:
+                conditions.append(f"{field} <= ?")
+                values.append(high)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with span('material_database.query'):
+            rows = self.connection.execute(
+                f"SELECT name, class, {', '.join(material_fields)} FROM materials{where} ORDER BY name", values).fetchall()
+        return self._columns(rows)
+
+    def configuration_names(self, material=None):
+        if material is None:
+            return [row[0] for row in self.connection.execute("SELECT name FROM configurations ORDER BY id")]
+        return [row[0] for row in self.connection.execute(
+            "SELECT name FROM configurations WHERE material = ? ORDER BY id", (material,))]
+
+    def configuration(self, name):
+        """One configuration as a dict with its name, material and configuration_fields"""
+        row = self.connection.execute(
+            f"SELECT name, material, {', '.join(configuration_columns)} FROM configurations WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown configuration '{name}'.")
+        return dict(zip(('name', 'material') + configuration_fields, row))
+
+    def configuration_arrays(self, material=None):
+        """All configurations (optionally of one material) as NumPy columns"""
+        where, values = ("WHERE material = ? ", (material,)) if material is not None else ("", ())
+        rows = self.connection.execute(
+            f"SELECT name, material, {', '.join(configuration_columns)} FROM configurations {where}ORDER BY id", values).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * (2 + len(configuration_fields))
+        arrays = {'name': np.array(columns[0], dtype=object), 'material': np.array(columns[1], dtype=object)}
+        data = np.array(columns[2:], dtype=float).reshape(len(configuration_fields), -1)
+        arrays.update(zip(configuration_fields, data))
+        return arrays
+
+    def example_params(self, name):
+        """(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T) of a configuration with its material"""
+        configuration = self.configuration(name)
+        material = self.material(configuration['material'])
+        R, r, t, *loads = (configuration[field] for field in configuration_fields)
+        return (R, r, t, material['E'], material['nu'], *loads)
+
+    @staticmethod
+    def _columns(rows):
+        columns = list(zip(*rows)) if rows else [()] * (2 + len(material_fields))
+        table = {'name': np.array(columns[0], dtype=object), 'class': np.array(columns[1], dtype=object)}
+        data = np.array(columns[2:], dtype=float).reshape(len(material_fields), -1)  # None -> NaN
+        table.update(zip(material_fields, data))
+        return table
+
+_default = None
+
+def default_database():
+    """Shared database: the file named by TORUS_DATABASE, or an in-memory copy of the seed data"""
+    global _default
+    if _default is None:
+        _default = MaterialDatabase(os.environ.get('TORUS_DATABASE'))
+    return _default
+
+def get_material(name):
+    """Properties of a material from the shared database"""
+    return default_database().material(name)
+
+if __name__ == "__main__":
+    # This allows the module to be run standalone for testing
+    from main import calculate_torus_stresses, fatigue_analysis
+    from modules import advanced_calculations
+    from visualization import create_advanced_animation
+    run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation)
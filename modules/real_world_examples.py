@@ -1,8 +1,11 @@
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from visualization import decimate_surface
+from modules.material_database import default_database
 
-def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi):
+def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi, alpha=12e-6):
     r_m = r + t/2
     A = 2 * np.pi * r_m * t
     I = np.pi * r_m**3 * t
@@ -19,7 +22,6 @@ def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M
     sigma_z = F_z / A
     tau_xy = M_x * r_m / J
 
-    alpha = 12e-6
     sigma_thermal = -E * alpha * T / (1 - nu)
 
     sigma_phi = N_phi / t + 6 * M_phi / t**2 + sigma_thermal
@@ -29,7 +31,7 @@ def calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M
 
     return sigma_vm, sigma_phi, sigma_theta
 
-def create_example_visualization(example):
+def create_example_visualization(example, max_vertices=2500):
     R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T = example['params']
     
     theta = np.linspace(0, 2*np.pi, 200)
@@ -40,7 +42,8 @@ def create_example_visualization(example):
     y = (R + r*np.cos(theta)) * np.sin(phi)
     z = r * np.sin(theta)
     
-    sigma_vm, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi)
+    alpha = default_database().material(example['material'])['alpha'] if 'material' in example else 12e-6
+    sigma_vm, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi, alpha)
     
     fig = plt.figure(figsize=(16, 14))
     ax1 = fig.add_subplot(221, projection='3d')
@@ -48,10 +51,11 @@ def create_example_visualization(example):
     ax3 = fig.add_subplot(223)
     ax4 = fig.add_subplot(224, projection='polar')
     
-    # 3D Visualization
+    # 3D Visualization on a level-of-detail surface that keeps the stress peaks
     norm = plt.Normalize(vmin=np.min(sigma_vm), vmax=np.max(sigma_vm))
-    colors = plt.cm.viridis(norm(sigma_vm))
-    surf = ax1.plot_surface(x, y, z, facecolors=colors, shade=False)
+    x_lod, y_lod, z_lod, sigma_lod, _, _ = decimate_surface(x, y, z, sigma_vm, max_vertices)
+    colors = plt.cm.viridis(norm(sigma_lod))
+    surf = ax1.plot_surface(x_lod, y_lod, z_lod, facecolors=colors, shade=False, rstride=1, cstride=1)
     fig.colorbar(surf, ax=ax1, label='von Mises Stress (Pa)')
     ax1.set_xlabel('X')
     ax1.set_ylabel('Y')
@@ -86,114 +90,20 @@ def create_example_visualization(example):
     plt.tight_layout()
     plt.show()
 
-# Define 5 real-world examples with improved parameters
+# Real-world examples from the configuration catalogue; E and nu come from each configuration's material
 examples = [
     {
-        "name": "Pressure Vessel",
-        "params": (1.0, 0.25, 0.02, 200e9, 0.3, 10e6, 1e5, 0, 0, -9.81*1000, 0, 0, 0, 25)
-    },
-    {
-        "name": "Tokamak Fusion Reactor",
-        "params": (6.2, 2.0, 0.05, 200e9, 0.3, 1e-6, 1e5, 0, 0, 0, 1e6, 1e6, 1e6, 100)
-    },
-    {
-        "name": "Submarine Hull Section",
-        "params": (5.0, 1.5, 0.1, 200e9, 0.3, 1e5, 2e7, 1e6, 1e6, 1e6, 1e7, 1e7, 1e7, -10)
-    },
-    {
-        "name": "Space Station Module",
-        "params": (2.0, 1.0, 0.01, 70e9, 0.33, 1e5, 0, 1e3, 1e3, 1e3, 1e4, 1e4, 1e4, 100)
-    },
-    {
-        "name": "Pneumatic Tire",
-        "params": (0.3, 0.1, 0.01, 0.01e9, 0.45, 2.5e5, 1e5, 5e3, 0, 5e3, 100, 100, 100, 30)
-    },
-        {
-        "name": "Nuclear Reactor Containment",
-        "params": (10.0, 3.0, 0.5, 200e9, 0.3, 5e6, 1e5, 0, 0, -9.81e6, 1e7, 1e7, 1e7, 300)
-    },
-    {
-        "name": "Particle Accelerator Ring",
-        "params": (50.0, 0.5, 0.05, 200e9, 0.3, 1e-9, 1e5, 0, 0, 0, 1e5, 1e5, 1e5, 20)
-    },
-    {
-        "name": "Offshore Oil Pipeline",
-        "params": (500.0, 0.5, 0.05, 200e9, 0.3, 10e6, 20e6, 1e6, 1e6, 1e6, 1e7, 1e7, 1e7, 5)
-    },
-    {
-        "name": "Wind Turbine Blade Root",
-        "params": (2.0, 0.5, 0.1, 70e9, 0.33, 1e5, 1e5, 1e5, 1e5, 1e5, 1e7, 1e7, 1e7, 30)
-    },
-    {
-        "name": "Aircraft Engine Nacelle",
-        "params": (1.5, 1.0, 0.02, 70e9, 0.33, 1e5, 8e4, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 100)
-    },
-    {
-        "name": "Hydroelectric Dam Penstock",
-        "params": (5.0, 2.0, 0.1, 200e9, 0.3, 2e6, 1e5, 0, 0, -9.81e5, 1e6, 1e6, 1e6, 15)
-    },
-    {
-        "name": "Cryogenic Storage Tank",
-        "params": (3.0, 1.5, 0.05, 200e9, 0.3, 5e5, 1e5, 0, 0, -9.81e4, 1e5, 1e5, 1e5, -200)
-    },
-    {
-        "name": "Roller Coaster Loop",
-        "params": (10.0, 1.0, 0.05, 200e9, 0.3, 1e5, 1e5, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 25)
-    },
-    {
-        "name": "Satellite Fuel Tank",
-        "params": (0.5, 0.25, 0.005, 70e9, 0.33, 2e6, 0, 100, 100, 100, 1e3, 1e3, 1e3, 50)
-    },
-    {
-        "name": "Superconducting Magnet Coil",
-        "params": (1.0, 0.2, 0.02, 100e9, 0.3, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, -270)
-    },
-    {
-        "name": "Bicycle Tire",
-        "params": (0.3, 0.025, 0.003, 0.01e9, 0.45, 8e5, 1e5, 500, 0, 500, 10, 10, 10, 25)
-    },
-    {
-        "name": "Industrial Centrifuge",
-        "params": (0.5, 0.2, 0.01, 200e9, 0.3, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 50)
-    },
-    {
-        "name": "Spacecraft Heat Shield",
-        "params": (2.0, 1.0, 0.1, 50e9, 0.3, 1e5, 0, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 1500)
-    },
-    {
-        "name": "Underwater Habitat",
-        "params": (5.0, 2.0, 0.1, 200e9, 0.3, 1e5, 3e6, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 10)
-    },
-    {
-        "name": "MRI Machine Bore",
-        "params": (1.0, 0.5, 0.05, 200e9, 0.3, 1e5, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 20)
-    },
-    {
-        "name": "Hypersonic Aircraft Fuselage",
-        "params": (20.0, 2.0, 0.1, 200e9, 0.3, 1e5, 5e4, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 800)
-    },
-    {
-        "name": "Geothermal Well Casing",
-        "params": (1.0, 0.1, 0.02, 200e9, 0.3, 20e6, 50e6, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 300)
-    },
-    {
-        "name": "Vacuum Chamber",
-        "params": (2.0, 1.0, 0.05, 200e9, 0.3, 0, 1e5, 1e4, 1e4, 1e4, 1e5, 1e5, 1e5, 25)
-    },
-    {
-        "name": "Inflatable Space Habitat",
-        "params": (5.0, 2.5, 0.001, 0.5e9, 0.45, 1e5, 0, 100, 100, 100, 1e3, 1e3, 1e3, 25)
-    },
-    {
-        "name": "Hyperloop Tube Section",
-        "params": (5.0, 1.5, 0.05, 200e9, 0.3, 1e3, 1e5, 1e5, 1e5, 1e5, 1e6, 1e6, 1e6, 30)
+        "name": name,
+        "material": default_database().configuration(name)['material'],
+        "params": default_database().example_params(name)
     }
+    for name in default_database().configuration_names()
 ]
 
 def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
     print("Real World Examples")
     for i, example in enumerate(examples):
-        print(f"{i + 1}. {example['name']}")
+        print(f"{i + 1}. {example['name']} ({example['material']})")
     
     choice = int(input("Enter the number of the example you want to visualize: ")) - 1
     
@@ -201,16 +111,15 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
         chosen_example = examples[choice]
         R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T = chosen_example['params']
         
-        # Add default values for missing parameters
+        # Material defaults from the database, falling back to structural steel values where a property is unknown
+        material = default_database().material(chosen_example['material'])
+        fallback = {'S_ut': 500e6, 'yield_stress': 250e6, 'density': 7800, 'K_IC': 50e6, 'alpha': 12e-6}
+        S_ut, yield_stress, rho, K_IC, alpha = (fallback[key] if np.isnan(material[key]) else material[key] for key in fallback)
         N_cycles = 1e6
-        S_ut = 500e6
-        yield_stress = 250e6
         n = 1.5
         T_inner = T
         T_outer = T
-        rho = 7800
         omega = 0
-        K_IC = 50e6
 
         variables = [
             ('R', R), ('r', r), ('t', t), ('E', E), ('nu', nu),
@@ -220,7 +129,7 @@ def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculatio
             ('T_inner', T_inner), ('T_outer', T_outer), ('rho', rho), ('omega', omega), ('K_IC', K_IC)
         ]
 
-        create_advanced_animation(variables, yield_stress, calculate_torus_stresses, fatigue_analysis)
+        create_advanced_animation(variables, yield_stress, functools.partial(calculate_torus_stresses, alpha=alpha), fatigue_analysis)
     else:
         print("Invalid example index")
     
@@ -0,0 +1,228 @@
+import time
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse.linalg import splu
+from modules.fem_3d_analysis import (assemble_system, generate_torus_mesh, pressure_loads, recover_nodal_stresses,
+                                     rigid_body_constraints, von_mises)
+from modules.instrumentation import count, span
+
+def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
+    print("Reduced-Order FEM Load Sweep")
+
+    # Get user input for parameters
+    R = float(input("Enter major radius (R): "))
+    r = float(input("Enter minor radius (r): "))
+    t = float(input("Enter thickness (t): "))
+    E = float(input("Enter Young's modulus (E): "))
+    nu = float(input("Enter Poisson's ratio (nu): "))
+    p_int = float(input("Enter mean internal pressure (p_int): "))
+    p_ext = float(input("Enter mean external pressure (p_ext): "))
+    variation = float(input("Enter relative pressure variation around the ring (e.g. 0.2): "))
+    n_elements = int(input("Enter number of elements: "))
+    n_cases = int(input("Enter number of load cases: "))
+
+    # Offline: one assembly, a load basis and a few training solves
+    nodes, elements = generate_torus_mesh(R, r, t, n_elements)
+    K, _ = assemble_system(nodes, elements, E, nu, 0, 0)
+    load_basis = torus_pressure_load_basis(nodes, elements, R)
+    rom = ReducedOrderModel(K, rigid_body_constraints(nodes), load_basis)
+
+    rng = np.random.default_rng()
+    def sample(n):
+        mu = np.empty((load_basis.shape[1], n))
+        mu[0] = p_int * (1 + variation * rng.uniform(-1, 1, n))
+        mu[1:-1] = p_int * variation * rng.uniform(-1, 1, (load_basis.shape[1] - 2, n))
+        mu[-1] = p_ext * (1 + variation * rng.uniform(-1, 1, n))
+        return mu
+
+    start = time.perf_counter()
+    rom.fit(sample(4))
+    offline = time.perf_counter() - start
+
+    # Online: all load cases in the reduced space
+    start = time.perf_counter()
+    q, errors = rom.project(sample(n_cases))
+    online = time.perf_counter() - start
+
+    # Stresses are linear in the reduced coordinates: one nodal stress field per basis vector
+    modes = recover_nodal_stresses(nodes, elements, rom.expand(np.eye(rom.basis.shape[1])), E, nu)
+    peak = np.concatenate([np.max(von_mises(np.einsum('kn,kmc->nmc', q[:, i:i + 500], modes)), axis=1)
+                           for i in range(0, n_cases, 500)])
+
+    print("\nReduced-Order Model Results:")
+    print(f"Full DOFs: {K.shape[0]}, basis size: {rom.basis.shape[1]}")
+    print(f"Offline time: {offline:.3f} s, online time: {online:.3f} s ({online / n_cases * 1e6:.1f} us per case)")
+    print(f"Full solves for enrichment: {rom.n_enrichments}, largest error indicator: {np.max(errors):.2e}")
+    print(f"Max von Mises stress over all cases: {np.max(peak):.4e} (min {np.min(peak):.4e})")
+
+    input("\nPress Enter to return to the main menu...")
+
+def torus_pressure_load_basis(nodes, elements, R, harmonics=(2, 3)):
+    """
+    Load vectors (n_dofs, 2 + 2*len(harmonics)) for uniform internal pressure,
+    cos/sin(h*theta) internal pressure per harmonic and uniform external pressure.
+    Harmonic 1 is left out because it is not self-equilibrated.
+    """
+    centre = np.mean(nodes[elements], axis=1)
+    theta = np.arctan2(centre[:, 1], centre[:, 0])
+    columns = [pressure_loads(nodes, elements, 1, 0)]
+    for h in harmonics:
+        columns.append(pressure_loads(nodes, elements, np.cos(h * theta), 0))
+        columns.append(pressure_loads(nodes, elements, np.sin(h * theta), 0))
+    columns.append(pressure_loads(nodes, elements, 0, 1))
+    return np.column_stack(columns)
+
+def pod_basis(snapshots, energy=0.999999):
+    """Orthonormal POD basis of snapshot columns keeping the given fraction of the energy"""
+    V, s, _ = np.linalg.svd(snapshots, full_matrices=False)
+    if not len(s) or s[0] == 0:
+        return V[:, :0]
+    n_modes = np.searchsorted(np.cumsum(s**2) / np.sum(s**2), energy) + 1
+    return V[:, :min(n_modes, len(s))]
+
+class ReducedOrderModel:
+    """
+    Galerkin projection of a fixed stiffness matrix onto a POD basis.
+
+    Loads are full force vectors, or parameter vectors mu when a load basis
+    F_b is given (F = F_b mu). In the second case every online quantity,
+    including the residual norm ||F - K V q|| / ||F|| used as error
+    indicator, comes from small precomputed matrices, so a reduced solve
+    costs O(k^2 + k m) independent of the mesh size. Loads whose indicator
+    exceeds tol are solved in full (with a sparse LU computed once) and the
+    solution is added to the basis.
+    """
+
+    def __init__(self, K, fixed_dofs, load_basis=None, tol=1e-4):
+        self.n_dofs = K.shape[0]
+        self.free = np.setdiff1d(np.arange(self.n_dofs), fixed_dofs)
+        self.K = K[self.free][:, self.free].tocsc()
+        self.load_basis = None if load_basis is None else np.asarray(load_basis)[self.free]
+        self.tol = tol
+        self.lu = None
+        self.n_enrichments = 0
+        self.set_basis(np.zeros((len(self.free), 0)))
+
+    def full_solve(self, F_free):
+        """Solve the full system for free-DOF loads (n_free,) or (n_free, n)"""
+        if self.lu is None:
+            with span('rom.factorize'):
+                self.lu = splu(self.K, permc_spec='MMD_AT_PLUS_A')
+        count('rom.full_solves', 1 if F_free.ndim == 1 else F_free.shape[1])
+        return self.lu.solve(F_free)
+
+    def loads(self, load):
+        """Free-DOF force vectors from full load vectors or load parameters"""
+        load = np.asarray(load, dtype=float)
+        if self.load_basis is not None:
+            return self.load_basis @ load
+        return load[self.free]
+
+    def fit(self, loads, energy=0.999999):
+        """Offline stage: full solves for the training loads (one per column) and a POD basis"""
+        with span('rom.fit'):
+            snapshots = self.full_solve(self.loads(loads).reshape(len(self.free), -1))
+            self.set_basis(pod_basis(snapshots, energy))
+        return self
+
+    def set_basis(self, V):
+        """Project the stiffness matrix (and load basis) onto the orthonormal basis V"""
+        self.basis = V
+        self.KV = np.asarray(self.K @ V)
+        self.K_r = cho_factor(V.T @ self.KV) if V.shape[1] else None
+        if self.load_basis is not None:
+            self.VtF = V.T @ self.load_basis
+            self.KVtF = self.KV.T @ self.load_basis
+            self.FtF = self.load_basis.T @ self.load_basis
+            self.KVtKV = self.KV.T @ self.KV
+
+    def enrich(self, U_free):
+        """Add solution vectors (columns) to the basis after Gram-Schmidt orthogonalization"""
+        V = self.basis
+        for u in np.atleast_2d(U_free.T):
+            norm = np.linalg.norm(u)
+            for _ in range(2):
+                u = u - V @ (V.T @ u)
+            if np.linalg.norm(u) > 1e-10 * norm:
+                V = np.column_stack((V, u / np.linalg.norm(u)))
+        self.n_enrichments += len(np.atleast_2d(U_free.T))
+        self.set_basis(V)
+
+    def reduced_solve(self, load):
+        """
+        Reduced coordinates q (k, n) and relative residual indicators (n,) for
+        loads given one per column (or a single load).
+        """
+        count('rom.reduced_solves', 1 if np.ndim(load) == 1 else np.shape(load)[1])
+        if self.load_basis is not None:
+            mu = np.asarray(load, dtype=float).reshape(self.load_basis.shape[1], -1)
+            f_norm2 = np.einsum('in,ij,jn->n', mu, self.FtF, mu)
+            if self.K_r is None:
+                return np.zeros((0, mu.shape[1])), np.ones(mu.shape[1])
+            q = cho_solve(self.K_r, self.VtF @ mu)
+            r_norm2 = f_norm2 - 2 * np.einsum('kn,kn->n', q, self.KVtF @ mu) + np.einsum('kn,kl,ln->n', q, self.KVtKV, q)
+        else:
+            F = self.loads(load).reshape(len(self.free), -1)
+            f_norm2 = np.sum(F**2, axis=0)
+            if self.K_r is None:
+                return np.zeros((0, F.shape[1])), np.ones(F.shape[1])
+            q = cho_solve(self.K_r, self.basis.T @ F)
+            r_norm2 = np.sum((F - self.KV @ q)**2, axis=0)
+        return q, np.sqrt(np.maximum(r_norm2, 0) / np.maximum(f_norm2, np.finfo(float).tiny))
+
+    def expand(self, q):
+        """Full displacement vectors (n_dofs, n) from reduced coordinates"""
+        U = np.zeros((self.n_dofs, q.shape[1]))
+        U[self.free] = self.basis @ q
+        return U
+
+    def project(self, loads, enrich=True):
+        """
+        Reduced coordinates (k, n) and indicators for many loads (one per column).
+        While some indicator exceeds tol, the worst load is solved in full, its
+        solution is added to the basis and the failing loads are re-projected
+        (greedy enrichment). Coordinates from before an enrichment are padded
+        with zeros, which represents the same displacement in the larger basis.
+        """
+        with span('rom.project'):
+            loads = np.asarray(loads, dtype=float)
+            q, errors = self.reduced_solve(loads)
+            bad = np.flatnonzero(errors > self.tol)
+            while enrich and len(bad):
+                size = self.basis.shape[1]
+                worst = bad[np.argmax(errors[bad])]
+                self.enrich(self.full_solve(self.loads(loads[:, worst]))[:, np.newaxis])
+                if self.basis.shape[1] == size:
+                    break  # already in the basis: the indicator is at its round-off floor
+                q = np.vstack((q, np.zeros((self.basis.shape[1] - size, q.shape[1]))))
+                q[:, bad], errors[bad] = self.reduced_solve(loads[:, bad])
+                bad = bad[errors[bad] > self.tol]
+        return q, errors
+
+    def solve_many(self, loads, enrich=True):
+        """
+        Displacements (n_dofs, n) and indicators for many loads (one per column).
+        With enrich=False, loads failing the tolerance are solved in full without
+        changing the basis. For very large batches keep the reduced coordinates
+        from project() and expand only what is needed.
+        """
+        loads = np.asarray(loads, dtype=float)
+        q, errors = self.project(loads, enrich)
+        U = self.expand(q)
+        bad = np.flatnonzero(errors > self.tol)
+        if not enrich and len(bad):
+            U[np.ix_(self.free, bad)] = self.full_solve(self.loads(loads[:, bad]).reshape(len(self.free), -1))
+            errors[bad] = 0.0
+        return U, errors
+
+    def solve(self, load, enrich=True):
+        """Displacement (n_dofs,) and error indicator for a single load"""
+        U, errors = self.solve_many(np.asarray(load, dtype=float)[:, np.newaxis], enrich)
+        return U[:, 0], errors[0]
+
+if __name__ == "__main__":
+    # This allows the module to be run standalone for testing
+    from main import calculate_torus_stresses, fatigue_analysis
+    from modules import advanced_calculations
+    from visualization import create_advanced_animation
+    run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation)
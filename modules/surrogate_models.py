@@ -0,0 +1,295 @@
+import functools
+import itertools
+import pickle
+import time
+import warnings
+import numpy as np
+from scipy.special import eval_legendre
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel, WhiteKernel
+from main import calculate_torus_stresses
+from modules.instrumentation import count, report, span
+
+# Input columns of the torus stress surrogates
+torus_inputs = ('R', 'r', 't', 'E', 'nu', 'p_int', 'p_ext')
+
+def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
+    print("Surrogate Model Analysis")
+
+    # Get user input for parameters
+    R = float(input("Enter major radius (R): "))
+    r = float(input("Enter minor radius (r): "))
+    t = float(input("Enter thickness (t): "))
+    E = float(input("Enter Young's modulus (E): "))
+    nu = float(input("Enter Poisson's ratio (nu): "))
+    p_int = float(input("Enter internal pressure (p_int): "))
+    p_ext = float(input("Enter external pressure (p_ext): "))
+    T = float(input("Enter temperature change (T): "))
+    yield_stress = float(input("Enter yield stress: "))
+    model = input("Enter true model (analytic/fem): ").strip().lower() or 'analytic'
+    kind = input("Enter surrogate type (gp/pce): ").strip().lower() or 'gp'
+    n_train = int(input("Enter number of training samples: "))
+    n_samples = int(input("Enter number of Monte Carlo samples: "))
+    path = input("Enter file to save the surrogate to (leave empty to skip): ").strip()
+
+    means = np.array([R, r, t, E, nu, p_int, p_ext])
+    param_uncertainties = {
+        'R': 0.01*R, 'r': 0.01*r, 't': 0.05*t, 'E': 0.05*E, 'nu': 0.1*nu,
+        'p_int': 0.1*p_int, 'p_ext': 0.1*p_ext, 'yield_stress': 0.1*yield_stress
+    }
+    std = np.array([param_uncertainties[name] for name in torus_inputs])
+    bounds = np.column_stack((means - 4*std, means + 4*std))
+
+    surrogate = torus_stress_surrogate(bounds, T=T, model=model, kind=kind)
+    start = time.perf_counter()
+    surrogate.fit(n_train)
+    train_time = time.perf_counter() - start
+    errors = surrogate.validate(50 if model == 'fem' else 1000)
+
+    params = (R, r, t, E, nu, p_int, p_ext, 0, 0, 0, 0, 0, 0, T)
+    start = time.perf_counter()
+    mean_stress, std_stress, prob_failure = advanced_calculations.probabilistic_analysis(
+        *params, param_uncertainties, n_samples=n_samples, surrogate=surrogate)
+    mc_time = time.perf_counter() - start
+
+    print("\nSurrogate Model Results:")
+    print(f"Training: {n_train} {model} evaluations in {train_time:.3f} s")
+    print(f"Validation: RMS relative error {errors['rms_error']:.2e}, max {errors['max_error']:.2e}, "
+          f"fallback fraction {errors['fallback_fraction']:.1%}")
+    print(f"Monte Carlo with surrogate ({n_samples} samples, {mc_time:.3f} s):")
+    print(f"  Mean stress: {mean_stress:.4e}, std: {std_stress:.4e}, probability of failure: {prob_failure:.4e}")
+    if model == 'analytic':
+        start = time.perf_counter()
+        mean_direct, std_direct, prob_direct = advanced_calculations.probabilistic_analysis(
+            *params, param_uncertainties, n_samples=n_samples)
+        print(f"Monte Carlo with the true model ({time.perf_counter() - start:.3f} s):")
+        print(f"  Mean stress: {mean_direct:.4e}, std: {std_direct:.4e}, probability of failure: {prob_direct:.4e}")
+
+    if path:
+        surrogate.save(path)
+        print(f"Surrogate saved to {path}")
+
+    # Surrogate hit and fallback counts when instrumentation is enabled (TORUS_TRACE=1)
+    report()
+
+    input("\nPress Enter to return to the main menu...")
+
+def latin_hypercube(n, bounds, rng):
+    """n Latin hypercube samples inside bounds (d, 2)"""
+    bounds = np.asarray(bounds, dtype=float)
+    strata = rng.permuted(np.tile(np.arange(n), (len(bounds), 1)), axis=1).T
+    u = (strata + rng.random((n, len(bounds)))) / n
+    return bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0])
+
+def total_degree_indices(d, degree):
+    """Multi-indices (n_terms, d) of all polynomials in d variables up to total degree"""
+    return np.array([a for a in itertools.product(range(degree + 1), repeat=d) if sum(a) <= degree])
+
+def legendre_design_matrix(Z, indices):
+    """Orthonormal Legendre polynomials (n, n_terms) at points Z (n, d) in [-1, 1]"""
+    degrees = np.arange(indices.max() + 1)
+    P = np.stack([np.sqrt(2*k + 1) * eval_legendre(k, Z) for k in degrees])  # (degree + 1, n, d)
+    Phi = np.ones((len(Z), len(indices)))
+    for j in range(Z.shape[1]):
+        Phi *= P[indices[:, j], :, j].T
+    return Phi
+
+class PolynomialChaosModel:
+    """
+    Total-degree Legendre polynomial chaos expansion fitted by least squares.
+    The predictive standard deviation is that of ordinary regression: the
+    residual variance scaled by the leverage of the point.
+    """
+
+    def __init__(self, degree=3):
+        self.degree = degree
+
+    def fit(self, Z, y):
+        self.indices = total_degree_indices(Z.shape[1], self.degree)
+        if len(Z) <= len(self.indices):
+            raise ValueError(f"Degree {self.degree} in {Z.shape[1]} variables needs more than {len(self.indices)} samples, got {len(Z)}.")
+        Q, self.R_factor = np.linalg.qr(legendre_design_matrix(Z, self.indices))
+        self.coefficients = np.linalg.solve(self.R_factor, Q.T @ y)
+        residual = y - Q @ (Q.T @ y)
+        self.variance = np.sum(residual**2) / (len(Z) - len(self.indices))
+        return self
+
+    def predict(self, Z):
+        Phi = legendre_design_matrix(Z, self.indices)
+        leverage = np.sum(np.linalg.solve(self.R_factor.T, Phi.T)**2, axis=0)
+        return Phi @ self.coefficients, np.sqrt(self.variance * (1 + leverage))
+
+class GaussianProcessModel:
+    """scikit-learn Gaussian process with an anisotropic RBF kernel and a small noise term"""
+
+    def __init__(self, n_restarts=2, seed=None):
+        self.n_restarts = n_restarts
+        self.seed = seed
+
+    def fit(self, Z, y):
+        d = Z.shape[1]
+        kernel = ConstantKernel(1.0, (1e-3, 1e3)) * RBF(np.ones(d), (1e-2, 1e3)) + WhiteKernel(1e-8, (1e-12, 1e-2))
+        self.gp = GaussianProcessRegressor(kernel, normalize_y=True, n_restarts_optimizer=self.n_restarts,
+                                           random_state=self.seed)
+        with warnings.catch_warnings():
+            # Inputs the output hardly depends on drive their length scales to the bound
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            self.gp.fit(Z, y)
+        return self
+
+    def predict(self, Z):
+        return self.gp.predict(Z, return_std=True)
+
+class Surrogate:
+    """
+    Drop-in replacement for a batched model y = func(X), X (n, d) -> y (n,).
+
+    Inputs are scaled from bounds (d, 2) to [-1, 1] and a Gaussian process
+    (kind='gp') or polynomial chaos expansion (kind='pce') is trained on
+    Latin hypercube samples. Calling the surrogate predicts every row and
+    re-evaluates func for rows whose relative standard deviation exceeds
+    max_rel_std or that lie outside the training bounds. With log_output the
+    model is fitted to log(y), which suits positive outputs spanning a wide
+    range and makes the standard deviation a relative one directly.
+    """
+
+    def __init__(self, func, bounds, names=None, kind='gp', degree=3, max_rel_std=0.01, log_output=False, seed=None):
+        if kind not in ('gp', 'pce'):
+            raise ValueError(f"Unknown surrogate type '{kind}'. Choose 'gp' or 'pce'.")
+        self.func = func
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.active = self.bounds[:, 1] > self.bounds[:, 0]  # inputs with zero-width bounds are constants
+        self.names = tuple(names) if names is not None else tuple(f"x{i}" for i in range(len(self.bounds)))
+        self.kind = kind
+        self.degree = degree
+        self.max_rel_std = max_rel_std
+        self.log_output = log_output
+        self.rng = np.random.default_rng(seed)
+        self.X = np.empty((0, len(self.bounds)))
+        self.y = np.empty(0)
+        self.model = None
+
+    def scale(self, X):
+        """Map inputs to [-1, 1] over the training bounds (constant inputs to 0, or inf when they differ)"""
+        low, high = self.bounds.T
+        X = np.atleast_2d(X)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Z = (2*X - low - high) / (high - low)
+        return np.where(self.active, Z, np.where(X == low, 0.0, np.inf))
+
+    def fit(self, n_samples=200):
+        """Evaluate func at n_samples Latin hypercube points and train the model"""
+        return self.add_samples(latin_hypercube(n_samples, self.bounds, self.rng))
+
+    def add_samples(self, X, y=None):
+        """Add training points (evaluating func when y is not given) and retrain"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if y is None:
+            with span('surrogate.train_samples'):
+                y = np.asarray(self.func(X), dtype=float)
+            count('surrogate.true_evaluations', len(X))
+        self.X = np.vstack((self.X, X))
+        self.y = np.concatenate((self.y, y))
+        if self.log_output and np.any(self.y <= 0):
+            raise ValueError("log_output requires positive model outputs.")
+        with span('surrogate.train'):
+            target = np.log(self.y) if self.log_output else self.y
+            model = GaussianProcessModel(seed=int(self.rng.integers(2**31))) if self.kind == 'gp' else PolynomialChaosModel(self.degree)
+            self.model = model.fit(self.scale(self.X)[:, self.active], target)
+        return self
+
+    def predict(self, X):
+        """Surrogate mean (n,) and relative standard deviation (n,) without any fallback"""
+        if self.model is None:
+            raise RuntimeError("The surrogate has not been trained; call fit() first.")
+        mean, std = self.model.predict(self.scale(X)[:, self.active])
+        if self.log_output:
+            return np.exp(mean), std
+        return mean, std / np.maximum(np.abs(mean), np.finfo(float).tiny)
+
+    def uncertain(self, X, rel_std):
+        """Rows outside the training bounds or with too large a predicted deviation"""
+        outside = np.any(np.abs(self.scale(X)) > 1 + 1e-9, axis=1)
+        return outside | (rel_std > self.max_rel_std)
+
+    def __call__(self, X):
+        """Predictions (n,) with the true model evaluated where the surrogate is unsure"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        with span('surrogate.predict'):
+            y, rel_std = self.predict(X)
+        fallback = np.flatnonzero(self.uncertain(X, rel_std))
+        if len(fallback):
+            with span('surrogate.fallback'):
+                y[fallback] = self.func(X[fallback])
+        count('surrogate.predictions', len(X) - len(fallback))
+        count('surrogate.fallbacks', len(fallback))
+        return y
+
+    def validate(self, n_samples=200):
+        """Relative errors of the surrogate mean against func at fresh samples inside the bounds"""
+        X = latin_hypercube(n_samples, self.bounds, self.rng)
+        y_true = np.asarray(self.func(X), dtype=float)
+        y, rel_std = self.predict(X)
+        error = np.abs(y - y_true) / np.maximum(np.abs(y_true), np.finfo(float).tiny)
+        return {
+            'rms_error': float(np.sqrt(np.mean(error**2))),
+            'max_error': float(np.max(error)),
+            'mean_rel_std': float(np.mean(rel_std)),
+            'fallback_fraction': float(np.mean(self.uncertain(X, rel_std)))
+        }
+
+    def save(self, path):
+        """Pickle the surrogate, training data and true model (func must be picklable)"""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        """Load a surrogate saved with save(); only load files from trusted sources"""
+        with open(path, 'rb') as f:
+            surrogate = pickle.load(f)
+        if not isinstance(surrogate, Surrogate):
+            raise TypeError(f"{path} does not contain a Surrogate.")
+        return surrogate
+
+def torus_max_stress(X, F_x=0, F_y=0, F_z=0, M_x=0, M_y=0, M_z=0, T=0):
+    """Von Mises stress at theta = phi = 0, as used by probabilistic_analysis, for rows (R, r, t, E, nu, p_int, p_ext)"""
+    X = np.atleast_2d(X)
+    sigma_vm, _, _ = calculate_torus_stresses(*X.T, F_x, F_y, F_z, M_x, M_y, M_z, T, 0, 0)
+    return np.broadcast_to(sigma_vm, len(X)).astype(float)
+
+def fem_max_stress(X, n_elements=8):
+    """Peak nodal von Mises stress of the 3D FEM pressure model for rows (R, r, t, E, nu, p_int, p_ext)"""
+    from modules.fem_3d_analysis import (assemble_system, generate_torus_mesh, recover_nodal_stresses,
+                                         rigid_body_constraints, solve_system, von_mises)
+    X = np.atleast_2d(X)
+    peak = np.empty(len(X))
+    for i, (R, r, t, E, nu, p_int, p_ext) in enumerate(X):
+        nodes, elements = generate_torus_mesh(R, r, t, n_elements)
+        K, F = assemble_system(nodes, elements, E, nu, p_int, p_ext)
+        U = solve_system(K, F, rigid_body_constraints(nodes))
+        peak[i] = np.max(von_mises(recover_nodal_stresses(nodes, elements, U, E, nu)))
+    return peak
+
+def torus_stress_surrogate(bounds, F_x=0, F_y=0, F_z=0, M_x=0, M_y=0, M_z=0, T=0, model='analytic', n_elements=8, **kwargs):
+    """
+    Untrained surrogate of the torus von Mises stress over (R, r, t, E, nu,
+    p_int, p_ext) within bounds (7, 2). model='analytic' wraps
+    calculate_torus_stresses with the given fixed loads; model='fem' wraps the
+    peak stress of the 3D FEM pressure model (forces, moments and T ignored).
+    """
+    if model == 'analytic':
+        func = functools.partial(torus_max_stress, F_x=F_x, F_y=F_y, F_z=F_z, M_x=M_x, M_y=M_y, M_z=M_z, T=T)
+    elif model == 'fem':
+        func = functools.partial(fem_max_stress, n_elements=n_elements)
+    else:
+        raise ValueError(f"Unknown model '{model}'. Choose 'analytic' or 'fem'.")
+    return Surrogate(func, bounds, names=torus_inputs, log_output=True, **kwargs)
+
+if __name__ == "__main__":
+    # This allows the module to be run standalone for testing
+    from main import calculate_torus_stresses, fatigue_analysis
+    from modules import advanced_calculations
+    from visualization import create_advanced_animation
+    run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation)
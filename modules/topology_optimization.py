@@ -0,0 +1,255 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, diags
+from scipy.sparse.linalg import splu
+from sklearn.neighbors import KDTree
+from modules.fem_3d_analysis import (element_b_matrices, element_dofs, element_stiffness_matrices, elasticity_matrix,
+                                     generate_torus_mesh, pressure_loads)
+from modules.instrumentation import count, report, span, traced
+
+def run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation):
+    print("Topology Optimization")
+
+    # Get user input for parameters
+    R = float(input("Enter major radius (R): "))
+    r = float(input("Enter minor radius (r): "))
+    t = float(input("Enter thickness (t): "))
+    E = float(input("Enter Young's modulus (E): "))
+    nu = float(input("Enter Poisson's ratio (nu): "))
+    p_int = float(input("Enter internal pressure (p_int): "))
+    F_z = float(input("Enter vertical point load on the crown (F_z, negative pushes down): "))
+    n_elements = int(input("Enter number of elements: "))
+    volume_fraction = float(input("Enter volume fraction to keep, of the design elements (the solid inner layer under pressure is excluded) (e.g. 0.5): "))
+    max_iter = int(input("Enter maximum number of iterations: ") or 50)
+
+    optimizer = torus_topology_optimization(R, r, t, E, nu, p_int, F_z, n_elements, volume_fraction)
+
+    # Finite-difference check of the sensitivities at the starting design on a few design elements
+    x0 = np.where(optimizer.passive, 1.0, volume_fraction)
+    sample = np.flatnonzero(~optimizer.passive)[::max(1, np.count_nonzero(~optimizer.passive) // 3)][:3]
+    dc, dc_fd, dv, dv_fd = optimizer.check_gradients(x0, sample)
+    print(f"Gradient check: compliance {np.max(np.abs(dc - dc_fd) / np.abs(dc_fd)):.1e}, "
+          f"volume {np.max(np.abs(dv - dv_fd) / np.abs(dv_fd)):.1e} (max relative error)")
+
+    result = optimizer.optimize(max_iter=max_iter)
+    history = result['history']
+
+    print("\nTopology Optimization Results:")
+    print(f"Iterations: {len(history)} ({'converged' if result['converged'] else 'not converged'})")
+    print(f"Compliance: {history[0]['compliance']:.4e} (iteration 1) -> {history[-1]['compliance']:.4e}")
+    print(f"Design volume fraction: {history[-1]['volume']:.3f}, passive elements: {np.mean(optimizer.passive):.1%}, "
+          f"elements with density > 0.5: {np.mean(result['density'] > 0.5):.1%}")
+
+    # Mean density around the tube cross-section (phi, averaged over theta)
+    centre = np.mean(optimizer.nodes[optimizer.elements], axis=1)
+    phi = np.arctan2(centre[:, 2], np.hypot(centre[:, 0], centre[:, 1]) - R)
+    bins = np.linspace(-np.pi, np.pi, 9)
+    index = np.clip(np.digitize(phi, bins) - 1, 0, 7)
+    for b in range(8):
+        print(f"phi {np.degrees(bins[b]):6.1f} to {np.degrees(bins[b + 1]):6.1f} deg: mean density {np.mean(result['density'][index == b]):.3f}")
+
+    # Stage timings when instrumentation is enabled (TORUS_TRACE=1)
+    report()
+
+    input("\nPress Enter to return to the main menu...")
+
+def density_filter(centroids, radius, weights=None):
+    """
+    Sparse row-normalized density filter (n_elements, n_elements) with linear
+    hat weights max(0, radius - distance), optionally times per-element
+    weights such as the volume (zero weights leave an element out of its
+    neighbours' averages). Neighbours come from one KDTree radius query.
+    """
+    neighbours, distances = KDTree(centroids).query_radius(centroids, r=radius, return_distance=True)
+    rows = np.repeat(np.arange(len(centroids)), [len(n) for n in neighbours])
+    cols = np.concatenate(neighbours)
+    values = np.maximum(radius - np.concatenate(distances), 0)
+    if weights is not None:
+        values = values * weights[cols]
+    H = coo_matrix((values, (rows, cols)), shape=(len(centroids),) * 2).tocsr()
+    total = np.asarray(H.sum(axis=1))
+    return csr_matrix(H.multiply(1 / np.where(total > 0, total, 1)))
+
+class TopologyOptimizer:
+    """
+    SIMP minimum-compliance topology optimization on a hexahedral mesh.
+
+    Element stiffness is (E_min + x^penal (E - E_min)) k0_e with k0_e the
+    unit-modulus element matrix, computed once. The constrained stiffness
+    matrix data is a fixed sparse matrix times the element moduli, so each
+    iteration assembles with one sparse product, factors once and solves
+    once. Compliance is self-adjoint (the adjoint solution is -U), so the
+    sensitivities -penal x^(penal-1) (E - E_min) u_e^T k0_e u_e reuse the
+    same solve. Densities go through the density filter and are updated with
+    optimality criteria under a volume constraint on the design elements:
+    passive elements are solid and outside the volume fraction. Loads are
+    design independent.
+    """
+
+    def __init__(self, nodes, elements, E, nu, F, fixed_dofs, volume_fraction=0.5, penal=3.0, filter_radius=None,
+                 E_min_ratio=1e-9, move=0.2, passive=None):
+        if not 0 < volume_fraction <= 1:
+            raise ValueError(f"volume_fraction must be in (0, 1], got {volume_fraction}")
+        self.nodes, self.elements = nodes, elements
+        self.E, self.E_min = E, E * E_min_ratio
+        self.F, self.volume_fraction, self.penal, self.move = np.asarray(F, dtype=float), volume_fraction, penal, move
+        n_dofs, n_elements = 3 * len(nodes), len(elements)
+        self.passive = np.zeros(n_elements, dtype=bool) if passive is None else np.asarray(passive, dtype=bool)
+
+        with span('topology.setup'):
+            self.k0 = element_stiffness_matrices(nodes, elements, elasticity_matrix(1.0, nu))
+            _, det_J = element_b_matrices(nodes, elements)
+            self.volumes = np.sum(np.abs(det_J), axis=1)  # unit Gauss weights
+            centroids = np.mean(nodes[elements], axis=1)
+            if filter_radius is None:
+                # 1.5 times the typical shorter in-surface edge, so elongated elements still see their neighbours
+                edges = np.linalg.norm(nodes[elements[:, [3, 4]]] - nodes[elements[:, [0]]], axis=2)
+                filter_radius = 1.5 * np.median(np.min(edges, axis=1))
+            # Passive elements are solid by definition and are left out of the design densities
+            self.filter = density_filter(centroids, filter_radius, self.volumes * ~self.passive)
+            # physical() overrides the passive rows, so derivatives with respect to x go through the design rows only
+            self.design_filter = csr_matrix(diags((~self.passive).astype(float)) @ self.filter)
+
+            # Map element matrix entries between free DOFs to the data of the constrained CSR matrix
+            self.dofs = element_dofs(elements)
+            self.free = np.setdiff1d(np.arange(n_dofs), fixed_dofs)
+            free_index = np.full(n_dofs, -1)
+            free_index[self.free] = np.arange(len(self.free))
+            rows = np.repeat(free_index[self.dofs], 24, axis=1).ravel()
+            cols = np.tile(free_index[self.dofs], (1, 24)).ravel()
+            keep = (rows >= 0) & (cols >= 0)
+            keys, position = np.unique(rows[keep] * len(self.free) + cols[keep], return_inverse=True)
+            entry_element = np.repeat(np.arange(n_elements), 24 * 24)[keep]
+            self.assembly = coo_matrix((self.k0.reshape(-1)[keep], (position.ravel(), entry_element)),
+                                       shape=(len(keys), n_elements)).tocsr()
+            pattern_rows, self.pattern_cols = np.divmod(keys, len(self.free))
+            self.pattern_indptr = np.concatenate(([0], np.cumsum(np.bincount(pattern_rows, minlength=len(self.free)))))
+
+    def stiffness(self, moduli):
+        """Constrained stiffness matrix (CSC) for element moduli"""
+        K = csr_matrix((self.assembly @ moduli, self.pattern_cols, self.pattern_indptr), shape=(len(self.free),) * 2)
+        return K.tocsc()
+
+    def analyse(self, density):
+        """Displacements, compliance and compliance sensitivities for physical densities"""
+        moduli = self.E_min + density**self.penal * (self.E - self.E_min)
+        with span('topology.solve'):
+            lu = splu(self.stiffness(moduli), permc_spec='MMD_AT_PLUS_A')
+            U = np.zeros(3 * len(self.nodes))
+            U[self.free] = lu.solve(self.F[self.free])
+        count('topology.solves')
+        u_e = U[self.dofs]
+        energy = np.einsum('ei,eij,ej->e', u_e, self.k0, u_e)
+        compliance = np.dot(self.F, U)
+        sensitivity = -self.penal * density**(self.penal - 1) * (self.E - self.E_min) * energy
+        return U, compliance, sensitivity
+
+    def physical(self, x):
+        """Filtered densities with passive elements kept solid"""
+        density = self.filter @ x
+        density[self.passive] = 1.0
+        return density
+
+    def design_gradients(self, sensitivity):
+        """
+        Compliance and volume derivatives with respect to the design variables
+        x from physical-density sensitivities (chain rule through the filter).
+        """
+        return self.design_filter.T @ sensitivity, self.design_filter.T @ self.volumes
+
+    def check_gradients(self, x, elements, step=1e-6):
+        """
+        Analytic and central finite-difference derivatives of compliance and
+        volume with respect to x at the given elements. Returns
+        (dc, dc_fd, dv, dv_fd), each of shape (len(elements),).
+        """
+        x = np.asarray(x, dtype=float)
+        _, _, sensitivity = self.analyse(self.physical(x))
+        dc, dv = self.design_gradients(sensitivity)
+        dc_fd, dv_fd = np.empty(len(elements)), np.empty(len(elements))
+        for i, e in enumerate(elements):
+            values = []
+            for sign in (1, -1):
+                x_step = x.copy()
+                x_step[e] += sign * step
+                density = self.physical(x_step)
+                values.append((self.analyse(density)[1], np.dot(self.volumes, density)))
+            dc_fd[i] = (values[0][0] - values[1][0]) / (2 * step)
+            dv_fd[i] = (values[0][1] - values[1][1]) / (2 * step)
+        return dc[elements], dc_fd, dv[elements], dv_fd
+
+    def design_volume(self, density):
+        """Volume fraction of the design (non-passive) elements for physical densities"""
+        design = ~self.passive
+        return np.dot(self.volumes[design], density[design]) / np.sum(self.volumes[design])
+
+    def oc_update(self, x, sensitivity, dv):
+        """Optimality criteria step with bisection on the volume multiplier (derivatives with respect to x)"""
+        design = ~self.passive
+        dv = dv[design]
+        dc = np.minimum(sensitivity[design], 0)
+        lower, upper = np.maximum(0.0, x[design] - self.move), np.minimum(1.0, x[design] + self.move)
+        # At the upper multiplier every design variable is pushed to its lower move limit
+        low, high = 0.0, 1e6 * np.max(-dc / dv) + np.finfo(float).tiny
+        x_new = x
+        while (high - low) / (high + low) > 1e-4:
+            mid = 0.5 * (low + high)
+            x_new = x.copy()
+            x_new[design] = np.clip(x[design] * np.sqrt(-dc / (mid * dv)), lower, upper)
+            if self.design_volume(self.physical(x_new)) > self.volume_fraction:
+                low = mid
+            else:
+                high = mid
+        return x_new
+
+    @traced('topology.optimize')
+    def optimize(self, max_iter=50, tol=0.01, x0=None):
+        """
+        OC iterations until the largest density change drops below tol with
+        the design volume fraction at most tol above its target. Returns the
+        physical densities, the design variables, the final displacements and
+        a history of compliance, design volume fraction and change.
+        """
+        x = np.full(len(self.elements), self.volume_fraction) if x0 is None else np.asarray(x0, dtype=float).copy()
+        x[self.passive] = 1.0
+        history, converged = [], False
+        for _ in range(max_iter):
+            density = self.physical(x)
+            U, compliance, sensitivity = self.analyse(density)
+            sensitivity, dv = self.design_gradients(sensitivity)
+            x_new = self.oc_update(x, sensitivity, dv)
+            change = np.max(np.abs(x_new - x))
+            history.append({'compliance': compliance, 'volume': self.design_volume(density), 'change': change})
+            count('topology.iterations')
+            x = x_new
+            if change < tol and self.design_volume(self.physical(x)) <= self.volume_fraction + tol:
+                converged = True
+                break
+        density = self.physical(x)
+        return {'density': density, 'x': x, 'U': U, 'history': history, 'converged': converged}
+
+def torus_topology_optimization(R, r, t, E, nu, p_int, F_z, n, volume_fraction=0.5, **options):
+    """
+    Optimizer for a torus resting on its lowest nodes with a vertical point
+    load F_z on the crown at theta = 0, plus internal pressure. With pressure,
+    the inner layer of elements carries it and is kept solid; volume_fraction
+    applies to the remaining design elements.
+    """
+    nodes, elements = generate_torus_mesh(R, r, t, n)
+    z = nodes[:, 2]
+    top, bottom = np.flatnonzero(np.isclose(z, z.max())), np.flatnonzero(np.isclose(z, z.min()))
+    crown = top[np.argmin(np.abs(np.arctan2(nodes[top, 1], nodes[top, 0])))]
+    F = pressure_loads(nodes, elements, p_int, 0)
+    F[3 * crown + 2] += F_z
+    fixed_dofs = (3 * bottom[:, np.newaxis] + np.arange(3)).ravel()
+    passive = None
+    if p_int != 0:
+        # Elements whose first-layer face is the inner surface (two elements through the thickness)
+        passive = np.arange(len(elements)) % 2 == 0
+    return TopologyOptimizer(nodes, elements, E, nu, F, fixed_dofs, volume_fraction, passive=passive, **options)
+
+if __name__ == "__main__":
+    # This allows the module to be run standalone for testing
+    from main import calculate_torus_stresses, fatigue_analysis
+    from modules import advanced_calculations
+    from visualization import create_advanced_animation
+    run_analysis(calculate_torus_stresses, fatigue_analysis, advanced_calculations, create_advanced_animation)
@@ -1,21 +1,27 @@
+import os
+import subprocess
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.figure import Figure
 from mpl_toolkits.mplot3d import Axes3D
 
-def create_advanced_animation(variables, failure_criteria, calculate_torus_stresses, fatigue_analysis):
+def create_advanced_animation(variables, failure_criteria, calculate_torus_stresses, fatigue_analysis, n_frames=100, n_grid=100, output=None, dpi=100, figsize=(16, 8), fps=20, max_points=10000):
     R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, N_cycles, S_ut, yield_stress, n, T_inner, T_outer, rho, omega, K_IC = [v[1] for v in variables]
-    
-    theta = np.linspace(0, 2*np.pi, 100)
-    phi = np.linspace(0, 2*np.pi, 100)
+
+    theta = np.linspace(0, 2*np.pi, n_grid)
+    phi = np.linspace(0, 2*np.pi, n_grid)
     theta, phi = np.meshgrid(theta, phi)
-    
+
     x = (R + r*np.cos(theta)) * np.cos(phi)
     y = (R + r*np.cos(theta)) * np.sin(phi)
     z = r * np.sin(theta)
-    
+
     sigma_vm, sigma_phi, sigma_theta = calculate_torus_stresses(R, r, t, E, nu, p_int, p_ext, F_x, F_y, F_z, M_x, M_y, M_z, T, theta, phi)
-    
+
     # Calculate fatigue damage
     sigma_max = np.max(sigma_vm)
     sigma_min = np.min(sigma_vm)
@@ -26,48 +32,274 @@ def create_advanced_animation(variables, failure_criteria, calculate_torus_stres
         damage_str = "Inf" if np.isinf(damage) else "NaN"
     else:
         damage_str = f"{damage:.4f}"
-    
-    fig = plt.figure(figsize=(16, 8))
+
+    if output is None:
+        fig = plt.figure(figsize=figsize)
+    else:
+        # Offscreen rendering: no pyplot state and no GUI backend involved
+        fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(fig)
+
+    update, redraw = build_stress_animation(fig, x, y, z, theta, sigma_vm, sigma_phi, sigma_theta, damage, failure_criteria, n_frames, max_points=max_points)
+
+    if output is None:
+        # The 3D axes must be redrawn every frame (and may be rotated), so the interactive view is not blitted
+        anim = FuncAnimation(fig, update, frames=n_frames, interval=50, blit=False)
+        plt.tight_layout()
+        plt.show()
+    else:
+        fig.tight_layout()
+        return save_animation(fig, update, n_frames, output, fps, redraw)
+
+def build_stress_animation(fig, x, y, z, theta, sigma_vm, sigma_phi, sigma_theta, damage, failure_criteria, n_frames, n_levels=16, n_depths=4, max_points=None):
+    """
+    Create every artist once and return a frame update function that only
+    changes artist data, together with the axes that must be redrawn in full
+    every frame (the 3D axes). The update returns the changed 2D artists,
+    which are the only ones that can be blitted.
+
+    The 3D points are drawn as one single-colour marker artist per (depth slab,
+    colour level), which renders far faster than a scatter with per-point
+    colours. Slabs are ordered back to front for the current view, and are
+    regrouped when the view is rotated. Points are sorted by stress, so the
+    points above a threshold are a slice of each artist's data. With
+    max_points set, the points are first decimated with decimate_points so
+    large fields keep their hotspots within the budget.
+    """
     ax1 = fig.add_subplot(121, projection='3d')
     ax2 = fig.add_subplot(122)
     ax3 = ax2.twinx()
-    
+
     cmap = plt.get_cmap('viridis')
     norm = plt.Normalize(vmin=np.min(sigma_vm), vmax=np.max(sigma_vm))
-    
+
+    ax1.set_xlabel('X')
+    ax1.set_ylabel('Y')
+    ax1.set_zlabel('Z')
+    ax1.set_title('Torus Stress Visualization')
+    ax1.grid(True)
+    ax1.set_xlim(np.min(x), np.max(x))
+    ax1.set_ylim(np.min(y), np.max(y))
+    ax1.set_zlim(np.min(z), np.max(z))
+
+    all_points = np.stack((x.ravel(), y.ravel(), z.ravel()))
+    all_values = sigma_vm.ravel()
+    if max_points is not None:
+        keep = decimate_points(all_points.T, all_values, max_points)
+        all_points, all_values = all_points[:, keep], all_values[keep]
+    all_levels = np.minimum((np.clip(norm(all_values), 0, 1) * n_levels).astype(int), n_levels - 1)
+
+    def group(view):
+        """Points, values and group bounds sorted by (depth slab for the view, level, stress)"""
+        elev, azim = np.radians(view)
+        eye = np.array([np.cos(elev) * np.cos(azim), np.cos(elev) * np.sin(azim), np.sin(elev)])
+        depth = np.searchsorted(np.quantile(eye @ all_points, np.linspace(0, 1, n_depths + 1)[1:-1]), eye @ all_points)
+        group = depth * n_levels + all_levels
+        order = np.lexsort((all_values, group))
+        bounds = np.searchsorted(group[order], np.arange(n_depths * n_levels + 1))
+        return view, all_points[:, order], all_values[order], bounds
+
+    state = [group((ax1.elev, ax1.azim))]
+
+    level_artists = []
+    for g in range(n_depths * n_levels):
+        artist, = ax1.plot([], [], [], linestyle='', marker='o', markersize=np.sqrt(20), markeredgewidth=0,
+                           color=cmap((g % n_levels + 0.5) / n_levels))
+        level_artists.append(artist)
+    fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=ax1, label='von Mises Stress (Pa)')
+
+    ax2.plot(theta[0], sigma_vm[:, 0], label='von Mises', color='#1f77b4')
+    ax2.plot(theta[0], sigma_phi[:, 0], label='Hoop', color='#ff7f0e')
+    ax2.plot(theta[0], sigma_theta[:, 0], label='Meridional', color='#2ca02c')
+    threshold_line = ax2.axhline(0, color='#7f7f7f', linestyle=':', label='Threshold')
+    ax2.set_xlabel('Theta (radians)')
+    ax2.set_ylabel('Stress (Pa)')
+    ax2.set_title('Stress Distribution')
+    ax2.legend(loc='upper left')
+    ax2.grid(True)
+
+    ax3.plot(theta[0], np.full_like(theta[0], damage), label='Damage', color='#d62728', linestyle='--')
+    ax3.set_ylabel('Damage')
+    ax3.legend(loc='upper right')
+
     def update(frame):
-        ax1.clear()
-        ax2.clear()
-        ax3.clear()
-        
-        ax1.set_xlabel('X')
-        ax1.set_ylabel('Y')
-        ax1.set_zlabel('Z')
-        ax1.set_title('Torus Stress Visualization')
-        ax1.grid(True)
-        
-        threshold = failure_criteria * (frame + 1) / 100
-        mask = sigma_vm > threshold
-        
-        scatter = ax1.scatter(x[mask], y[mask], z[mask], c=sigma_vm[mask], cmap=cmap, norm=norm)
-        if frame == 0:
-            fig.colorbar(scatter, ax=ax1, label='von Mises Stress (Pa)')
-        
-        ax2.plot(theta[0], sigma_vm[:, 0], label='von Mises', color='#1f77b4')
-        ax2.plot(theta[0], sigma_phi[:, 0], label='Hoop', color='#ff7f0e')
-        ax2.plot(theta[0], sigma_theta[:, 0], label='Meridional', color='#2ca02c')
-        ax2.set_xlabel('Theta (radians)')
-        ax2.set_ylabel('Stress (Pa)')
-        ax2.set_title('Stress Distribution')
-        ax2.legend(loc='upper left')
-        ax2.grid(True)
-        
-        ax3.plot(theta[0], np.full_like(theta[0], damage), label='Damage', color='#d62728', linestyle='--')
-        ax3.set_ylabel('Damage')
-        ax3.legend(loc='upper right')
-        
-        return scatter,
-    
-    anim = FuncAnimation(fig, update, frames=100, interval=50, blit=False)
-    plt.tight_layout()
-    plt.show()
+        if state[0][0] != (ax1.elev, ax1.azim):
+            state[0] = group((ax1.elev, ax1.azim))
+        _, points, values, bounds = state[0]
+        threshold = failure_criteria * (frame + 1) / n_frames
+        for g, artist in enumerate(level_artists):
+            start = bounds[g] + np.searchsorted(values[bounds[g]:bounds[g+1]], threshold, side='right')
+            visible = points[:, start:bounds[g+1]]
+            artist.set_data_3d(visible[0], visible[1], visible[2])
+        threshold_line.set_ydata([threshold, threshold])
+        return [threshold_line]
+
+    return update, [ax1]
+
+def render_frames(fig, update, n_frames, redraw=()):
+    """
+    Yield each frame as an RGBA array rendered offscreen.
+    The static parts of the figure are drawn once; every frame restores that
+    background, redraws the axes in redraw (such as 3D axes) in full and
+    blits only the 2D artists returned by update.
+    """
+    animated = update(0)
+    for artist in animated:
+        artist.set_animated(True)
+    for ax in redraw:
+        ax.set_visible(False)
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    for ax in redraw:
+        ax.set_visible(True)
+
+    for frame in range(n_frames):
+        canvas.restore_region(background)
+        animated = update(frame)
+        for ax in redraw:
+            fig.draw_artist(ax)
+        for artist in animated:
+            artist.axes.draw_artist(artist)
+        yield np.asarray(canvas.buffer_rgba())
+
+def save_animation(fig, update, n_frames, output, fps=20, redraw=()):
+    """
+    Render frames offscreen and write them to output.
+    .mp4/.mkv/.avi files are encoded by piping raw frames to ffmpeg when it is
+    available; anything else is treated as a directory for a PNG sequence.
+    If ffmpeg is missing or fails, the frames are written as a PNG sequence
+    next to output instead. Returns the list of written paths.
+    """
+    extension = os.path.splitext(output)[1].lower()
+
+    if extension in ('.mp4', '.mkv', '.avi'):
+        ffmpeg = matplotlib.rcParams['animation.ffmpeg_path']
+        width, height = fig.canvas.get_width_height()
+        try:
+            process = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                                        '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                                        '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', output],
+                                       stdin=subprocess.PIPE)
+        except FileNotFoundError:
+            print("ffmpeg not found, writing a PNG sequence instead")
+        else:
+            try:
+                for frame in render_frames(fig, update, n_frames, redraw):
+                    process.stdin.write(frame.tobytes())
+                process.stdin.close()
+            except BrokenPipeError:
+                pass  # ffmpeg exited early; its return code says why
+            if process.wait() == 0:
+                return [output]
+            print(f"ffmpeg failed with exit code {process.returncode}, writing a PNG sequence instead")
+        output = os.path.splitext(output)[0]
+
+    frames = render_frames(fig, update, n_frames, redraw)
+    os.makedirs(output, exist_ok=True)
+    paths = []
+    for i, frame in enumerate(frames):
+        path = os.path.join(output, f"frame_{i:04d}.png")
+        plt.imsave(path, frame, pil_kwargs={'compress_level': 1})
+        paths.append(path)
+    return paths
+
+def adaptive_indices(values, axis, n_keep, uniform_weight=0.5):
+    """
+    Pick at most n_keep (and at least 2) indices along one axis of a gridded
+    field, denser where the field changes fastest. Half of the spacing budget
+    (uniform_weight) is spread evenly, the rest follows the largest gradient
+    across the other axis. The first and last index are always kept.
+    """
+    n = values.shape[axis]
+    if n_keep >= n:
+        return np.arange(n)
+    gradient = np.max(np.abs(np.diff(values, axis=axis)), axis=1 - axis)
+    gradient = gradient / max(np.sum(gradient), np.finfo(float).tiny)
+    density = uniform_weight / (n - 1) + (1 - uniform_weight) * gradient
+    cumulative = np.concatenate(([0.0], np.cumsum(density)))
+    cumulative /= cumulative[-1]
+    # Samples that land on the same index collapse, so ask for more until the budget is used
+    n_samples = n_keep
+    for _ in range(8):
+        indices = np.unique(np.searchsorted(cumulative, np.linspace(0, 1, n_samples), side='left').clip(0, n - 1))
+        if len(indices) >= n_keep:
+            break
+        n_samples += n_keep - len(indices)
+    if len(indices) > n_keep:
+        # The last round can overshoot: drop the interior indices next to the flattest intervals
+        weight = density[np.maximum(indices - 1, 0)] + density[np.minimum(indices, n - 2)]
+        weight[[0, -1]] = np.inf
+        indices = np.sort(indices[np.argsort(-weight, kind='stable')[:max(n_keep, 2)]])
+    return indices
+
+def pool_blocks(values, rows, cols, reducer='max'):
+    """
+    Reduce every block [rows[i]:rows[i+1], cols[j]:cols[j+1]] of a grid to one
+    value, so peaks inside a coarse face survive decimation. 'absmax' keeps the
+    signed value with the largest magnitude.
+    """
+    high = np.maximum.reduceat(np.maximum.reduceat(values, rows, axis=0), cols, axis=1)
+    if reducer == 'max':
+        return high
+    low = np.minimum.reduceat(np.minimum.reduceat(values, rows, axis=0), cols, axis=1)
+    return np.where(np.abs(low) > np.abs(high), low, high)
+
+def decimate_surface(x, y, z, values, max_vertices, reducer='max'):
+    """
+    Level-of-detail version of a gridded surface with at most max_vertices
+    vertices (but never fewer than 2x2).
+
+    Rows and columns are kept adaptively (denser at steep gradients) and each
+    coarse face takes the pooled value of the fine block it covers, so stress
+    peaks are preserved. Returns the coarse x, y, z and values together with
+    the kept row and column indices into the full-resolution arrays.
+    """
+    n_rows, n_cols = values.shape
+    if n_rows * n_cols <= max_vertices:
+        rows, cols = np.arange(n_rows), np.arange(n_cols)
+        return x, y, z, values, rows, cols
+    scale = np.sqrt(max_vertices / (n_rows * n_cols))
+    rows = adaptive_indices(values, 0, max(2, int(n_rows * scale)))
+    cols = adaptive_indices(values, 1, max(2, int(n_cols * scale)))
+    grid = np.ix_(rows, cols)
+    return x[grid], y[grid], z[grid], pool_blocks(values, rows, cols, reducer), rows, cols
+
+def decimate_points(points, values, max_points, n_hotspots=None):
+    """
+    Indices of at most max_points points (n, 3) that keep the peaks of values.
+
+    The highest n_hotspots values (1% of the budget by default) are always kept;
+    the remaining budget is filled with the highest-valued point of each cell
+    of a voxel grid sized so the number of occupied cells fits. The indices
+    refer to the full-resolution arrays, which stay available for queries.
+    """
+    n = len(points)
+    if n <= max_points:
+        return np.arange(n)
+    if n_hotspots is None:
+        n_hotspots = max(1, max_points // 100)
+    hotspots = np.argpartition(values, n - n_hotspots)[n - n_hotspots:]
+    budget = max_points - n_hotspots
+
+    lower = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lower, np.finfo(float).tiny)
+    by_value = np.argsort(-values, kind='stable')
+
+    def voxel_representatives(cells):
+        key = np.floor((points[by_value] - lower) / extent * (cells - 1e-9)).astype(np.int64)
+        key = (key[:, 0] * cells + key[:, 1]) * cells + key[:, 2]
+        _, first = np.unique(key, return_index=True)
+        return by_value[first]
+
+    # Largest voxel grid whose occupied cells fit the budget
+    lo, hi = 1, max(2, int(np.ceil(budget ** 0.5)) * 4)
+    chosen = voxel_representatives(lo)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        candidate = voxel_representatives(mid)
+        if len(candidate) <= budget:
+            lo, chosen = mid, candidate
+        else:
+            hi = mid
+    return np.union1d(chosen, hotspots)